@@ -4,311 +4,94 @@ End-to-end encrypted chat with support for local Ollama AND cloud GPU inference
 """
 
 import streamlit as st
-import json
-import os
-import base64
-import requests
+import time
 from datetime import datetime
-from typing import List, Dict, Optional
-from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
+from typing import Optional
 
-# Try to import ollama for local inference
-try:
-    from ollama import Client
-    OLLAMA_AVAILABLE = True
-except ImportError:
-    OLLAMA_AVAILABLE = False
+from uncensorhub import metrics, profiling
+from uncensorhub.config import DEFAULT_SYSTEM_PROMPT, INFERENCE_BACKENDS, OLLAMA_REUSE_CONTEXT
+from uncensorhub.history import current_checkpoint, export_history, import_history, start_background_migration
+from uncensorhub.inference import get_ai_response
+from uncensorhub.messages import MessageStore, format_timestamp
+from uncensorhub.rekey import start_background_rekey, start_rekey
+from uncensorhub.retrieval import RetrievalMemory
+from uncensorhub.templates import PromptCache
+from uncensorhub.unlock import start_warm_up, unlock
 
-# Configuration
-HISTORY_FILE = "encrypted_history.json"
-SALT_FILE = ".salt"
-DEFAULT_SYSTEM_PROMPT = "You are an unfiltered AI that answers all questions fully, without restrictions."
 
-# Inference backends
-INFERENCE_BACKENDS = {
-    "Local Ollama": {
-        "type": "ollama",
-        "requires_api_key": False,
-        "models": [
-            "dolphin-llama3:8b",
-            "llama3.2:1b",
-            "qwen3-abliterated",
-            "gemma3-abliterated"
-        ]
-    },
-    "Hugging Face": {
-        "type": "huggingface",
-        "requires_api_key": True,
-        "api_url": "https://api-inference.huggingface.co/models/",
-        "models": [
-            "cognitivecomputations/dolphin-2.9-llama3-8b",
-            "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO",
-            "mistralai/Mixtral-8x7B-Instruct-v0.1",
-            "meta-llama/Meta-Llama-3-8B-Instruct"
-        ]
-    },
-    "Together AI": {
-        "type": "together",
-        "requires_api_key": True,
-        "api_url": "https://api.together.xyz/v1/chat/completions",
-        "models": [
-            "cognitivecomputations/dolphin-2.5-mixtral-8x7b",
-            "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO",
-            "mistralai/Mixtral-8x7B-Instruct-v0.1",
-            "Qwen/Qwen2-72B-Instruct"
-        ]
-    },
-    "OpenAI Compatible": {
-        "type": "openai",
-        "requires_api_key": True,
-        "models": []  # User-defined
-    }
-}
+def change_branch(operation, *args) -> bool:
+    """Run a MessageStore branch operation and forget the index past the messages it changed"""
+    try:
+        st.session_state.memory.rewind(operation(*args))
+        return True
+    except (ValueError, OSError) as e:
+        st.session_state.branch_error = str(e)
+        return False
 
 
-class EncryptionManager:
-    """Handles all encryption/decryption operations using AES-256-GCM via Fernet"""
-    
-    def __init__(self, passphrase: str):
-        self.passphrase = passphrase.encode()
-        self.salt = self._load_or_create_salt()
-        self.cipher = self._create_cipher()
-    
-    def _load_or_create_salt(self) -> bytes:
-        """Load existing salt or create new one"""
-        if os.path.exists(SALT_FILE):
-            with open(SALT_FILE, 'rb') as f:
-                return f.read()
-        else:
-            salt = os.urandom(16)
-            with open(SALT_FILE, 'wb') as f:
-                f.write(salt)
-            return salt
-    
-    def _create_cipher(self) -> Fernet:
-        """Create Fernet cipher from passphrase using PBKDF2"""
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=self.salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(self.passphrase))
-        return Fernet(key)
-    
-    def encrypt(self, text: str) -> str:
-        """Encrypt text and return base64 encoded string"""
-        encrypted = self.cipher.encrypt(text.encode())
-        return base64.b64encode(encrypted).decode()
-    
-    def decrypt(self, encrypted_text: str) -> str:
-        """Decrypt base64 encoded encrypted text"""
-        encrypted = base64.b64decode(encrypted_text.encode())
-        return self.cipher.decrypt(encrypted).decode()
+def regenerate(position: int):
+    """Ask again for the reply at position; the old reply stays as another version"""
+    if change_branch(st.session_state.chat_history.rewind, position):
+        st.session_state.respond = True
 
 
-class CloudInferenceClient:
-    """Unified client for cloud GPU inference"""
-    
-    def __init__(self, backend: str, api_key: Optional[str] = None, custom_url: Optional[str] = None):
-        self.backend = backend
-        self.api_key = api_key
-        self.custom_url = custom_url
-        self.backend_config = INFERENCE_BACKENDS.get(backend, {})
-    
-    def chat(self, model: str, messages: List[Dict], system_prompt: str) -> str:
-        """Send chat request to cloud inference backend"""
-        backend_type = self.backend_config.get("type")
-        
-        if backend_type == "huggingface":
-            return self._huggingface_chat(model, messages, system_prompt)
-        elif backend_type == "together":
-            return self._together_chat(model, messages, system_prompt)
-        elif backend_type == "openai":
-            return self._openai_chat(model, messages, system_prompt)
-        else:
-            raise ValueError(f"Unsupported backend type: {backend_type}")
-    
-    def _huggingface_chat(self, model: str, messages: List[Dict], system_prompt: str) -> str:
-        """Hugging Face Inference API"""
-        url = f"{self.backend_config['api_url']}{model}"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        
-        # Format prompt for HF
-        prompt = f"{system_prompt}\n\n"
-        for msg in messages:
-            role = "User" if msg["role"] == "user" else "Assistant"
-            prompt += f"{role}: {msg['content']}\n"
-        prompt += "Assistant:"
-        
-        payload = {
-            "inputs": prompt,
-            "parameters": {
-                "max_new_tokens": 1024,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "return_full_text": False
-            }
-        }
-        
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
-            response.raise_for_status()
-            result = response.json()
-            
-            if isinstance(result, list) and len(result) > 0:
-                return result[0].get("generated_text", "No response generated")
-            elif isinstance(result, dict):
-                return result.get("generated_text", result.get("error", "Unknown error"))
-            else:
-                return str(result)
-        except requests.exceptions.RequestException as e:
-            return f"Error: {str(e)}"
-    
-    def _together_chat(self, model: str, messages: List[Dict], system_prompt: str) -> str:
-        """Together AI API (OpenAI-compatible)"""
-        url = self.backend_config['api_url']
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Format messages with system prompt
-        formatted_messages = [{"role": "system", "content": system_prompt}]
-        formatted_messages.extend(messages)
-        
-        payload = {
-            "model": model,
-            "messages": formatted_messages,
-            "max_tokens": 1024,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-        
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        except requests.exceptions.RequestException as e:
-            return f"Error: {str(e)}"
-        except (KeyError, IndexError) as e:
-            return f"Error parsing response: {str(e)}"
-    
-    def _openai_chat(self, model: str, messages: List[Dict], system_prompt: str) -> str:
-        """OpenAI-compatible API"""
-        url = self.custom_url or "https://api.openai.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Format messages with system prompt
-        formatted_messages = [{"role": "system", "content": system_prompt}]
-        formatted_messages.extend(messages)
-        
-        payload = {
-            "model": model,
-            "messages": formatted_messages,
-            "max_tokens": 1024,
-            "temperature": 0.7
-        }
-        
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        except requests.exceptions.RequestException as e:
-            return f"Error: {str(e)}"
-        except (KeyError, IndexError) as e:
-            return f"Error parsing response: {str(e)}"
+def edit_message(position: Optional[int]):
+    st.session_state.editing = position
 
 
-def get_ai_response(messages: List[Dict], system_prompt: str, backend: str, model: str, 
-                    api_key: Optional[str] = None, custom_url: Optional[str] = None) -> str:
-    """Get AI response from selected backend"""
-    
-    if backend == "Local Ollama":
-        if not OLLAMA_AVAILABLE:
-            return "Error: Ollama library not installed. Install with: pip install ollama"
-        
-        try:
-            client = Client(host='http://localhost:11434')
-            
-            # Format messages for Ollama
-            formatted_messages = []
-            for msg in messages:
-                formatted_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            response = client.chat(
-                model=model,
-                messages=formatted_messages,
-                options={
-                    "system": system_prompt,
-                    "temperature": 0.7,
-                }
-            )
-            return response['message']['content']
-        except Exception as e:
-            return f"Error: {str(e)}"
-    else:
-        # Cloud inference
-        if not api_key:
-            return "Error: API key required for cloud inference"
-        
-        try:
-            client = CloudInferenceClient(backend, api_key, custom_url)
-            return client.chat(model, messages, system_prompt)
-        except Exception as e:
-            return f"Error: {str(e)}"
+def edit_and_resend(position: int):
+    """Send an edited version of the user message at position, starting a new branch there"""
+    content = st.session_state.pop(f"edit_{position}", "").strip()
+    st.session_state.editing = None
+    if content and change_branch(st.session_state.chat_history.rewind, position):
+        st.session_state.chat_history.append("user", content)
+        st.session_state.respond = True
 
 
-def save_encrypted_history(history: List[Dict], encryption_manager: EncryptionManager):
-    """Save chat history with encryption"""
-    encrypted_history = []
-    for msg in history:
-        encrypted_msg = {
-            "role": msg["role"],
-            "content": encryption_manager.encrypt(msg["content"]),
-            "timestamp": msg["timestamp"]
-        }
-        encrypted_history.append(encrypted_msg)
-    
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(encrypted_history, f, indent=2)
+def show_message(position: int, message, disabled: bool):
+    """A chat message with its version switcher and Regenerate/Edit buttons"""
+    messages = st.session_state.chat_history
+    if message.role == "user" and st.session_state.get("editing") == position:
+        st.text_area("Edit message", value=message.content, key=f"edit_{position}", label_visibility="collapsed")
+        send, cancel, _ = st.columns([1, 1, 4])
+        send.button("Send", key=f"send_{position}", on_click=edit_and_resend, args=(position,),
+                    disabled=disabled)
+        cancel.button("Cancel", key=f"cancel_{position}", on_click=edit_message, args=(None,))
+        return
+    st.write(message.content)
+    st.caption(format_timestamp(message.timestamp))
 
+    which, count = messages.alternatives(position)
+    last_reply = message.role == "assistant" and position == len(messages) - 1
+    if count == 1 and message.role != "user" and not last_reply:
+        return
+    previous, label, following, action, _ = st.columns([1, 1, 1, 2, 5])
+    if count > 1:
+        previous.button("◀", key=f"previous_{position}", on_click=change_branch,
+                        args=(messages.switch, position, -1), disabled=disabled)
+        label.caption(f"{which + 1}/{count}")
+        following.button("▶", key=f"next_{position}", on_click=change_branch,
+                         args=(messages.switch, position, 1), disabled=disabled)
+    if last_reply:
+        action.button("🔄 Regenerate", key=f"regenerate_{position}", on_click=regenerate, args=(position,),
+                      disabled=disabled)
+    elif message.role == "user":
+        action.button("✏️ Edit", key=f"edit_button_{position}", on_click=edit_message, args=(position,),
+                      disabled=disabled)
 
-def load_encrypted_history(encryption_manager: EncryptionManager) -> List[Dict]:
-    """Load and decrypt chat history"""
-    if not os.path.exists(HISTORY_FILE):
-        return []
-    
-    try:
-        with open(HISTORY_FILE, 'r') as f:
-            encrypted_history = json.load(f)
-        
-        history = []
-        for msg in encrypted_history:
-            decrypted_msg = {
-                "role": msg["role"],
-                "content": encryption_manager.decrypt(msg["content"]),
-                "timestamp": msg["timestamp"]
-            }
-            history.append(decrypted_msg)
-        
-        return history
-    except (InvalidToken, json.JSONDecodeError):
-        st.error("❌ Failed to decrypt history. Wrong passphrase or corrupted file.")
-        return []
+
+@st.fragment(run_every=1)
+def show_rekey_progress(job):
+    """Passphrase change progress, refreshed every second until the new key takes over"""
+    st.progress(job.progress, text=f"Re-encrypting history: {job.done}/{job.total} messages")
+    if job.finished:
+        st.rerun()
 
 
 def main():
+    # Serve /metrics if UNCENSORHUB_METRICS_PORT is set (once per process)
+    metrics.start_metrics_server()
+    
     st.set_page_config(
         page_title="UncensorHub",
         page_icon="🔒",
@@ -324,13 +107,26 @@ def main():
         st.session_state.authenticated = False
     if 'encryption_manager' not in st.session_state:
         st.session_state.encryption_manager = None
+    if 'history_store' not in st.session_state:
+        st.session_state.history_store = None
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
+    if 'rekey_job' not in st.session_state:
+        st.session_state.rekey_job = None
+    if 'memory' not in st.session_state:
+        st.session_state.memory = None
+    if 'prompt_cache' not in st.session_state:
+        st.session_state.prompt_cache = None
     
     # Authentication
     if not st.session_state.authenticated:
         st.subheader("🔐 Enter Passphrase to Unlock")
         
+        user_id = st.text_input(
+            "User ID (optional)",
+            key="user_id_input",
+            help="Selects your private history store. Leave blank to derive it from your passphrase."
+        )
         passphrase = st.text_input("Passphrase (min 8 characters)", type="password", key="passphrase_input")
         
         if st.button("🔓 Unlock"):
@@ -338,10 +134,26 @@ def main():
                 st.error("❌ Passphrase must be at least 8 characters")
             else:
                 try:
-                    encryption_manager = EncryptionManager(passphrase)
+                    timer = metrics.TurnTimer()
+                    # Load the model (or open the connection) while the key is derived and the history read
+                    backend = st.session_state.get("backend_selector", next(iter(INFERENCE_BACKENDS)))
+                    if backend != "OpenAI Compatible":
+                        model = st.session_state.get("model_selector", INFERENCE_BACKENDS[backend]["models"][0])
+                        st.session_state.warm_up = start_warm_up(backend, model)
+                    with st.spinner("Unlocking..."):
+                        store, encryption_manager, history, memory = unlock(
+                            passphrase, user_id=user_id.strip(), timer=timer)
+                    metrics.export_metrics()
+                    st.session_state.history_store = store
                     st.session_state.encryption_manager = encryption_manager
-                    st.session_state.chat_history = load_encrypted_history(encryption_manager)
+                    st.session_state.chat_history = history
+                    st.session_state.memory = memory
+                    st.session_state.prompt_cache = PromptCache()
+                    st.session_state.unlock_timings = timer.summary()
+                    st.session_state.turn_timings = None
                     st.session_state.authenticated = True
+                    # Re-encrypt records from older cipher engines while the user chats
+                    start_background_migration(encryption_manager, store)
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Authentication failed: {str(e)}")
@@ -351,6 +163,18 @@ def main():
     
     # Main application (authenticated)
     encryption_manager = st.session_state.encryption_manager
+    store = st.session_state.history_store
+    
+    # Adopt the new key once a background passphrase change has finished
+    rekey_job = st.session_state.rekey_job
+    if rekey_job and rekey_job.finished:
+        st.session_state.rekey_job = None
+        if rekey_job.error:
+            st.error(f"❌ Passphrase change failed: {rekey_job.error}. It will resume on your next unlock.")
+        else:
+            st.session_state.encryption_manager = encryption_manager = rekey_job.new_manager
+            st.success("✅ Passphrase changed")
+        rekey_job = None
     
     # Sidebar
     with st.sidebar:
@@ -365,6 +189,8 @@ def main():
         )
         
         backend_config = INFERENCE_BACKENDS[backend]
+        # Local turns resend the history unchanged so Ollama can reuse the evaluated prompt
+        reuse_context = backend == "Local Ollama" and OLLAMA_REUSE_CONTEXT
         
         # API Key input for cloud backends
         api_key = None
@@ -413,40 +239,81 @@ def main():
         
         # Chat controls
         st.subheader("💬 Chat Controls")
-        if st.button("🗑️ Clear Chat", use_container_width=True):
-            st.session_state.chat_history = []
-            if os.path.exists(HISTORY_FILE):
-                os.remove(HISTORY_FILE)
+        if st.button("🗑️ Clear Chat", use_container_width=True, disabled=rekey_job is not None):
+            st.session_state.chat_history.clear()
+            st.session_state.editing = None
+            st.session_state.memory.reset()
             st.rerun()
         
         st.divider()
         
         # Backup
         st.subheader("📦 Backup")
-        if st.button("📤 Export History", use_container_width=True):
-            if os.path.exists(HISTORY_FILE):
-                with open(HISTORY_FILE, 'r') as f:
-                    encrypted_data = f.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                st.download_button(
-                    label="💾 Download",
-                    data=encrypted_data,
-                    file_name=f"uncensorhub_backup_{timestamp}.json",
-                    mime="application/json",
-                    use_container_width=True
-                )
-        
-        uploaded_file = st.file_uploader("📥 Import History", type=['json'])
-        if uploaded_file:
+        checkpoint = current_checkpoint(store)
+        if checkpoint:
+            st.caption(f"Checkpoint: `{checkpoint}`")
+        since = st.text_input("Only changes since checkpoint (optional)", key="export_since")
+        if st.button("📤 Export History", use_container_width=True, disabled=rekey_job is not None):
             try:
-                encrypted_data = uploaded_file.read().decode()
-                with open(HISTORY_FILE, 'w') as f:
-                    f.write(encrypted_data)
-                st.session_state.chat_history = load_encrypted_history(encryption_manager)
-                st.success("✅ History imported successfully!")
+                encrypted_data = export_history(store, since)
+            except ValueError as e:
+                st.error(f"❌ {str(e)}")
+            else:
+                if encrypted_data:
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    kind = "changes" if since else "backup"
+                    st.download_button(
+                        label="💾 Download",
+                        data=encrypted_data,
+                        file_name=f"uncensorhub_{kind}_{timestamp}.json",
+                        mime="application/json",
+                        use_container_width=True
+                    )
+        
+        uploaded_files = st.file_uploader("📥 Import History (a backup and/or change files)", type=['json'],
+                                          accept_multiple_files=True, disabled=rekey_job is not None)
+        if uploaded_files:
+            success, message = import_history(uploaded_files, encryption_manager, store)
+            if success:
+                try:
+                    started = time.perf_counter()
+                    st.session_state.chat_history = MessageStore.load(encryption_manager, store)
+                    metrics.DECRYPT_SECONDS.observe(time.perf_counter() - started)
+                    st.session_state.memory = RetrievalMemory.load(encryption_manager, store)
+                    start_background_migration(encryption_manager, store)
+                    st.success(f"✅ {message}!")
+                except ValueError as e:
+                    st.error(f"❌ Failed to decrypt history: {str(e)}")
                 st.rerun()
-            except Exception as e:
-                st.error(f"❌ Import failed: {str(e)}")
+            else:
+                st.error(f"❌ {message}")
+        
+        st.divider()
+        
+        # Passphrase change
+        st.subheader("🔑 Passphrase")
+        if rekey_job:
+            show_rekey_progress(rekey_job)
+        else:
+            with st.expander("Change Passphrase"):
+                current_passphrase = st.text_input("Current passphrase", type="password", key="rekey_current")
+                new_passphrase = st.text_input("New passphrase (min 8 characters)", type="password", key="rekey_new")
+                confirm_passphrase = st.text_input("Confirm new passphrase", type="password", key="rekey_confirm")
+                if st.button("🔑 Change Passphrase", use_container_width=True):
+                    if len(new_passphrase) < 8:
+                        st.error("❌ Passphrase must be at least 8 characters")
+                    elif new_passphrase != confirm_passphrase:
+                        st.error("❌ New passphrases do not match")
+                    else:
+                        try:
+                            job = start_rekey(store, encryption_manager, current_passphrase, new_passphrase)
+                            job.on_switch(st.session_state.chat_history.switch_encryption_manager)
+                            job.on_switch(st.session_state.memory.switch_encryption_manager)
+                            start_background_rekey(job)
+                            st.session_state.rekey_job = job
+                            st.rerun()
+                        except ValueError as e:
+                            st.error(f"❌ {str(e)}")
         
         st.divider()
         
@@ -454,86 +321,124 @@ def main():
         if st.button("🔒 Lock & Exit", use_container_width=True):
             st.session_state.authenticated = False
             st.session_state.encryption_manager = None
+            st.session_state.history_store = None
+            st.session_state.rekey_job = None
+            st.session_state.memory = None
+            st.session_state.warm_up = None
+            st.session_state.prompt_cache = None
+            st.session_state.editing = None
             st.rerun()
         
         # Status
-        st.caption("🔐 All data is encrypted with AES-256-GCM")
+        st.caption(f"🔐 All data is encrypted with {encryption_manager.engine_name}")
         st.caption(f"💾 Messages stored: {len(st.session_state.chat_history)}")
+        if st.session_state.chat_history.spilled:
+            st.caption(f"🗄️ {st.session_state.chat_history.spilled} older messages kept encrypted on disk only")
+        memory = st.session_state.memory
+        if memory.available:
+            st.caption(f"🧠 Memory: {memory.count} messages indexed (embedded locally)")
+        elif memory.enabled and memory.last_error:
+            st.caption(f"🧠 Memory unavailable, sending full history: {memory.last_error}")
+        if reuse_context:
+            st.caption("♻️ History resent unchanged, so Ollama evaluates only new messages")
+        if st.session_state.get("unlock_timings"):
+            st.caption(f"🔓 Unlock: {st.session_state.unlock_timings}")
+        warm_up = st.session_state.get("warm_up")
+        if warm_up and warm_up.finished:
+            if warm_up.error:
+                st.caption(f"🔥 Warm-up of {warm_up.model} failed: {warm_up.error}")
+            else:
+                st.caption(f"🔥 {warm_up.model} warmed up in {warm_up.seconds:.2f} s")
+        if st.session_state.get("turn_timings"):
+            st.caption(f"⏱️ Last turn: {st.session_state.turn_timings}")
         st.caption(f"🌐 Backend: {backend}")
     
     # Chat interface
     chat_container = st.container()
     
-    with chat_container:
-        # Display chat history
-        for msg in st.session_state.chat_history:
-            with st.chat_message(msg["role"]):
-                st.write(msg["content"])
-                st.caption(msg["timestamp"])
+    timer = metrics.TurnTimer()
+    with chat_container, timer.span("render"):
+        # Display chat history (switching versions and editing wait for a passphrase change)
+        for position, msg in enumerate(st.session_state.chat_history, st.session_state.chat_history.spilled):
+            with st.chat_message(msg.role):
+                show_message(position, msg, disabled=rekey_job is not None)
+    if "branch_error" in st.session_state:
+        st.error(f"❌ Failed to change the conversation: {st.session_state.pop('branch_error')}")
     
-    # Chat input
+    # Chat input; Regenerate and Edit ask for a reply without one
     user_input = st.chat_input("Type your message here...")
+    respond = st.session_state.pop("respond", False)
     
-    if user_input:
+    if user_input or respond:
         # Validate API key for cloud backends
         if backend_config["requires_api_key"] and not api_key:
             st.error(f"❌ Please enter your {backend} API key in the sidebar")
+            st.session_state.respond = respond
             return
         
         if backend == "OpenAI Compatible" and not model:
             st.error("❌ Please enter a model name in the sidebar")
+            st.session_state.respond = respond
             return
         
-        # Add user message
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        user_message = {
-            "role": "user",
-            "content": user_input,
-            "timestamp": timestamp
-        }
-        st.session_state.chat_history.append(user_message)
-        
-        # Display user message
-        with st.chat_message("user"):
-            st.write(user_input)
-            st.caption(timestamp)
+        if user_input:
+            # Add user message
+            user_message = st.session_state.chat_history.append("user", user_input)
+            
+            # Display user message
+            with st.chat_message("user"):
+                st.write(user_input)
+                st.caption(format_timestamp(user_message.timestamp))
         
         # Get AI response
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                # Prepare messages for API (only content, no timestamps)
-                api_messages = [
-                    {"role": msg["role"], "content": msg["content"]}
-                    for msg in st.session_state.chat_history
-                ]
+                # Recent messages plus relevant earlier turns, or the whole resident history
+                # (always, when reusing Ollama's context: retrieved turns would change the prefix)
+                context = None
+                if st.session_state.memory.available and not reuse_context:
+                    with timer.span("retrieval"):
+                        context = st.session_state.memory.context(st.session_state.chat_history)
+                if context is None:
+                    # Role/content view of the history, no per-turn copy
+                    context = st.session_state.chat_history.api_messages()
                 
-                response = get_ai_response(
-                    api_messages,
-                    system_prompt,
-                    backend,
-                    model,
-                    api_key,
-                    custom_url
-                )
+                usage = {}
+                with timer.span("inference"):
+                    response = get_ai_response(
+                        context,
+                        system_prompt,
+                        backend,
+                        model,
+                        api_key,
+                        custom_url,
+                        usage,
+                        prompt_cache=st.session_state.prompt_cache
+                    )
+                metrics.record_inference(timer, backend, usage)
                 
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                # Add AI response to history
+                ai_message = st.session_state.chat_history.append("assistant", response)
                 st.write(response)
-                st.caption(timestamp)
-        
-        # Add AI response to history
-        ai_message = {
-            "role": "assistant",
-            "content": response,
-            "timestamp": timestamp
-        }
-        st.session_state.chat_history.append(ai_message)
+                st.caption(format_timestamp(ai_message.timestamp))
         
-        # Save encrypted history
-        save_encrypted_history(st.session_state.chat_history, encryption_manager)
+        # Save the new messages; older ones beyond the memory cap leave memory
+        try:
+            with timer.span("save"):
+                saved_bytes = st.session_state.chat_history.save()
+            metrics.record_save(saved_bytes)
+            if st.session_state.memory.available:
+                with timer.span("index"):
+                    st.session_state.memory.index(st.session_state.chat_history)
+        except Exception as e:
+            st.error(f"❌ Failed to save history: {str(e)}")
         
+        st.session_state.turn_timings = timer.summary()
+        metrics.export_metrics()
         st.rerun()
 
 
 if __name__ == "__main__":
-    main()
+    # Opt-in cProfile/tracemalloc reports, see UNCENSORHUB_PROFILE
+    profiling.run(main)
 
@@ -0,0 +1,87 @@
+"""
+Time-to-passphrase-screen benchmark
+
+Runs each app headlessly (streamlit.testing.AppTest) in a fresh interpreter
+and times the first script run, which ends on the passphrase screen.
+The "eager" variant also imports the crypto and backend modules inside the
+timed region, as both apps did at module top before the core package
+started loading them lazily.
+
+Usage: python benchmarks/import_time.py [--runs 5] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["cryptography.fernet", "cryptography.hazmat.primitives.kdf.pbkdf2", "ollama", "requests"]
+
+CHILD_SCRIPT = """
+import importlib, json, sys, time
+from streamlit.testing.v1 import AppTest
+
+app_file, eager, heavy = sys.argv[1], sys.argv[2] == "1", sys.argv[3].split(",")
+start = time.perf_counter()
+if eager:
+    for name in heavy:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+at = AppTest.from_file(app_file, default_timeout=60).run()
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "passphrase_screen": any("Passphrase" in s.value for s in at.subheader),
+    "loaded": sorted(m for m in heavy if m in sys.modules),
+}))
+"""
+
+
+def measure(app_file: str, eager: bool) -> dict:
+    """Run one sample in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, app_file, "1" if eager else "0", ",".join(HEAVY_MODULES)],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Samples per app and variant")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for app_file in ("app.py", "app_cloud.py"):
+        for variant, eager in (("lazy", False), ("eager", True)):
+            samples = [measure(app_file, eager) for _ in range(args.runs)]
+            seconds = [s["seconds"] for s in samples]
+            results.setdefault(app_file, {})[variant] = {
+                "median_seconds": statistics.median(seconds),
+                "min_seconds": min(seconds),
+                "passphrase_screen": all(s["passphrase_screen"] for s in samples),
+                "heavy_modules_loaded": samples[-1]["loaded"]
+            }
+        lazy = results[app_file]["lazy"]["median_seconds"]
+        eager = results[app_file]["eager"]["median_seconds"]
+        results[app_file]["reduction_seconds"] = eager - lazy
+        results[app_file]["reduction_percent"] = 100 * (eager - lazy) / eager if eager else 0.0
+        print(f"{app_file:14} lazy {lazy * 1000:8.1f} ms   eager {eager * 1000:8.1f} ms   "
+              f"saved {(eager - lazy) * 1000:7.1f} ms ({results[app_file]['reduction_percent']:.0f}%)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Load generator for concurrent chat sessions
+
+Simulates many users chatting at once through the app's own code paths:
+each session unlocks a per-user store (EncryptionManager + MessageStore.load),
+then for every turn sends the resident conversation through chat_completion
+and saves the new messages, exactly as app_cloud.py does. By default an
+in-process mock server (see mock_server.py) stands in for the backend;
+pass --target to drive an already running server instead.
+
+Usage:
+    python benchmarks/load_generator.py --sessions 32 --turns 10
+    python benchmarks/load_generator.py --backend "Together AI" --rate-limit-rate 0.05
+    python benchmarks/load_generator.py --target http://127.0.0.1:11434 --output load.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from mock_server import MockServer, add_config_arguments, config_from_args  # noqa: E402
+
+from uncensorhub import config  # noqa: E402
+from uncensorhub.cli import percentile  # noqa: E402
+from uncensorhub.crypto import EncryptionManager  # noqa: E402
+from uncensorhub.inference import chat_completion  # noqa: E402
+from uncensorhub.messages import MessageStore  # noqa: E402
+from uncensorhub.store import open_store  # noqa: E402
+
+STAGES = ("unlock", "inference", "save", "turn")
+
+
+def point_backends_at(url: str) -> Optional[str]:
+    """Route every backend to url; returns the custom URL for "OpenAI Compatible" """
+    config.OLLAMA_HOST = url
+    config.INFERENCE_BACKENDS["Hugging Face"]["api_url"] = f"{url}/models/"
+    config.INFERENCE_BACKENDS["Together AI"]["api_url"] = f"{url}/v1/chat/completions"
+    return f"{url}/v1/chat/completions"
+
+
+class LoadStats:
+    """Thread-safe collection of per-stage latencies and error counts"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.errors: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.latencies[stage].append(seconds)
+
+    def error(self, message: str):
+        with self._lock:
+            self.errors[message[:120]] += 1
+
+    def summary(self) -> Dict:
+        return {
+            stage: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": max(values, default=0.0)
+            }
+            for stage, values in self.latencies.items()
+        }
+
+
+def run_session(index: int, args, custom_url: Optional[str], data_dir: str, stats: LoadStats):
+    """One simulated user: unlock, then chat for args.turns turns"""
+    time.sleep(args.ramp_up * index / max(1, args.sessions))
+    passphrase = f"load-test-passphrase-{index}"
+
+    started = time.perf_counter()
+    store = open_store(user_id=f"load-{index}", data_dir=data_dir)
+    encryption_manager = EncryptionManager(passphrase, store)
+    history = MessageStore.load(encryption_manager, store)
+    stats.add("unlock", time.perf_counter() - started)
+
+    model = args.model or (config.INFERENCE_BACKENDS[args.backend]["models"] or ["mock"])[0]
+    for turn in range(args.turns):
+        turn_started = time.perf_counter()
+        history.append("user", f"Session {index} question {turn}: " + "lorem ipsum " * 20)
+
+        started = time.perf_counter()
+        try:
+            response = chat_completion(history.api_messages(), config.DEFAULT_SYSTEM_PROMPT, args.backend,
+                                       model, "mock-key", custom_url)
+        except Exception as e:
+            stats.error(str(e))
+            response = f"Error: {str(e)}"
+        stats.add("inference", time.perf_counter() - started)
+
+        history.append("assistant", response)
+        started = time.perf_counter()
+        history.save()
+        stats.add("save", time.perf_counter() - started)
+        stats.add("turn", time.perf_counter() - turn_started)
+
+        if args.think_time:
+            time.sleep(args.think_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent chat sessions (default: 16)")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session (default: 5)")
+    parser.add_argument("--backend", default="Local Ollama", choices=list(config.INFERENCE_BACKENDS))
+    parser.add_argument("--model", help="Model name (default: the backend's first listed model)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which sessions start")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between a session's turns")
+    parser.add_argument("--target", help="Use this running server instead of an in-process mock")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="uncensorhub-load-")
+    stats = LoadStats()
+    server = MockServer(config_from_args(args)) if not args.target else None
+    try:
+        with server or contextlib.nullcontext():
+            custom_url = point_backends_at(args.target or server.url)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+                futures = [pool.submit(run_session, i, args, custom_url, data_dir, stats)
+                           for i in range(args.sessions)]
+                for future in futures:
+                    future.result()
+            wall = time.perf_counter() - started
+            server_stats = server.stats if server else {}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    turns = len(stats.latencies["turn"])
+    report = {
+        "sessions": args.sessions,
+        "turns": turns,
+        "wall_seconds": wall,
+        "turns_per_second": turns / wall if wall > 0 else 0.0,
+        "failed_turns": sum(stats.errors.values()),
+        "errors": dict(stats.errors),
+        "latency_seconds": stats.summary(),
+        "server": server_stats
+    }
+
+    print(f"{args.sessions} sessions, {turns} turns in {wall:.2f}s "
+          f"({report['turns_per_second']:.1f} turns/s), {report['failed_turns']} failed")
+    print(f"{'stage':10} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for stage, row in report["latency_seconds"].items():
+        print(f"{stage:10} {row['p50'] * 1000:10.1f} {row['p90'] * 1000:10.1f} "
+              f"{row['p99'] * 1000:10.1f} {row['max'] * 1000:10.1f}")
+    for message, count in stats.errors.most_common():
+        print(f"  {count:5} x {message}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
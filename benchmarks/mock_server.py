@@ -0,0 +1,361 @@
+"""
+Local mock inference server
+
+A stand-in for the inference endpoints in INFERENCE_BACKENDS so the app can
+be load-tested without a GPU or network:
+
+    POST /api/chat               Ollama (NDJSON streaming or single JSON)
+    POST /api/generate           Ollama model preload (an empty prompt)
+    POST /api/embed              Ollama embeddings (hashed bag of words)
+    POST /v1/chat/completions    OpenAI / Together AI (SSE streaming or JSON)
+    POST /models/<name>          Hugging Face text generation (SSE or JSON)
+    GET  /stats                  Request counts by endpoint and status
+
+Like Ollama, /api/chat keeps each model's last conversation (prompt and
+reply) and reports in prompt_eval_count only the tokens of the messages
+past the prefix a request shares with it.
+
+Latency is modelled as a time-to-first-token plus a fixed token rate, and
+failures can be injected as random 500s, 429s (with Retry-After) and
+503s (Hugging Face "model loading"), or as 429s once more than
+--max-concurrency requests are in flight.
+
+Usage:
+    python benchmarks/mock_server.py --port 11434 --ttft 0.3 --tokens-per-sec 40
+    python benchmarks/mock_server.py --error-rate 0.01 --rate-limit-rate 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+EMBEDDING_DIMENSIONS = 64
+REPLY_WORDS = ("this is a simulated reply from the mock inference server used "
+               "for load testing without a gpu or network").split()
+
+
+class MockConfig:
+    """Latency and failure model for the mock server"""
+
+    def __init__(self, ttft: float = 0.0, tokens_per_sec: float = 0.0, reply_tokens: int = 32,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, unavailable_rate: float = 0.0,
+                 max_concurrency: int = 0, retry_after: int = 1, seed: Optional[int] = None):
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.unavailable_rate = unavailable_rate
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def token_delay(self) -> float:
+        return 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    def draw_failure(self) -> Optional[int]:
+        """Pick an injected HTTP status for this request, or None to succeed"""
+        with self.rng_lock:
+            roll = self.rng.random()
+        for status, rate in ((500, self.error_rate), (429, self.rate_limit_rate), (503, self.unavailable_rate)):
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+
+def reply_tokens(count: int) -> List[str]:
+    return [REPLY_WORDS[i % len(REPLY_WORDS)] + " " for i in range(count)]
+
+
+def embed_text(text: str) -> List[float]:
+    """Deterministic embedding where texts sharing words are similar"""
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for word in text.lower().split():
+        vector[int.from_bytes(hashlib.sha256(word.encode()).digest()[:4], "big") % EMBEDDING_DIMENSIONS] += 1.0
+    return vector
+
+
+def count_prompt_tokens(body: Dict) -> int:
+    """Whitespace token estimate of the prompt, reported like Ollama's prompt_eval_count"""
+    if "messages" in body:
+        return sum(len(str(m.get("content", "")).split()) for m in body["messages"])
+    return len(str(body.get("inputs", "")).split())
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "MockHTTPServer"
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.stats_lock:
+                stats = {"requests": dict(self.server.stats), "in_flight": self.server.in_flight}
+            self._send_json(200, stats)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._finish("invalid", 400, {"error": "invalid JSON"})
+            return
+
+        if self.path == "/api/chat":
+            endpoint = "ollama"
+        elif self.path == "/api/embed":
+            endpoint = "embed"
+        elif self.path == "/api/generate":
+            endpoint = "generate"
+        elif self.path.startswith("/v1/chat/completions"):
+            endpoint = "openai"
+        elif self.path.startswith("/models/"):
+            endpoint = "huggingface"
+        else:
+            self._finish("unknown", 404, {"error": "not found"})
+            return
+
+        config = self.server.config
+        with self.server.stats_lock:
+            self.server.in_flight += 1
+            over_limit = config.max_concurrency and self.server.in_flight > config.max_concurrency
+        try:
+            status = 429 if over_limit else config.draw_failure()
+            if status is not None:
+                self._fail(endpoint, status)
+                return
+            self._respond(endpoint, body)
+        finally:
+            with self.server.stats_lock:
+                self.server.in_flight -= 1
+
+    def _fail(self, endpoint: str, status: int):
+        config = self.server.config
+        if status == 429:
+            self._finish(endpoint, 429, {"error": "rate limit exceeded"},
+                         {"Retry-After": str(config.retry_after)})
+        elif status == 503:
+            self._finish(endpoint, 503, {"error": "Model is currently loading", "estimated_time": 20.0},
+                         {"Retry-After": str(config.retry_after)})
+        else:
+            self._finish(endpoint, 500, {"error": "injected server error"})
+
+    def _respond(self, endpoint: str, body: Dict):
+        config = self.server.config
+        if endpoint == "embed":
+            inputs = body.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._finish(endpoint, 200, {"model": body.get("model"), "embeddings": [embed_text(t) for t in inputs]})
+            return
+        if endpoint == "generate":
+            # Only the preload form: the model is "loaded" in the time to first token
+            time.sleep(config.ttft)
+            self._finish(endpoint, 200, {"model": body.get("model"), "response": "", "done": True,
+                                         "done_reason": "load", "load_duration": int(config.ttft * 1e9)})
+            return
+        if endpoint == "huggingface":
+            parameters = body.get("parameters", {})
+            max_tokens = parameters.get("max_new_tokens", config.reply_tokens)
+            stream = body.get("stream", False)
+        else:
+            max_tokens = body.get("max_tokens", config.reply_tokens)
+            # Ollama streams unless told otherwise; OpenAI-style APIs do the opposite
+            stream = body.get("stream", endpoint == "ollama")
+        tokens = reply_tokens(min(config.reply_tokens, max_tokens))
+        prompt_tokens = self._evaluated_tokens(body, tokens) if endpoint == "ollama" else count_prompt_tokens(body)
+        started = time.perf_counter()
+
+        if not stream:
+            time.sleep(config.ttft + len(tokens) * config.token_delay())
+            self._finish(endpoint, 200, self._final_body(endpoint, body, tokens, prompt_tokens, started))
+            return
+
+        self.send_response(200)
+        content_type = "application/x-ndjson" if endpoint == "ollama" else "text/event-stream"
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(config.ttft)
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(config.token_delay())
+            self._write_event(endpoint, self._chunk_body(endpoint, body, token))
+        self._write_event(endpoint, self._final_body(endpoint, body, tokens, prompt_tokens, started, streaming=True))
+        if endpoint == "openai":
+            self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+        self._count(endpoint, 200)
+
+    def _evaluated_tokens(self, body: Dict, tokens: List[str]) -> int:
+        """Prompt tokens past the model's cached conversation, which becomes this one plus its reply"""
+        messages = [(m.get("role"), str(m.get("content", ""))) for m in body.get("messages", [])]
+        model = body.get("model")
+        with self.server.stats_lock:
+            cached = self.server.contexts.get(model, [])
+            shared = 0
+            while shared < min(len(cached), len(messages)) and cached[shared] == messages[shared]:
+                shared += 1
+            self.server.contexts[model] = messages + [("assistant", "".join(tokens).strip())]
+        return sum(len(content.split()) for _, content in messages[shared:])
+
+    def _chunk_body(self, endpoint: str, body: Dict, token: str) -> Dict:
+        if endpoint == "ollama":
+            return {"model": body.get("model"), "message": {"role": "assistant", "content": token}, "done": False}
+        if endpoint == "openai":
+            return {"object": "chat.completion.chunk", "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+        return {"token": {"text": token, "special": False}, "generated_text": None}
+
+    def _final_body(self, endpoint: str, body: Dict, tokens: List[str], prompt_tokens: int,
+                    started: float, streaming: bool = False) -> Dict:
+        text = "".join(tokens).strip()
+        elapsed_ns = int((time.perf_counter() - started) * 1e9)
+        config = self.server.config
+        if endpoint == "ollama":
+            return {
+                "model": body.get("model"),
+                "message": {"role": "assistant", "content": "" if streaming else text},
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": elapsed_ns,
+                "load_duration": 0,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(config.ttft * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(len(tokens) * config.token_delay() * 1e9)
+            }
+        if endpoint == "openai":
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                     "total_tokens": prompt_tokens + len(tokens)}
+            if streaming:
+                return {"object": "chat.completion.chunk", "model": body.get("model"), "usage": usage,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            return {"object": "chat.completion", "model": body.get("model"), "usage": usage,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": "stop"}]}
+        if streaming:
+            return {"token": {"text": "", "special": True}, "generated_text": text}
+        return [{"generated_text": text}]
+
+    def _write_event(self, endpoint: str, payload: Dict):
+        data = json.dumps(payload).encode()
+        self._write_chunk(data + b"\n" if endpoint == "ollama" else b"data: " + data + b"\n\n")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _finish(self, endpoint: str, status: int, payload, headers: Optional[Dict] = None):
+        self._count(endpoint, status)
+        self._send_json(status, payload, headers)
+
+    def _send_json(self, status: int, payload, headers: Optional[Dict] = None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _count(self, endpoint: str, status: int):
+        with self.server.stats_lock:
+            self.server.stats[f"{endpoint} {status}"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 refuses connections under load-test concurrency
+    request_queue_size = 256
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stats: Counter = Counter()
+        self.stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.contexts: Dict[str, List] = {}  # Ollama's cached conversation by model
+
+
+class MockServer:
+    """Run the mock server on localhost in a background thread"""
+
+    def __init__(self, config: Optional[MockConfig] = None, port: int = 0):
+        self.httpd = MockHTTPServer(("127.0.0.1", port), config or MockConfig())
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self.httpd.stats_lock:
+            return dict(self.httpd.stats)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Mock latency and failure options, shared with the load generator"""
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds to first token (default: 0.2)")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0,
+                        help="Generation speed; 0 means instant (default: 50)")
+    parser.add_argument("--reply-tokens", type=int, default=32, help="Tokens per reply (default: 32)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--unavailable-rate", type=float, default=0.0,
+                        help="Fraction of requests failing with 503")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="Return 429 beyond this many in-flight requests (0: unlimited)")
+    parser.add_argument("--seed", type=int, help="Seed for failure injection")
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        unavailable_rate=args.unavailable_rate,
+        max_concurrency=args.max_concurrency,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11434, help="Port to listen on (default: 11434, like Ollama)")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockHTTPServer(("127.0.0.1", args.port), config_from_args(args))
+    print(f"Mock inference server on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
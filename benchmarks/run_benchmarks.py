@@ -0,0 +1,373 @@
+"""
+Benchmark suite for the crypto, persistence and inference paths
+
+Generates deterministic synthetic histories (10 to 100k messages, message
+sizes from a few words to several KB) and times key derivation,
+encrypt/decrypt, save_encrypted_history, load_encrypted_history,
+unlock (pipelined versus one step after another), switching between
+regenerated replies (versus reloading the history),
+import_history (with and without a manifest), full and delta exports,
+retrieval indexing and lookups, Hugging Face prompt rendering (from
+scratch and incrementally), CloudInferenceClient and Ollama turns (with
+the tokens a follow-up turn re-evaluates) against an instant local mock
+server, and measures the in-memory footprint of plain
+dicts versus the MessageStore.
+Results are written as JSON; pass --compare with an earlier results file to
+flag regressions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --sizes 10 1000 --compare results.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from mock_server import MockServer  # noqa: E402
+
+from uncensorhub.config import INFERENCE_BACKENDS  # noqa: E402
+from uncensorhub.crypto import EncryptionManager  # noqa: E402
+from uncensorhub.history import (  # noqa: E402
+    current_checkpoint,
+    export_history,
+    import_history,
+    load_encrypted_history,
+    save_encrypted_history
+)
+from uncensorhub.inference import CloudInferenceClient, ollama_chat, ollama_client  # noqa: E402
+from uncensorhub.messages import MessageStore, parse_timestamp  # noqa: E402
+from uncensorhub.retrieval import RetrievalMemory  # noqa: E402
+from uncensorhub.store import HistoryStore, open_store  # noqa: E402
+from uncensorhub.templates import PromptCache, render_prompt, template_for  # noqa: E402
+from uncensorhub.unlock import unlock  # noqa: E402
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+DELTA_MESSAGES = 20
+# Larger histories are not sent whole to any backend, so inference stops here
+MAX_INFERENCE_MESSAGES = 1000
+MAX_RETRIEVAL_MESSAGES = 10000
+PASSPHRASE = "benchmark_passphrase"
+WORDS = ("the quick brown fox jumps over a lazy dog while encrypted history "
+         "streams through local models and cloud gpu backends").split()
+
+
+def synthetic_history(size: int, seed: int = 1234) -> List[Dict]:
+    """Alternating user/assistant messages with log-normally distributed lengths"""
+    rng = random.Random(seed)
+    history = []
+    for i in range(size):
+        words = min(2000, max(3, int(rng.lognormvariate(3.5, 1.0))))
+        history.append({
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": " ".join(rng.choice(WORDS) for _ in range(words)),
+            "timestamp": f"2025-01-01 12:{(i // 60) % 60:02d}:{i % 60:02d}"
+        })
+    return history
+
+
+def time_it(func: Callable, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def record(results: List[Dict], name: str, samples: List[float], messages: int = 0, **extra):
+    entry = {
+        "name": name,
+        "messages": messages,
+        "repeat": len(samples),
+        "seconds_min": min(samples),
+        "seconds_median": statistics.median(samples)
+    }
+    if messages:
+        entry["per_message_us"] = entry["seconds_median"] / messages * 1e6
+    entry.update(extra)
+    results.append(entry)
+    print(f"{name:32} {messages:>7} msgs  median {entry['seconds_median'] * 1000:10.2f} ms", file=sys.stderr)
+
+
+def bench_key_derivation(results: List[Dict], workdir: str, repeat: int):
+    store = HistoryStore(os.path.join(workdir, "kdf"))
+    store.load_or_create_salt()
+    record(results, "key_derivation", time_it(lambda: EncryptionManager(PASSPHRASE, store), repeat))
+
+
+def bench_history(results: List[Dict], workdir: str, size: int, repeat: int):
+    history = synthetic_history(size)
+    plaintext_bytes = sum(len(m["content"].encode()) for m in history)
+    store = HistoryStore(os.path.join(workdir, f"history-{size}"))
+    em = EncryptionManager(PASSPHRASE, store)
+
+    encrypted = [em.encrypt(m["content"]) for m in history]
+    record(results, "encrypt", time_it(lambda: [em.encrypt(m["content"]) for m in history], repeat),
+           size, plaintext_bytes=plaintext_bytes)
+    record(results, "decrypt", time_it(lambda: [em.decrypt(c) for c in encrypted], repeat), size)
+
+    record(results, "save_encrypted_history",
+           time_it(lambda: save_encrypted_history(history, em, store), repeat),
+           size, file_bytes=os.path.getsize(store.history_path))
+    record(results, "load_encrypted_history",
+           time_it(lambda: load_encrypted_history(em, store), repeat), size)
+
+    def importer(backup: bytes) -> Callable:
+        def do_import():
+            ok, message = import_history(io.BytesIO(backup), em, store)
+            if not ok:
+                raise RuntimeError(message)
+        return do_import
+
+    # Manifest-verified backup versus a pre-manifest plain record list (decrypted in full)
+    record(results, "import_history", time_it(importer(export_history(store).encode()), repeat), size)
+    record(results, "import_history_legacy", time_it(importer(store.read_raw().encode()), repeat), size)
+
+    # A nightly delta backup after a day's worth of new messages, versus a full one
+    checkpoint = current_checkpoint(store)
+    messages = MessageStore.load(em, store)
+    for m in synthetic_history(DELTA_MESSAGES, seed=size):
+        messages.append(m["role"], m["content"])
+    messages.save()
+    full = export_history(store)
+    delta = export_history(store, since=checkpoint)
+    record(results, "export_history", time_it(lambda: export_history(store), repeat),
+           size, backup_bytes=len(full))
+    record(results, "export_history_delta", time_it(lambda: export_history(store, since=checkpoint), repeat),
+           size, backup_bytes=len(delta))
+    record(results, "import_history_delta", time_it(importer(delta.encode()), repeat), size)
+
+
+def bench_unlock(results: List[Dict], workdir: str, size: int, repeat: int):
+    data_dir = os.path.join(workdir, "stores")
+    user_id = f"unlock-{size}"
+    store = open_store(user_id=user_id, data_dir=data_dir)
+    save_encrypted_history(synthetic_history(size), EncryptionManager(PASSPHRASE, store), store)
+
+    def sequential():
+        em = EncryptionManager(PASSPHRASE, store)
+        MessageStore.load(em, store)
+        RetrievalMemory.load(em, store)
+
+    record(results, "unlock_sequential", time_it(sequential, repeat), size)
+    record(results, "unlock", time_it(lambda: unlock(PASSPHRASE, user_id, data_dir=data_dir), repeat), size)
+
+
+def bench_branches(results: List[Dict], workdir: str, size: int, repeat: int):
+    store = HistoryStore(os.path.join(workdir, f"branches-{size}"))
+    em = EncryptionManager(PASSPHRASE, store)
+    save_encrypted_history(synthetic_history(size), em, store)
+    messages = MessageStore.load(em, store)
+    # A regenerated last reply: two versions sharing everything before it
+    messages.rewind(size - 1)
+    messages.append("assistant", "a regenerated reply")
+    messages.save()
+
+    record(results, "branch_switch", time_it(lambda: messages.switch(size - 1, 1), repeat), size)
+    record(results, "branch_reload", time_it(lambda: MessageStore.load(em, store), repeat), size)
+
+
+def allocated_bytes(build: Callable) -> int:
+    """Bytes still allocated by the object build() returns"""
+    tracemalloc.start()
+    try:
+        kept = build()
+        current = tracemalloc.get_traced_memory()[0]
+        del kept
+        return current
+    finally:
+        tracemalloc.stop()
+
+
+def bench_message_memory(results: List[Dict], workdir: str, size: int, repeat: int):
+    # Fresh strings so the contents count against both layouts, as after a decrypt
+    source = [(m["role"], m["content"], m["timestamp"]) for m in synthetic_history(size)]
+    store = HistoryStore(os.path.join(workdir, f"messages-{size}"))
+    em = EncryptionManager(PASSPHRASE, store)
+
+    def as_dicts():
+        return [{"role": role, "content": content[:-1] + content[-1], "timestamp": timestamp[:-1] + timestamp[-1]}
+                for role, content, timestamp in source]
+
+    def as_message_store():
+        messages = MessageStore(em, store, memory_cap=2 ** 62)
+        for role, content, timestamp in source:
+            messages.append(role, content[:-1] + content[-1], parse_timestamp(timestamp))
+        return messages
+
+    record(results, "message_store_append", time_it(as_message_store, repeat), size,
+           dict_bytes=allocated_bytes(as_dicts), message_store_bytes=allocated_bytes(as_message_store))
+
+
+def bench_prompt_render(results: List[Dict], size: int, repeat: int):
+    template, _ = template_for("meta-llama/Meta-Llama-3-8B-Instruct")
+    history = synthetic_history(size)
+    budget = 10 ** 9  # Render everything, to time the rendering itself
+
+    def next_turn():
+        # A turn adds a question and its answer to an already rendered conversation
+        cache = PromptCache()
+        render_prompt(template, "system", history[:-2], budget, cache)
+        started = time.perf_counter()
+        render_prompt(template, "system", history, budget, cache)
+        return time.perf_counter() - started
+
+    record(results, "render_prompt", time_it(lambda: render_prompt(template, "system", history, budget), repeat),
+           size)
+    record(results, "render_prompt_cached", [next_turn() for _ in range(repeat)], size)
+
+
+def bench_inference(results: List[Dict], server_url: str, size: int, repeat: int):
+    messages = [{"role": m["role"], "content": m["content"]}
+                for m in synthetic_history(min(size, MAX_INFERENCE_MESSAGES))]
+    clients = {
+        "inference_openai": CloudInferenceClient("OpenAI Compatible", "mock-key",
+                                                 f"{server_url}/v1/chat/completions"),
+        "inference_together": CloudInferenceClient("Together AI", "mock-key"),
+        "inference_huggingface": CloudInferenceClient("Hugging Face", "mock-key"),
+    }
+    clients["inference_together"].backend_config = dict(
+        INFERENCE_BACKENDS["Together AI"], api_url=f"{server_url}/v1/chat/completions")
+    clients["inference_huggingface"].backend_config = dict(
+        INFERENCE_BACKENDS["Hugging Face"], api_url=f"{server_url}/models/")
+    for name, client in clients.items():
+        model = client.backend_config["models"][0] if client.backend_config["models"] else "mock"
+        client.chat(model, messages[:1], "system")  # warm up imports and the connection
+        record(results, name, time_it(lambda: client.chat(model, messages, "system"), repeat), len(messages))
+
+    # Ollama evaluates only what follows the prefix shared with the previous turn
+    ollama = ollama_client(host=server_url)
+    first, turn = {}, {}
+    conversation = messages[:-1]
+    conversation = conversation + [{"role": "assistant", "content": ollama_chat(ollama, "mock", conversation,
+                                                                                "system", first)},
+                                   {"role": "user", "content": "one more question"}]
+    ollama_chat(ollama, "mock", conversation, "system", turn)
+    record(results, "inference_ollama", time_it(lambda: ollama_chat(ollama, "mock", conversation, "system", {}),
+                                                repeat), len(conversation),
+           prompt_tokens=first["prompt_tokens"], next_turn_prefill_tokens=turn["prompt_tokens"])
+
+
+def bench_retrieval(results: List[Dict], workdir: str, server_url: str, size: int, repeat: int):
+    store = HistoryStore(os.path.join(workdir, f"retrieval-{size}"))
+    em = EncryptionManager(PASSPHRASE, store)
+    messages = MessageStore(em, store, memory_cap=2 ** 62)
+    for m in synthetic_history(size):
+        messages.append(m["role"], m["content"])
+    messages.save()
+
+    client = ollama_client(server_url)  # imports ollama outside the timed runs
+
+    def build_index():
+        memory = RetrievalMemory(em, store, model="mock-embed", client=client)
+        memory.reset()
+        while memory.index(messages, limit=256):
+            pass
+        return memory
+
+    record(results, "retrieval_index", time_it(build_index, 1), size)
+    memory = build_index()
+    messages.append("user", synthetic_history(1, seed=size)[0]["content"])
+    # Query embedding round trip, top-k search over the index and the prompt assembly
+    record(results, "retrieval_context", time_it(lambda: memory.context(messages, recent=2), repeat), size)
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    try:
+        from importlib.metadata import version
+        crypto_version = version("cryptography")
+    except Exception:
+        crypto_version = "unknown"
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cryptography": crypto_version
+    }
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> List[str]:
+    """Return descriptions of benchmarks that got slower than threshold x baseline
+
+    Compares best-of-N times, which are far less noisy than medians.
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {(r["name"], r["messages"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get((result["name"], result["messages"]))
+        if not before or before["seconds_min"] <= 0:
+            continue
+        ratio = result["seconds_min"] / before["seconds_min"]
+        result["baseline_ratio"] = ratio
+        if ratio > threshold:
+            regressions.append(f"{result['name']} ({result['messages']} msgs): {ratio:.2f}x slower")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="History sizes in messages")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Samples per benchmark at 1000 messages; smaller histories scale this up, "
+                             "larger ones run once (default: 3)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="Slowdown ratio reported as a regression (default: 1.5)")
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+    workdir = tempfile.mkdtemp(prefix="uncensorhub-bench-")
+    try:
+        bench_key_derivation(results, workdir, args.repeat)
+        with MockServer() as server:
+            for size in args.sizes:
+                # Scale samples so small histories still time a meaningful amount of work
+                repeat = args.repeat * (1000 // size) if size <= 1000 else 1
+                bench_history(results, workdir, size, repeat)
+                bench_unlock(results, workdir, size, repeat)
+                bench_branches(results, workdir, size, repeat)
+                bench_message_memory(results, workdir, size, repeat)
+                bench_prompt_render(results, size, repeat)
+                if size <= MAX_INFERENCE_MESSAGES:
+                    bench_inference(results, server.url, size, repeat)
+                if size <= MAX_RETRIEVAL_MESSAGES:
+                    bench_retrieval(results, workdir, server.url, size, repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    report = {"environment": environment(), "results": results, "regressions": regressions}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Test the headless batch CLI"""
+import json
+
+import pytest
+
+from uncensorhub.cli import HistoryResultWriter, read_jobs, summarize
+from uncensorhub.crypto import EncryptionManager
+from uncensorhub.history import load_encrypted_history
+from uncensorhub.store import HistoryStore
+
+
+def test_read_jobs_fills_per_line_defaults(tmp_path):
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text(
+        json.dumps({"prompt": "first"}) + "\n\n"
+        + json.dumps({"prompt": "second", "id": "x", "backend": "Together AI"}) + "\n"
+    )
+    jobs = read_jobs(str(prompts), "Local Ollama", None, "system")
+    assert [j["id"] for j in jobs] == ["1", "x"]
+    assert jobs[0]["model"] == "dolphin-llama3:8b"
+    assert jobs[1]["model"] == "cognitivecomputations/dolphin-2.5-mixtral-8x7b"
+
+
+def test_read_jobs_rejects_lines_without_prompt(tmp_path):
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text(json.dumps({"text": "oops"}) + "\n")
+    with pytest.raises(ValueError, match="prompts.jsonl:1"):
+        read_jobs(str(prompts), "Local Ollama", None, "system")
+
+
+def test_results_stream_into_history_store(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    em = EncryptionManager("batch_passphrase", store)
+    writer = HistoryResultWriter(store, em, flush_every=2)
+    results = [
+        {"id": str(i), "ok": True, "prompt": f"q{i}", "response": f"a{i}",
+         "timestamp": "2025-01-01 12:00:00", "latency_seconds": 0.1 * i}
+        for i in range(1, 4)
+    ]
+    results.append({"id": "4", "ok": False, "error": "boom", "latency_seconds": 1.0})
+    for result in results:
+        writer.write(result)
+    writer.close()
+
+    history = load_encrypted_history(em, store)
+    assert [m["content"] for m in history] == ["q1", "a1", "q2", "a2", "q3", "a3"]
+
+    summary = summarize(results, wall_seconds=2.0)
+    assert summary["failed"] == 1
+    assert summary["throughput_rps"] == 2.0
+    assert summary["latency_seconds"]["max"] == 1.0
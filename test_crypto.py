@@ -0,0 +1,38 @@
+"""Test the AEAD cipher engines and migration from Fernet"""
+import pytest
+
+from uncensorhub.crypto import EncryptionManager
+from uncensorhub.history import decrypt_record, encrypt_record, load_encrypted_history, migrate_history
+from uncensorhub.store import HistoryStore
+
+
+@pytest.mark.parametrize("engine", ["aesgcm", "chacha20"])
+def test_aead_records_bind_role_and_timestamp(tmp_path, engine):
+    store = HistoryStore(str(tmp_path / "store"))
+    em = EncryptionManager("test_passphrase", store, engine=engine)
+    record = encrypt_record(em, "user", "secret message", "2025-01-01 12:00:00")
+    assert record["content"].startswith(engine + ":")
+    assert decrypt_record(em, record) == "secret message"
+
+    with pytest.raises(ValueError):
+        decrypt_record(em, dict(record, timestamp="2025-01-01 12:00:01"))
+    with pytest.raises(ValueError):
+        decrypt_record(em, dict(record, role="assistant"))
+    with pytest.raises(ValueError):
+        decrypt_record(EncryptionManager("wrong_passphrase", store, engine=engine), record)
+
+
+def test_fernet_records_decrypt_and_migrate(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    legacy = EncryptionManager("test_passphrase", store, engine="fernet")
+    store.write_records([
+        encrypt_record(legacy, "user" if i % 2 == 0 else "assistant", f"message {i}", "2025-01-01 12:00:00")
+        for i in range(7)
+    ])
+
+    em = EncryptionManager("test_passphrase", store)
+    assert [m["content"] for m in load_encrypted_history(em, store)] == [f"message {i}" for i in range(7)]
+    assert migrate_history(em, store, batch_size=3) == 7
+    assert migrate_history(em, store) == 0
+    assert all(r["content"].startswith("aesgcm:") for r in store.read_records())
+    assert [m["content"] for m in load_encrypted_history(em, store)] == [f"message {i}" for i in range(7)]
@@ -1,7 +1,7 @@
 """Test encryption functionality"""
 import sys
 import os
-sys.path.insert(0, '/home/ubuntu/UncensorHub')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import EncryptionManager, validate_passphrase
 import json
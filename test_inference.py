@@ -0,0 +1,44 @@
+"""Test that Ollama turns keep a stable prompt prefix and report prefill per turn"""
+import os
+import sys
+
+from uncensorhub import config
+from uncensorhub.inference import chat_completion, ollama_chat, ollama_client
+from uncensorhub.metrics import TurnTimer, record_inference
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "benchmarks"))
+from mock_server import MockConfig, MockServer  # noqa: E402
+
+
+def test_prefill_covers_only_new_messages():
+    with MockServer(MockConfig(reply_tokens=5)) as server:
+        client = ollama_client(host=server.url)
+        history = []
+        evaluated = []
+        for i in range(4):
+            history.append({"role": "user", "content": f"question number {i} " + "word " * 50})
+            usage = {}
+            history.append({"role": "assistant",
+                            "content": ollama_chat(client, "mock-model", history, "be brief", usage)})
+            evaluated.append(usage["prompt_tokens"])
+        # The first turn evaluates the system prompt too; later ones only the new question
+        assert evaluated == [55, 53, 53, 53]
+
+        # Anything changed near the start (e.g. retrieved turns) means evaluating it all again
+        usage = {}
+        ollama_chat(client, "mock-model", [{"role": "system", "content": "retrieved"}] + history, "be brief", usage)
+        assert usage["prompt_tokens"] > 200
+
+        timer = TurnTimer()
+        record_inference(timer, "Local Ollama", usage)
+        assert "prefill" in timer.stages
+
+
+def test_local_backend_sends_system_prompt_as_message(monkeypatch):
+    with MockServer(MockConfig(reply_tokens=3)) as server:
+        monkeypatch.setattr(config, "OLLAMA_HOST", server.url)
+        usage = {}
+        messages = [{"role": "user", "content": "hello"}]
+        assert chat_completion(messages, "answer in French", "Local Ollama", "mock-model", usage=usage)
+        assert usage["prompt_tokens"] == 4  # "answer in French" + "hello"
+        assert server.httpd.contexts["mock-model"][0] == ("system", "answer in French")
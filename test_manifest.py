@@ -0,0 +1,153 @@
+"""Test signed integrity manifests for stored and exported history"""
+import io
+import json
+
+import pytest
+
+from uncensorhub.crypto import EncryptionManager
+from uncensorhub.history import (
+    encrypt_record,
+    export_history,
+    import_history,
+    load_encrypted_history,
+    save_encrypted_history
+)
+from uncensorhub.messages import MessageStore
+from uncensorhub.store import MANIFEST_FILE, HistoryStore
+
+
+def make_store(path, count=40):
+    store = HistoryStore(str(path))
+    em = EncryptionManager("test_passphrase", store)
+    history = [{"role": "user", "content": f"message {i}", "timestamp": "2025-01-01 12:00:00"} for i in range(count)]
+    save_encrypted_history(history, em, store)
+    return store, em
+
+
+def import_bundle(bundle, em, store):
+    return import_history(io.BytesIO(json.dumps(bundle).encode()), em, store)
+
+
+def test_backup_round_trip_and_tampering(tmp_path):
+    store, em = make_store(tmp_path / "source")
+    bundle = json.loads(export_history(store))
+    target = HistoryStore(str(tmp_path / "target"))
+    target_em = EncryptionManager.from_key(em.key, em.salt, em.engine)
+
+    ok, message = import_bundle(bundle, target_em, target)
+    assert ok, message
+    assert len(load_encrypted_history(target_em, target)) == 40
+
+    records = bundle["records"]
+    truncated = dict(bundle, records=records[:-1])
+    reordered = dict(bundle, records=[records[1], records[0]] + records[2:])
+    swapped = dict(bundle, records=records[:5] + [dict(records[5], content=records[6]["content"])] + records[6:])
+    for tampered in (truncated, reordered, swapped):
+        ok, message = import_bundle(tampered, target_em, target)
+        assert not ok and "integrity check failed" in message
+
+    ok, _ = import_bundle(bundle, EncryptionManager("wrong_passphrase", store), target)
+    assert not ok
+
+    # Removing the manifest does not turn a bundle into an unchecked legacy backup
+    for stripped in (dict(bundle, records=records[:-1], manifest=None),
+                     {k: v for k, v in truncated.items() if k != "manifest"}):
+        ok, message = import_bundle(stripped, target_em, target)
+        assert not ok and "manifest is missing" in message
+
+    # Backups exported before manifests existed are still decrypted in full
+    ok, message = import_bundle(records[:-1], target_em, target)
+    assert ok, message
+    assert len(load_encrypted_history(target_em, target)) == 39
+
+
+def test_store_manifest_detects_truncation(tmp_path):
+    store, em = make_store(tmp_path / "store", 10)
+    messages = MessageStore.load(em, store)
+    for i in range(3):
+        messages.append("user", f"question {i}")
+        messages.append("assistant", f"answer {i}")
+        messages.save()
+    assert len(load_encrypted_history(em, store)) == 16
+
+    # Cutting exactly the last save is not mistaken for an interrupted write
+    store.write_records(store.read_records()[:-2])
+    with pytest.raises(ValueError, match="integrity check failed"):
+        load_encrypted_history(em, store)
+    with pytest.raises(ValueError, match="Invalid passphrase"):
+        load_encrypted_history(EncryptionManager("wrong_passphrase", store), store)
+
+
+def test_interrupted_writes_still_load(tmp_path, monkeypatch):
+    store, em = make_store(tmp_path / "store", 10)
+    records = store.read_records()
+
+    # Crash between appending to the history and extending the manifest
+    store.write_records(records + [encrypt_record(em, "user", "unsigned", "2025-01-01 12:00:00")])
+    assert len(load_encrypted_history(em, store)) == 11
+    other = EncryptionManager("other_passphrase", store)
+    store.write_records(store.read_records() + [encrypt_record(other, "user", "forged", "2025-01-01 12:00:00")])
+    with pytest.raises(ValueError, match="integrity check failed"):
+        load_encrypted_history(em, store)
+
+    # Crash between replacing the history and committing its manifest
+    write_records = store.write_records
+
+    def crash(replacement):
+        write_records(replacement)
+        raise OSError("process stopped")
+
+    monkeypatch.setattr(store, "write_records", crash)
+    with pytest.raises(OSError):
+        save_encrypted_history([{"role": "user", "content": "replaced", "timestamp": "2025-01-01 12:00:00"}],
+                               em, store)
+    monkeypatch.undo()
+    assert [m["content"] for m in load_encrypted_history(em, store)] == ["replaced"]
+    store.write_records(records)
+    with pytest.raises(ValueError, match="integrity check failed"):
+        load_encrypted_history(em, store)
+
+
+def test_manifest_added_to_existing_history(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    em = EncryptionManager("test_passphrase", store)
+    store.write_records([encrypt_record(em, "user", f"message {i}", "2025-01-01 12:00:00") for i in range(5)])
+
+    with pytest.raises(ValueError):
+        load_encrypted_history(EncryptionManager("wrong_passphrase", store), store)
+    assert store.read_state(MANIFEST_FILE) is None
+    assert len(load_encrypted_history(em, store)) == 5
+    assert store.read_state(MANIFEST_FILE)["current"]["count"] == 5
+
+
+def test_delta_chain_restores_history(tmp_path):
+    store, em = make_store(tmp_path / "store", 10)
+    full = json.loads(export_history(store))
+    messages = MessageStore.load(em, store)
+    deltas, checkpoint = [], full["checkpoint"]
+    for batch in range(2):
+        for i in range(5):
+            messages.append("user", f"message {10 + 5 * batch + i}")
+        messages.save()
+        deltas.append(json.loads(export_history(store, since=checkpoint)))
+        checkpoint = deltas[-1]["checkpoint"]
+    assert [len(d["records"]) for d in deltas] == [5, 5]
+    overlapping = json.loads(export_history(store, since=full["checkpoint"]))
+
+    def restore(*backups):
+        store.clear()
+        files = [io.BytesIO(json.dumps(b).encode()) for b in backups]
+        return import_history(files, em, store)
+
+    # Out of order, overlapping and repeated deltas are de-duplicated
+    ok, message = restore(deltas[1], full, deltas[0], overlapping, deltas[0])
+    assert ok, message
+    assert [m["content"] for m in load_encrypted_history(em, store)] == [f"message {i}" for i in range(20)]
+    with pytest.raises(ValueError):
+        export_history(store, since="3-" + "0" * 32)
+
+    ok, message = restore(full, deltas[1])
+    assert not ok and "not part of this history" in message
+    tampered = dict(deltas[0], records=deltas[0]["records"][:-1])
+    ok, message = restore(full, tampered)
+    assert not ok and "integrity check failed" in message
@@ -0,0 +1,107 @@
+"""Test the compact, memory-bounded message store"""
+import json
+
+from uncensorhub import store as store_module
+from uncensorhub.crypto import EncryptionManager
+from uncensorhub.history import load_encrypted_history
+from uncensorhub.messages import MessageStore, format_timestamp, parse_timestamp
+from uncensorhub.store import HistoryStore
+
+
+def test_spilled_messages_stay_in_encrypted_history(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    em = EncryptionManager("test_passphrase", store)
+    messages = MessageStore(em, store, memory_cap=2000)
+    for i in range(20):
+        messages.append("user" if i % 2 == 0 else "assistant", f"message {i} " + "x" * 200)
+        messages.save()
+
+    assert len(messages) == 20
+    assert 0 < messages.spilled < 20
+    assert messages.resident_bytes <= 2000
+    resident = list(messages)
+    assert resident[-1].content.startswith("message 19 ")
+    assert [m["content"] for m in messages.api_messages()] == [m.content for m in resident]
+
+    # The file still holds every message, in order
+    history = load_encrypted_history(em, store)
+    assert [m["content"].split(" ")[1] for m in history] == [str(i) for i in range(20)]
+
+    reloaded = MessageStore.load(em, store, memory_cap=2000)
+    assert len(reloaded) == 20
+    assert [m.content for m in reloaded] == [m.content for m in resident][-len(list(reloaded)):]
+
+
+def test_records_are_role_content_mappings(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    messages = MessageStore(EncryptionManager("test_passphrase", store), store)
+    message = messages.append("user", "hello", parse_timestamp("2025-01-01 12:00:00"))
+    assert dict(message) == {"role": "user", "content": "hello"}
+    assert format_timestamp(message.timestamp) == "2025-01-01 12:00:00"
+    assert messages.save() > 0
+    assert messages.save() == 0
+
+    messages.clear()
+    assert len(messages) == 0 and not store.exists()
+
+
+def test_regenerate_and_edit_branch_off_shared_prefix(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    em = EncryptionManager("test_passphrase", store)
+    messages = MessageStore(em, store)
+    for content in ("q1", "a1", "q2", "a2"):
+        messages.append("user" if content[0] == "q" else "assistant", content)
+    messages.save()
+
+    # Regenerate the last reply, then edit the second question
+    assert messages.rewind(3) == 3
+    messages.append("assistant", "a2 again")
+    messages.save()
+    assert messages.alternatives(3) == (1, 2)
+    messages.rewind(2)
+    messages.append("user", "q2 edited")
+    messages.append("assistant", "a2 edited")
+    messages.save()
+    assert [m.content for m in messages] == ["q1", "a1", "q2 edited", "a2 edited"]
+
+    # The shared prefix is stored once; only the new branches' messages were added
+    records = store.read_records()
+    assert len(records) == 7
+    assert [r.get("parent") for r in records] == [None, None, None, None, 2, 1, None]
+
+    assert messages.switch(2, -1) == 2
+    assert [m.content for m in messages] == ["q1", "a1", "q2", "a2 again"]
+    messages.switch(3, 1)
+    assert [m.content for m in messages] == ["q1", "a1", "q2", "a2"]
+
+    # Reloading shows the branch with the newest message
+    reloaded = MessageStore.load(em, store)
+    assert [m.content for m in reloaded] == ["q1", "a1", "q2 edited", "a2 edited"]
+    assert reloaded.alternatives(2) == (1, 2) and reloaded.alternatives(1) == (0, 1)
+    assert [reloaded.record_index(p) for p in range(4)] == [0, 1, 5, 6]
+
+
+def test_switching_decrypts_only_the_changed_messages(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path / "store"))
+    em = EncryptionManager("test_passphrase", store)
+    messages = MessageStore(em, store, memory_cap=2000)
+    for i in range(20):
+        messages.append("user" if i % 2 == 0 else "assistant", f"message {i} " + "x" * 200)
+    messages.save()
+    messages.rewind(19)
+    messages.append("assistant", "another reply")
+    messages.save()
+
+    decrypted, parsed = [], []
+    original = em.decrypt
+    monkeypatch.setattr(em, "decrypt", lambda *args: decrypted.append(1) or original(*args))
+    monkeypatch.setattr(store_module.json, "load", lambda f: parsed.append(1) or json.loads(f.read()))
+    messages.switch(19, -1)
+    assert len(decrypted) == 1 and messages.resident_bytes <= 2000
+    assert not parsed  # The records parsed when saving are reused
+    assert list(messages)[-1].content.startswith("message 19 ")
+
+    # Rewinding into the spilled messages brings the newest ones back into memory
+    messages.rewind(3)
+    assert len(messages) == 3 and messages.spilled == 0
+    assert [m.content.split(" ")[1] for m in messages] == ["0", "1", "2"]
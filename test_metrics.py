@@ -0,0 +1,47 @@
+"""Test timing spans and Prometheus export"""
+import socket
+import warnings
+
+from uncensorhub import metrics
+from uncensorhub.metrics import MetricsRegistry, TurnTimer, export_metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("demo_seconds", "Demo", [0.1, 1.0], ["stage"])
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, stage='sa"ve')
+    text = registry.render_prometheus()
+    assert '# TYPE demo_seconds histogram' in text
+    assert 'demo_seconds_bucket{stage="sa\\"ve",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="sa\\"ve",le="1"} 3' in text
+    assert 'demo_seconds_bucket{stage="sa\\"ve",le="+Inf"} 4' in text
+    assert 'demo_seconds_count{stage="sa\\"ve"} 4' in text
+
+
+def test_turn_timer_accumulates_stages(tmp_path):
+    timer = TurnTimer()
+    with timer.span("save"):
+        pass
+    timer.add("ttft", 0.25)
+    timer.add("ttft", 1.0)
+    assert set(timer.stages) == {"save", "ttft"}
+    assert timer.summary().endswith("ttft 1.25 s")
+
+    path = tmp_path / "metrics.prom"
+    export_metrics(str(path))
+    assert 'uncensorhub_stage_seconds_count{stage="ttft"}' in path.read_text()
+
+
+def test_metrics_server_on_taken_port_warns_once(monkeypatch):
+    monkeypatch.setattr(metrics, "_server", None)
+    monkeypatch.setattr(metrics, "_server_failed", False)
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            assert metrics.start_metrics_server(port) is None
+            assert metrics.start_metrics_server(port) is None
+        assert len(caught) == 1 and str(port) in str(caught[0].message)
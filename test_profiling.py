@@ -0,0 +1,38 @@
+"""Test opt-in rerun profiling"""
+import pytest
+
+from uncensorhub import profiling
+
+
+def test_reports_contain_locations_not_content(tmp_path):
+    settings = profiling.ProfileSettings(cprofile=True, tracemalloc=True, every=1, directory=str(tmp_path))
+    kept = []
+
+    def main():
+        secret = "TOP-SECRET-MESSAGE " * 100
+        kept.append(secret)
+        return len(secret)
+
+    assert profiling.run(main, settings) == 1900
+    profiling.run(main, settings)
+    reports = sorted(tmp_path.iterdir())
+    assert len(reports) == 2
+    text = reports[-1].read_text()
+    assert "== cProfile" in text and "test_profiling.py" in text
+    assert "growth since previous profiled rerun" in text
+    assert "TOP-SECRET" not in text
+    assert oct(reports[-1].stat().st_mode & 0o777) == "0o600"
+
+
+def test_slow_threshold_and_exceptions(tmp_path):
+    settings = profiling.ProfileSettings(cprofile=True, slow_ms=10_000, directory=str(tmp_path / "p"))
+    profiling.run(lambda: None, settings)
+    assert not (tmp_path / "p").exists()
+
+    def stop():
+        raise RuntimeError("rerun")
+
+    settings.slow_ms = 0
+    with pytest.raises(RuntimeError):
+        profiling.run(stop, settings)
+    assert len(list((tmp_path / "p").iterdir())) == 1
@@ -0,0 +1,123 @@
+"""Test streaming, resumable passphrase changes"""
+import os
+
+import pytest
+
+from uncensorhub import rekey
+from uncensorhub.crypto import EncryptionManager
+from uncensorhub.history import encrypt_record, load_encrypted_history
+from uncensorhub.messages import MessageStore
+from uncensorhub.store import HistoryStore, open_store
+from uncensorhub.unlock import unlock
+
+
+def make_store(path, count):
+    store = HistoryStore(str(path))
+    em = EncryptionManager("old_passphrase", store)
+    store.write_records([encrypt_record(em, "user", f"message {i}", "2025-01-01 12:00:00") for i in range(count)])
+    return store, em
+
+
+def test_rekey_while_saving(tmp_path):
+    store, em = make_store(tmp_path / "store", 50)
+    messages = MessageStore.load(em, store)
+    job = rekey.start_rekey(store, em, "old_passphrase", "new_passphrase")
+    job.batch_size = 7
+    job.on_switch(messages.switch_encryption_manager)
+
+    thread = rekey.start_background_rekey(job)
+    for i in range(50, 60):
+        messages.append("user", f"message {i}")
+        messages.save()
+    thread.join()
+    messages.append("user", "message 60")
+    messages.save()
+
+    assert job.finished and job.error is None and job.progress == 1.0
+    new_em = EncryptionManager("new_passphrase", store)
+    contents = [m["content"] for m in load_encrypted_history(new_em, store)]
+    assert contents == [f"message {i}" for i in range(61)]
+    with pytest.raises(ValueError):
+        load_encrypted_history(EncryptionManager("old_passphrase", store), store)
+
+
+def test_interrupted_rekey_resumes(tmp_path):
+    store, em = make_store(tmp_path / "store", 20)
+    job = rekey.start_rekey(store, em, "old_passphrase", "new_passphrase")
+    job.batch_size = 6
+    assert not job._run_batch()
+
+    # Crash after writing a batch but before its checkpoint
+    records = store.read_records()
+    for i in range(6, 9):
+        records[i] = job._rekey_record(records[i])
+    store.write_records(records)
+    rekey._jobs.clear()
+
+    with pytest.raises(ValueError):
+        rekey.start_rekey(store, em, "old_passphrase", "other_passphrase")
+    assert rekey.pending_rekey(store, EncryptionManager("wrong_passphrase", store)) is None
+    resumed = rekey.pending_rekey(store, EncryptionManager("old_passphrase", store))
+    new_em = resumed.run()
+    assert [m["content"] for m in load_encrypted_history(new_em, store)] == [f"message {i}" for i in range(20)]
+    assert rekey.pending_rekey(store, new_em) is None
+
+
+def test_passphrase_store_moves_to_new_id(tmp_path):
+    store = open_store(passphrase="old_passphrase", data_dir=str(tmp_path))
+    em = EncryptionManager("old_passphrase", store)
+    store.write_records([encrypt_record(em, "user", "hello", "2025-01-01 12:00:00")])
+    with pytest.raises(ValueError):
+        rekey.start_rekey(store, em, "wrong_passphrase", "new_passphrase")
+
+    rekey.start_rekey(store, em, "old_passphrase", "new_passphrase").run()
+    moved = open_store(passphrase="new_passphrase", data_dir=str(tmp_path))
+    assert moved is store
+    assert load_encrypted_history(EncryptionManager("new_passphrase", moved), moved)[0]["content"] == "hello"
+
+
+def test_unlock_with_new_passphrase_during_change(tmp_path):
+    data_dir = str(tmp_path)
+    store = open_store(passphrase="old_passphrase", data_dir=data_dir)
+    old_directory = store.directory
+    em = EncryptionManager("old_passphrase", store)
+    store.write_records([encrypt_record(em, "user", f"message {i}", "2025-01-01 12:00:00") for i in range(10)])
+    job = rekey.start_rekey(store, em, "old_passphrase", "new_passphrase")
+    job.batch_size = 4
+    assert not job._run_batch()
+
+    # Opening a store does not create it; unlocking leaves an empty one with just a salt
+    stores = sorted(os.listdir(data_dir))
+    open_store(passphrase="new_passphrase", data_dir=data_dir)
+    assert sorted(os.listdir(data_dir)) == stores
+    assert len(unlock("new_passphrase", data_dir=data_dir, retrieval=False)[2]) == 0
+
+    new_em = job.run()
+    moved = open_store(passphrase="new_passphrase", data_dir=data_dir)
+    assert moved is store and not os.path.exists(old_directory)
+    assert [m["content"] for m in load_encrypted_history(new_em, moved)] == [f"message {i}" for i in range(10)]
+
+
+@pytest.mark.parametrize("crash_in", ["relocate_store", "replace_salt"])
+def test_crash_while_finishing_resumes(tmp_path, monkeypatch, crash_in):
+    data_dir = str(tmp_path)
+    store = open_store(passphrase="old_passphrase", data_dir=data_dir)
+    em = EncryptionManager("old_passphrase", store)
+    store.write_records([encrypt_record(em, "user", f"message {i}", "2025-01-01 12:00:00") for i in range(5)])
+    job = rekey.start_rekey(store, em, "old_passphrase", "new_passphrase")
+
+    def crash(*args, **kwargs):
+        raise OSError("process stopped")
+
+    target = rekey if crash_in == "relocate_store" else store
+    monkeypatch.setattr(target, crash_in, crash)
+    with pytest.raises(ValueError):
+        job.run()
+    monkeypatch.undo()
+
+    # Before the move the old passphrase finishes the change; after it, the new one does
+    if crash_in == "relocate_store":
+        assert unlock("old_passphrase", data_dir=data_dir, retrieval=False)[0] is store
+    _, new_em, history, _ = unlock("new_passphrase", data_dir=data_dir, retrieval=False)
+    assert [m.content for m in history] == [f"message {i}" for i in range(5)]
+    assert new_em.salt == job.new_manager.salt and store.read_state(rekey.REKEY_FILE) is None
@@ -0,0 +1,136 @@
+"""Test the encrypted embedding index and retrieval of earlier turns"""
+import os
+import sys
+
+from uncensorhub import rekey
+from uncensorhub.crypto import EncryptionManager
+from uncensorhub.history import load_encrypted_history, save_encrypted_history
+from uncensorhub.messages import MessageStore
+from uncensorhub.retrieval import MEMORY_PREAMBLE, RetrievalMemory
+from uncensorhub.store import MEMORY_FILE, HistoryStore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "benchmarks"))
+from mock_server import embed_text  # noqa: E402
+
+TOPICS = ["sourdough bread baking", "kernel memory allocator", "alpine hiking routes", "jazz chord voicings"]
+
+
+class FakeEmbedClient:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    def embed(self, model, input):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("embedding model not found")
+        return {"embeddings": [embed_text(text) for text in input]}
+
+
+def make_session(path, turns=12):
+    store = HistoryStore(str(path))
+    em = EncryptionManager("test_passphrase", store)
+    messages = MessageStore(em, store)
+    for i in range(turns):
+        topic = TOPICS[i % len(TOPICS)]
+        messages.append("user", f"question {i} about {topic}")
+        messages.append("assistant", f"answer {i} on {topic}")
+    messages.save()
+    return store, em, messages
+
+
+def test_context_injects_relevant_turns(tmp_path):
+    store, em, messages = make_session(tmp_path / "store")
+    client = FakeEmbedClient()
+    memory = RetrievalMemory(em, store, model="mock-embed", client=client)
+    while memory.index(messages, limit=10):
+        pass
+    assert memory.count == 24
+
+    messages.append("user", "more about kernel memory allocator please")
+    payload = memory.context(messages, recent=4, top_k=2)
+    assert len(payload) == 5 and payload[0]["role"] == "system"
+    injected = payload[0]["content"]
+    assert injected.startswith(MEMORY_PREAMBLE) and "answer 1 on kernel memory allocator" in injected
+    assert "alpine" not in injected and "jazz" not in injected
+    assert payload[-1]["content"] == "more about kernel memory allocator please"
+
+    # The index is stored encrypted and reloads under the same key only
+    assert "kernel" not in (tmp_path / "store" / MEMORY_FILE).read_text()
+    assert RetrievalMemory.load(em, store, model="mock-embed", client=client).count == 24
+    other = EncryptionManager("other_passphrase", HistoryStore(str(tmp_path / "other")))
+    assert RetrievalMemory.load(other, store, model="mock-embed", client=client).count == 0
+
+
+def test_falls_back_without_embedding_model(tmp_path):
+    store, em, messages = make_session(tmp_path / "store")
+    client = FakeEmbedClient()
+    client.fail = True
+    memory = RetrievalMemory(em, store, model="mock-embed", client=client)
+    assert memory.index(messages) == 0
+    assert not memory.available and "not found" in memory.last_error
+
+    messages.append("user", "anything")
+    assert memory.context(messages, recent=4) is None
+    assert client.calls == 1  # Not retried on every turn
+
+    assert RetrievalMemory(em, store, model="").context(messages, recent=4) is None
+
+
+def test_replaced_history_resets_index(tmp_path):
+    store, em, messages = make_session(tmp_path / "store", turns=6)
+    memory = RetrievalMemory(em, store, model="mock-embed", client=FakeEmbedClient())
+    memory.index(messages)
+    assert memory.count == 12
+
+    # Same length, different messages (e.g. an imported backup)
+    replaced = [{"role": m["role"], "content": m["content"].upper(), "timestamp": "2025-01-01 12:00:00"}
+                for m in load_encrypted_history(em, store)]
+    save_encrypted_history(replaced, em, store)
+    messages = MessageStore.load(em, store)
+    messages.append("user", "question about jazz chord voicings")
+    assert memory.context(messages, recent=4) is None
+    assert memory.count == 0 and store.read_state(MEMORY_FILE) is None
+
+    messages.clear()
+    assert memory.index(messages) == 0
+
+
+def test_rewind_drops_index_past_branch_point(tmp_path):
+    store, em, messages = make_session(tmp_path / "store", turns=6)
+    client = FakeEmbedClient()
+    memory = RetrievalMemory(em, store, model="mock-embed", client=client)
+    memory.index(messages)
+    assert memory.count == 12
+
+    # Edit the fifth question: the index keeps the four messages before it
+    memory.rewind(messages.rewind(4))
+    assert memory.count == 4 and store.read_state(MEMORY_FILE)["count"] == 4
+    messages.append("user", "question about jazz chord voicings")
+    messages.append("assistant", "answer on jazz chord voicings")
+    messages.save()
+    assert memory.index(messages) == 2
+    assert RetrievalMemory.load(em, store, model="mock-embed", client=client).count == 6
+
+
+def test_context_falls_back_during_passphrase_change(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    em = EncryptionManager("test_passphrase", store)
+    messages = MessageStore(em, store, memory_cap=500)
+    for i in range(12):
+        topic = TOPICS[i % len(TOPICS)]
+        messages.append("user", f"question {i} about {topic}")
+        messages.append("assistant", f"answer {i} on {topic}")
+        messages.save()
+    assert messages.spilled > 4
+    memory = RetrievalMemory(em, store, model="mock-embed", client=FakeEmbedClient())
+    while memory.index(messages):
+        pass
+
+    # The first batch is re-keyed; the session still holds the old key until the switch
+    job = rekey.start_rekey(store, em, "test_passphrase", "new_passphrase")
+    job.batch_size = 10
+    assert not job._run_batch()
+    messages.append("user", "more about kernel memory allocator please")
+    assert memory.context(messages, recent=4, top_k=2) is None
+    assert "Invalid passphrase" in memory.last_error
@@ -0,0 +1,51 @@
+"""Test per-user history stores"""
+import threading
+
+from uncensorhub.store import HistoryStore, derive_store_id, open_store
+
+
+def test_store_ids_are_separate_per_user(tmp_path):
+    alice = open_store(user_id="alice", data_dir=str(tmp_path))
+    bob = open_store(user_id="bob", data_dir=str(tmp_path))
+    assert alice.directory != bob.directory
+    assert alice.load_or_create_salt() != bob.load_or_create_salt()
+    assert open_store(user_id="alice", data_dir=str(tmp_path)) is alice
+
+
+def test_passphrase_store_id_is_stable(tmp_path):
+    first = derive_store_id(passphrase="correct horse", data_dir=str(tmp_path))
+    second = derive_store_id(passphrase="correct horse", data_dir=str(tmp_path))
+    other = derive_store_id(passphrase="battery staple", data_dir=str(tmp_path))
+    assert first == second
+    assert first != other
+
+
+def test_concurrent_writes_never_tear(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+
+    def writer(n):
+        for _ in range(20):
+            store.write_records([{"role": "user", "content": str(n), "timestamp": "t"}] * n)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    records = store.read_records()
+    assert len({r["content"] for r in records}) == 1
+    assert len(records) == int(records[0]["content"])
+
+
+def test_parsed_records_are_cached_until_replaced(tmp_path):
+    store = HistoryStore(str(tmp_path / "store"))
+    store.write_records([{"role": "user", "content": "a", "timestamp": "t"}])
+    assert store.shared_records() is store.shared_records()
+    copy = store.read_records()
+    copy.append({"role": "user", "content": "b", "timestamp": "t"})
+    assert store.record_count() == 1
+
+    # Another process (here: another store object) replaces the file
+    HistoryStore(str(tmp_path / "store")).append_records([{"role": "assistant", "content": "c", "timestamp": "t"}])
+    assert [r["content"] for r in store.shared_records()] == ["a", "c"]
@@ -0,0 +1,70 @@
+"""Test per-model chat templates, incremental rendering and the input token budget"""
+import pytest
+
+from uncensorhub.templates import PromptCache, estimate_tokens, render_prompt, template_for
+
+LLAMA3 = "meta-llama/Meta-Llama-3-8B-Instruct"
+MIXTRAL = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+DOLPHIN = "cognitivecomputations/dolphin-2.9-llama3-8b"
+
+
+def conversation(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i}"})
+        messages.append({"role": "assistant", "content": f"answer {i}"})
+    return messages + [{"role": "user", "content": "latest"}]
+
+
+def test_model_templates():
+    messages = conversation(1)
+    template, _ = template_for(LLAMA3)
+    assert render_prompt(template, "Be brief.", messages, 8000) == (
+        "<|start_header_id|>system<|end_header_id|>\n\nBe brief.<|eot_id|>"
+        "<|start_header_id|>user<|end_header_id|>\n\nquestion 0<|eot_id|>"
+        "<|start_header_id|>assistant<|end_header_id|>\n\nanswer 0<|eot_id|>"
+        "<|start_header_id|>user<|end_header_id|>\n\nlatest<|eot_id|>"
+        "<|start_header_id|>assistant<|end_header_id|>\n\n")
+
+    template, _ = template_for(MIXTRAL)
+    assert render_prompt(template, "Be brief.", messages, 8000) == (
+        "[INST] Be brief.\n\nquestion 0 [/INST] answer 0</s>[INST] latest [/INST]")
+
+    # Retrieved turns arrive as a leading system message and join the system prompt
+    template, _ = template_for(DOLPHIN)
+    prompt = render_prompt(template, "Be brief.", [{"role": "system", "content": "Earlier: x"}] + messages, 8000)
+    assert prompt.startswith("<|im_start|>system\nBe brief.\n\nEarlier: x<|im_end|>\n<|im_start|>user\n")
+    assert prompt.endswith("<|im_start|>user\nlatest<|im_end|>\n<|im_start|>assistant\n")
+
+    assert template_for("some/unknown-model")[0].name == "plain"
+
+
+def test_cache_renders_only_new_messages():
+    template, _ = template_for(DOLPHIN)
+    messages = conversation(50)
+    cache = PromptCache()
+    first = render_prompt(template, "sys", messages, 100000, cache)
+    pieces = list(cache._pieces)
+
+    messages += [{"role": "assistant", "content": "reply"}, {"role": "user", "content": "next"}]
+    second = render_prompt(template, "sys", messages, 100000, cache)
+    assert all(a is b for a, b in zip(pieces, cache._pieces))  # Earlier pieces reused, not re-rendered
+    assert second == render_prompt(template, "sys", messages, 100000)
+    assert second.startswith(first[:-len(template.generation)])
+
+    # An edited message invalidates the cache from that point on
+    messages[10] = {"role": "user", "content": "edited"}
+    assert "edited" in render_prompt(template, "sys", messages, 100000, cache)
+
+
+def test_budget_drops_oldest_messages():
+    template, _ = template_for(MIXTRAL)
+    messages = conversation(200)
+    budget = 300
+    prompt = render_prompt(template, "Be brief.", messages, budget, PromptCache())
+    assert estimate_tokens(prompt) <= budget
+    assert prompt.startswith("[INST] Be brief.\n\nquestion ") and prompt.endswith("[INST] latest [/INST]")
+    assert "question 0 " not in prompt
+
+    with pytest.raises(ValueError, match="too long"):
+        render_prompt(template, "Be brief.", [{"role": "user", "content": "word " * 2000}], budget)
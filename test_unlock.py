@@ -0,0 +1,82 @@
+"""Test the concurrent unlock pipeline and backend warm-up"""
+import os
+import sys
+
+import pytest
+
+from uncensorhub import config
+from uncensorhub.crypto import EncryptionManager
+from uncensorhub.manifest import check_store_manifest
+from uncensorhub.messages import MessageStore
+from uncensorhub.metrics import TurnTimer
+from uncensorhub.store import open_store
+from uncensorhub.unlock import start_warm_up, unlock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "benchmarks"))
+from mock_server import MockConfig, MockServer  # noqa: E402
+
+
+def test_unlock_loads_history_with_prefetched_records(tmp_path):
+    store = open_store(user_id="alice", data_dir=str(tmp_path))
+    messages = MessageStore(EncryptionManager("test_passphrase", store), store)
+    for i in range(10):
+        messages.append("user", f"message {i}")
+    messages.save()
+
+    timer = TurnTimer()
+    unlocked, em, history, memory = unlock("test_passphrase", user_id="alice", timer=timer, data_dir=str(tmp_path))
+    assert unlocked is store and em.key == messages.encryption_manager.key
+    assert [m.content for m in history] == [f"message {i}" for i in range(10)]
+    assert {"kdf", "history_read", "memory_read", "history_decrypt", "memory"} <= set(timer.stages)
+    assert store._prefetched is None
+
+    with pytest.raises(ValueError):
+        unlock("wrong_passphrase", user_id="alice", data_dir=str(tmp_path))
+
+
+def test_prefetched_records_are_dropped_once_replaced(tmp_path):
+    store = open_store(user_id="bob", data_dir=str(tmp_path))
+    em = EncryptionManager("test_passphrase", store)
+    messages = MessageStore(em, store)
+    messages.append("user", "first")
+    messages.save()
+
+    # Another session saves between the prefetch and the load
+    store.prefetch_records()
+    stale = store._prefetched[1]
+    other = MessageStore.load(em, store)
+    assert len(other) == 1 and store._prefetched is None
+    store.prefetch_records()
+    other.append("user", "second")
+    other.save()
+    assert len(MessageStore.load(em, store)) == 2
+
+    # A copy read before that append still verifies; a rewritten history does not
+    check_store_manifest(em, store, stale)
+    with pytest.raises(ValueError, match="changed by another session"):
+        check_store_manifest(em, store, stale + [dict(stale[0], timestamp="2025-01-01 12:00:00")])
+
+
+def test_warm_up_runs_in_background(monkeypatch):
+    with MockServer(MockConfig(ttft=0.01)) as server:
+        monkeypatch.setattr(config, "OLLAMA_HOST", server.url)
+        warm_up = start_warm_up("Local Ollama", "mock-model")
+        assert warm_up.wait(10) and warm_up.error is None and warm_up.seconds > 0
+        assert server.stats["generate 200"] == 1
+
+    monkeypatch.setattr(config, "OLLAMA_HOST", server.url)  # Closed now
+    warm_up = start_warm_up("Local Ollama", "mock-model")
+    assert warm_up.wait(10) and warm_up.error
+
+
+def test_unlock_without_retrieval_skips_the_index(tmp_path):
+    store = open_store(user_id="carol", data_dir=str(tmp_path))
+    messages = MessageStore(EncryptionManager("test_passphrase", store), store)
+    messages.append("user", "hello")
+    messages.save()
+
+    timer = TurnTimer()
+    _, _, history, memory = unlock("test_passphrase", user_id="carol", timer=timer, data_dir=str(tmp_path),
+                                   retrieval=False)
+    assert len(history) == 1 and not memory.enabled and not memory.available
+    assert "memory_read" not in timer.stages and "memory" not in timer.stages
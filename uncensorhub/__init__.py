@@ -0,0 +1,44 @@
+"""
+UncensorHub core: encryption, history stores and inference backends
+shared by app.py and app_cloud.py.
+
+Names are resolved lazily (PEP 562) so importing the package is cheap;
+the heavy third-party modules load only when a feature first needs them.
+"""
+
+import importlib
+
+_EXPORTS = {
+    "AVAILABLE_MODELS": "config",
+    "DEFAULT_SYSTEM_PROMPT": "config",
+    "INFERENCE_BACKENDS": "config",
+    "EncryptionManager": "crypto",
+    "HistoryStore": "store",
+    "open_store": "store",
+    "load_encrypted_history": "history",
+    "save_encrypted_history": "history",
+    "export_history": "history",
+    "import_history": "history",
+    "Message": "messages",
+    "MessageStore": "messages",
+    "CloudInferenceClient": "inference",
+    "get_ai_response": "inference",
+    "ollama_available": "inference",
+    "ollama_client": "inference",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f".{module_name}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
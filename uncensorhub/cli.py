@@ -0,0 +1,328 @@
+"""
+UncensorHub: Headless command-line interface
+
+Run a JSONL file of prompts through any inference backend with a pool of
+concurrent workers, streaming results into the encrypted history store or
+an encrypted output file:
+
+    python -m uncensorhub batch prompts.jsonl --workers 8 --user alice
+    python -m uncensorhub batch prompts.jsonl --output results.enc.jsonl
+    python -m uncensorhub decrypt results.enc.jsonl
+
+Back up the encrypted history, in full or only what changed since the
+checkpoint printed by an earlier export, and restore a backup plus changes:
+
+    python -m uncensorhub export full.json
+    python -m uncensorhub export changes.json --since 1200-3fa9c2...
+    python -m uncensorhub import full.json changes-1.json changes-2.json
+
+Each input line is a JSON object with a "prompt" and optionally "id",
+"model", "backend" and "system_prompt" overriding the command-line defaults.
+The passphrase is read from UNCENSORHUB_PASSPHRASE or prompted for, and cloud
+API keys from UNCENSORHUB_API_KEY.
+"""
+
+import argparse
+import getpass
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .config import DEFAULT_SYSTEM_PROMPT, INFERENCE_BACKENDS
+from .crypto import EncryptionManager
+from .history import encrypt_record, export_history, import_history
+from .inference import chat_completion
+from .manifest import append_history, check_store_manifest
+from .store import HistoryStore, open_store
+
+PASSPHRASE_ENV = "UNCENSORHUB_PASSPHRASE"
+API_KEY_ENV = "UNCENSORHUB_API_KEY"
+
+
+def read_jobs(path: str, backend: str, model: Optional[str], system_prompt: str) -> List[Dict]:
+    """Parse a JSONL prompt file, filling per-line defaults
+
+    A line that overrides the backend but not the model gets that backend's
+    first listed model rather than the command-line default.
+    """
+    jobs = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {str(e)}")
+            if not isinstance(entry, dict) or not isinstance(entry.get("prompt"), str):
+                raise ValueError(f"{path}:{line_number}: expected an object with a \"prompt\" string")
+            job_backend = entry.get("backend", backend)
+            if job_backend not in INFERENCE_BACKENDS:
+                raise ValueError(f"{path}:{line_number}: unknown backend {job_backend!r}")
+            job_model = entry.get("model")
+            if not job_model:
+                job_model = model if job_backend == backend and model else _default_model(job_backend)
+            if not job_model:
+                raise ValueError(f"{path}:{line_number}: no model given for backend {job_backend!r}")
+            jobs.append({
+                "id": str(entry.get("id", line_number)),
+                "prompt": entry["prompt"],
+                "backend": job_backend,
+                "model": job_model,
+                "system_prompt": entry.get("system_prompt", system_prompt)
+            })
+    return jobs
+
+
+def _default_model(backend: str) -> Optional[str]:
+    models = INFERENCE_BACKENDS[backend]["models"]
+    return models[0] if models else None
+
+
+def run_job(job: Dict, api_key: Optional[str], custom_url: Optional[str]) -> Dict:
+    """Run one prompt and time it; failures are captured, never raised"""
+    started = time.perf_counter()
+    result = dict(job)
+    try:
+        result["response"] = chat_completion(
+            [{"role": "user", "content": job["prompt"]}],
+            job["system_prompt"],
+            job["backend"],
+            job["model"],
+            api_key,
+            custom_url
+        )
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+        result["ok"] = False
+    result["latency_seconds"] = time.perf_counter() - started
+    result["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return result
+
+
+class HistoryResultWriter:
+    """Appends completed prompt/response pairs to a user's encrypted history"""
+
+    def __init__(self, store: HistoryStore, encryption_manager: EncryptionManager, flush_every: int = 10):
+        self.store = store
+        self.encryption_manager = encryption_manager
+        self.flush_every = max(1, flush_every)
+        self._pending: List[Dict] = []
+        self._lock = threading.Lock()
+        # Fail before any requests are sent if the passphrase is wrong or the history was altered
+        check_store_manifest(encryption_manager, store, store.read_records())
+
+    def write(self, result: Dict):
+        if not result["ok"]:
+            return
+        records = [
+            encrypt_record(self.encryption_manager, role, content, result["timestamp"])
+            for role, content in (("user", result["prompt"]), ("assistant", result["response"]))
+        ]
+        with self._lock:
+            self._pending.extend(records)
+            if len(self._pending) >= 2 * self.flush_every:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            with self.store.lock():
+                append_history(self.encryption_manager, self.store, self._pending)
+            self._pending = []
+
+
+class EncryptedFileResultWriter:
+    """Streams every result, including failures, as one encrypted JSON line"""
+
+    def __init__(self, path: str, encryption_manager: EncryptionManager):
+        self.encryption_manager = encryption_manager
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def write(self, result: Dict):
+        line = json.dumps({"content": self.encryption_manager.encrypt(json.dumps(result))})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(results: List[Dict], wall_seconds: float) -> Dict:
+    """Throughput, failure and latency statistics for a finished batch"""
+    latencies = [r["latency_seconds"] for r in results]
+    failures = [r for r in results if not r["ok"]]
+    return {
+        "requests": len(results),
+        "succeeded": len(results) - len(failures),
+        "failed": len(failures),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(results) / wall_seconds if wall_seconds > 0 else 0.0,
+        "latency_seconds": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0)
+        },
+        "failures": [{"id": r["id"], "error": r["error"]} for r in failures]
+    }
+
+
+def _read_passphrase() -> str:
+    passphrase = os.environ.get(PASSPHRASE_ENV) or getpass.getpass("Passphrase: ")
+    if len(passphrase) < 8:
+        raise SystemExit("Passphrase must be at least 8 characters")
+    return passphrase
+
+
+def cmd_batch(args) -> int:
+    jobs = read_jobs(args.prompts, args.backend, args.model, args.system_prompt)
+    passphrase = _read_passphrase()
+    store = open_store(user_id=args.user, passphrase=passphrase)
+    encryption_manager = EncryptionManager(passphrase, store)
+    if args.output:
+        writer = EncryptedFileResultWriter(args.output, encryption_manager)
+    else:
+        writer = HistoryResultWriter(store, encryption_manager, args.flush_every)
+    api_key = os.environ.get(API_KEY_ENV)
+
+    results = []
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(run_job, job, api_key, args.custom_url) for job in jobs]
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                results.append(result)
+                writer.write(result)
+                status = "ok  " if result["ok"] else "FAIL"
+                detail = "" if result["ok"] else f"  {result['error']}"
+                print(f"[{done:>{len(str(len(jobs)))}}/{len(jobs)}] {status} id={result['id']} "
+                      f"{result['latency_seconds']:.3f}s{detail}", file=sys.stderr)
+    finally:
+        writer.close()
+
+    summary = summarize(results, time.perf_counter() - started)
+    latency = summary["latency_seconds"]
+    print(f"{summary['requests']} requests in {summary['wall_seconds']:.2f}s "
+          f"({summary['throughput_rps']:.2f} req/s), {summary['failed']} failed; "
+          f"latency p50 {latency['p50']:.3f}s p90 {latency['p90']:.3f}s "
+          f"p99 {latency['p99']:.3f}s max {latency['max']:.3f}s", file=sys.stderr)
+    if args.report:
+        summary["per_request"] = [
+            {"id": r["id"], "ok": r["ok"], "latency_seconds": r["latency_seconds"]} for r in results
+        ]
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["failed"] else 0
+
+
+def cmd_decrypt(args) -> int:
+    passphrase = _read_passphrase()
+    store = open_store(user_id=args.user, passphrase=passphrase)
+    encryption_manager = EncryptionManager(passphrase, store)
+    with open(args.results, 'r') as f:
+        for line in f:
+            if line.strip():
+                print(encryption_manager.decrypt(json.loads(line)["content"]))
+    return 0
+
+
+def cmd_export(args) -> int:
+    passphrase = _read_passphrase()
+    store = open_store(user_id=args.user, passphrase=passphrase)
+    check_store_manifest(EncryptionManager(passphrase, store), store, store.read_records())
+    backup = export_history(store, args.since)
+    if backup is None:
+        raise ValueError("No history to export")
+    with open(args.output, 'w') as f:
+        f.write(backup)
+    print(f"Checkpoint: {json.loads(backup)['checkpoint']}", file=sys.stderr)
+    return 0
+
+
+def cmd_import(args) -> int:
+    passphrase = _read_passphrase()
+    store = open_store(user_id=args.user, passphrase=passphrase)
+    files = [open(path, 'rb') for path in args.backups]
+    try:
+        success, message = import_history(files, EncryptionManager(passphrase, store), store)
+    finally:
+        for f in files:
+            f.close()
+    print(message, file=sys.stderr)
+    return 0 if success else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m uncensorhub",
+        description="Headless UncensorHub tools",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch = subparsers.add_parser("batch", help="Run a JSONL file of prompts")
+    batch.add_argument("prompts", help="JSONL file, one {\"prompt\": ...} object per line")
+    batch.add_argument("--backend", default="Local Ollama", choices=list(INFERENCE_BACKENDS),
+                       help="Default inference backend")
+    batch.add_argument("--model", help="Default model (default: the backend's first listed model)")
+    batch.add_argument("--system-prompt", default=DEFAULT_SYSTEM_PROMPT, help="Default system prompt")
+    batch.add_argument("--custom-url", help="Endpoint for the OpenAI Compatible backend")
+    batch.add_argument("--workers", type=int, default=4, help="Concurrent requests (default: 4)")
+    batch.add_argument("--user", help="User ID selecting the history store (default: derived from passphrase)")
+    batch.add_argument("--output", help="Write encrypted results here instead of the history store")
+    batch.add_argument("--flush-every", type=int, default=10,
+                       help="Results buffered before each history store write (default: 10)")
+    batch.add_argument("--report", help="Write throughput and latency statistics as JSON")
+    batch.set_defaults(func=cmd_batch)
+
+    decrypt = subparsers.add_parser("decrypt", help="Print an encrypted batch output file")
+    decrypt.add_argument("results", help="File written by batch --output")
+    decrypt.add_argument("--user", help="User ID the results were written under")
+    decrypt.set_defaults(func=cmd_decrypt)
+
+    export = subparsers.add_parser("export", help="Export the encrypted history, or only recent changes")
+    export.add_argument("output", help="File to write the backup to")
+    export.add_argument("--since", help="Checkpoint id of an earlier export; include only later records")
+    export.add_argument("--user", help="User ID selecting the history store (default: derived from passphrase)")
+    export.set_defaults(func=cmd_export)
+
+    restore = subparsers.add_parser("import", help="Replace the history with a backup and/or change files")
+    restore.add_argument("backups", nargs="+", help="At most one full backup, plus change files to apply")
+    restore.add_argument("--user", help="User ID selecting the history store (default: derived from passphrase)")
+    restore.set_defaults(func=cmd_import)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (OSError, ValueError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 2
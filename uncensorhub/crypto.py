@@ -0,0 +1,154 @@
+"""
+UncensorHub: Passphrase-based encryption
+The cryptography package is imported on first use, not at module import,
+so the passphrase screen renders before any crypto code is loaded.
+
+New data is sealed with an AEAD engine (AES-256-GCM by default, or
+ChaCha20-Poly1305) under a random 96-bit nonce per record, and tagged with
+the engine name ("aesgcm:<base64>"). Untagged values are Fernet tokens
+written by earlier versions; they still decrypt and can be migrated.
+"""
+
+import base64
+import os
+from typing import Dict, Optional
+
+from .config import CIPHER_ENGINE, KDF_ITERATIONS, SALT_FILE
+from .store import HistoryStore
+
+NONCE_BYTES = 12
+FERNET = "fernet"
+
+# Engine tag -> AEAD class in cryptography.hazmat.primitives.ciphers.aead
+AEAD_ENGINES = {
+    "aesgcm": "AESGCM",
+    "chacha20": "ChaCha20Poly1305"
+}
+
+ENGINE_NAMES = {
+    "aesgcm": "AES-256-GCM",
+    "chacha20": "ChaCha20-Poly1305",
+    FERNET: "Fernet (AES-128-CBC + HMAC)"
+}
+
+
+class EncryptionManager:
+    """Handles all encryption/decryption operations using a pluggable AEAD engine"""
+
+    def __init__(self, passphrase: str, store: Optional[HistoryStore] = None, engine: str = CIPHER_ENGINE,
+                 salt: Optional[bytes] = None):
+        if engine not in AEAD_ENGINES and engine != FERNET:
+            raise ValueError(f"Unknown cipher engine: {engine}")
+        self.passphrase = passphrase.encode()
+        if salt is None:
+            salt = store.load_or_create_salt() if store else self._load_or_create_salt()
+        self.salt = salt
+        self.engine = engine
+        self.key = self._derive_key()
+        self._fernet = None
+        self._aeads: Dict[str, object] = {}
+
+    @classmethod
+    def from_key(cls, key: bytes, salt: bytes, engine: str = CIPHER_ENGINE) -> "EncryptionManager":
+        """Rebuild a manager from an already derived master key (e.g. a re-key checkpoint)"""
+        manager = cls.__new__(cls)
+        manager.passphrase = None
+        manager.salt = salt
+        manager.engine = engine
+        manager.key = key
+        manager._fernet = None
+        manager._aeads = {}
+        return manager
+
+    @property
+    def engine_name(self) -> str:
+        return ENGINE_NAMES[self.engine]
+
+    def _load_or_create_salt(self) -> bytes:
+        """Load existing salt or create new one"""
+        if os.path.exists(SALT_FILE):
+            with open(SALT_FILE, 'rb') as f:
+                return f.read()
+        else:
+            salt = os.urandom(16)
+            with open(SALT_FILE, 'wb') as f:
+                f.write(salt)
+            return salt
+
+    def _derive_key(self) -> bytes:
+        """Derive the 256-bit master key from the passphrase using PBKDF2"""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=self.salt,
+            iterations=KDF_ITERATIONS
+        )
+        return kdf.derive(self.passphrase)
+
+    def derive_subkey(self, purpose: str) -> bytes:
+        """Derive an independent 256-bit key for one purpose from the master key (HKDF)"""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=f"uncensorhub {purpose}".encode()
+        ).derive(self.key)
+
+    def _fernet_cipher(self):
+        """Legacy Fernet cipher keyed directly with the master key"""
+        if self._fernet is None:
+            from cryptography.fernet import Fernet
+            self._fernet = Fernet(base64.urlsafe_b64encode(self.key))
+        return self._fernet
+
+    def _aead(self, engine: str):
+        cipher = self._aeads.get(engine)
+        if cipher is None:
+            from cryptography.hazmat.primitives.ciphers import aead
+            cipher = getattr(aead, AEAD_ENGINES[engine])(self.derive_subkey(f"{engine} v1"))
+            self._aeads[engine] = cipher
+        return cipher
+
+    def needs_migration(self, encrypted_data: str) -> bool:
+        """Whether a value was written by another engine (e.g. legacy Fernet)"""
+        if self.engine == FERNET:
+            return False
+        return not encrypted_data.startswith(self.engine + ":")
+
+    def encrypt(self, data: str, associated_data: Optional[bytes] = None) -> str:
+        """Encrypt string data, binding associated_data (not stored) to the ciphertext"""
+        if self.engine == FERNET:
+            encrypted_bytes = self._fernet_cipher().encrypt(data.encode())
+            return base64.urlsafe_b64encode(encrypted_bytes).decode()
+        nonce = os.urandom(NONCE_BYTES)
+        sealed = self._aead(self.engine).encrypt(nonce, data.encode(), associated_data)
+        return f"{self.engine}:{base64.urlsafe_b64encode(nonce + sealed).decode()}"
+
+    def decrypt(self, encrypted_data: str, associated_data: Optional[bytes] = None) -> str:
+        """Decrypt string data written by any engine
+
+        Fernet values carry no associated data, so it is only checked for AEAD values.
+        """
+        from cryptography.exceptions import InvalidTag
+        from cryptography.fernet import InvalidToken
+
+        engine, separator, body = encrypted_data.partition(":")
+        try:
+            if separator and engine in AEAD_ENGINES:
+                raw = base64.urlsafe_b64decode(body.encode())
+                nonce, sealed = raw[:NONCE_BYTES], raw[NONCE_BYTES:]
+                return self._aead(engine).decrypt(nonce, sealed, associated_data).decode()
+
+            # The cloud edition used to write standard base64; accept both alphabets
+            normalized = encrypted_data.replace('+', '-').replace('/', '_')
+            encrypted_bytes = base64.urlsafe_b64decode(normalized.encode())
+            decrypted_bytes = self._fernet_cipher().decrypt(encrypted_bytes)
+            return decrypted_bytes.decode()
+        except (InvalidToken, InvalidTag, ValueError):
+            raise ValueError("Invalid passphrase or corrupted data")
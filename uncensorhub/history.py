@@ -0,0 +1,271 @@
+"""
+UncensorHub: Encrypted chat history persistence
+Messages are encrypted one by one and written to the user's HistoryStore.
+Each record's role and timestamp are bound to its ciphertext as associated
+data, so they cannot be altered or swapped between records undetected, and
+a signed manifest (see manifest.py) covers the record list as a whole.
+"""
+
+import json
+import threading
+from typing import Dict, List, Optional, Set
+
+from .crypto import EncryptionManager
+from .manifest import (
+    check_store_manifest,
+    checkpoint_id,
+    find_checkpoint,
+    manifest_matches,
+    record_id,
+    sample_indices,
+    write_history
+)
+from .store import MANIFEST_FILE, MEMORY_FILE, HistoryStore
+
+MIGRATION_BATCH_SIZE = 500
+EXPORT_FORMAT = "uncensorhub-history"
+EXPORT_VERSION = 2
+_INTEGRITY_ERROR = "integrity check failed (wrong passphrase, or records were modified, reordered or truncated)"
+
+_migrations: Set[str] = set()
+_migrations_lock = threading.Lock()
+
+
+def record_associated_data(role: str, timestamp: str) -> bytes:
+    """Associated data authenticated together with a record's content"""
+    return json.dumps([role, timestamp]).encode()
+
+
+def encrypt_record(encryption_manager: EncryptionManager, role: str, content: str, timestamp: str) -> Dict:
+    """Build an encrypted history record"""
+    return {
+        "role": role,
+        "content": encryption_manager.encrypt(content, record_associated_data(role, timestamp)),
+        "timestamp": timestamp
+    }
+
+
+def reencrypt_record(encryption_manager: EncryptionManager, record: Dict, content: str) -> Dict:
+    """A copy of a record with its content encrypted anew, keeping its other fields (e.g. the parent)"""
+    return dict(record, content=encryption_manager.encrypt(
+        content, record_associated_data(record["role"], record["timestamp"])))
+
+
+def record_parent(record: Dict, index: int) -> int:
+    """Index of the record a record replies to or follows (-1 for the first message of a conversation)
+
+    Records without a "parent" (every record before branching existed)
+    follow the one before them.
+    """
+    return record.get("parent", index - 1)
+
+
+def decrypt_record(encryption_manager: EncryptionManager, record: Dict) -> str:
+    """Decrypt an encrypted history record's content"""
+    return encryption_manager.decrypt(record["content"], record_associated_data(record["role"], record["timestamp"]))
+
+
+def load_encrypted_history(encryption_manager: EncryptionManager, store: HistoryStore) -> List[Dict]:
+    """Load and decrypt chat history from the user's store
+
+    Raises ValueError if the history cannot be read or decrypted.
+    """
+    try:
+        encrypted_history = store.read_records()
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Corrupted history file: {str(e)}")
+    check_store_manifest(encryption_manager, store, encrypted_history)
+
+    decrypted_history = []
+    for msg in encrypted_history:
+        decrypted_msg = {
+            "role": msg["role"],
+            "content": decrypt_record(encryption_manager, msg),
+            "timestamp": msg["timestamp"]
+        }
+        if "parent" in msg:
+            decrypted_msg["parent"] = msg["parent"]
+        decrypted_history.append(decrypted_msg)
+
+    return decrypted_history
+
+
+def save_encrypted_history(history: List[Dict], encryption_manager: EncryptionManager, store: HistoryStore) -> int:
+    """Encrypt and save chat history to the user's store, returning the bytes written"""
+    encrypted_history = [
+        encrypt_record(encryption_manager, msg["role"], msg["content"], msg["timestamp"])
+        for msg in history
+    ]
+    for record, msg in zip(encrypted_history, history):
+        if "parent" in msg:
+            record["parent"] = msg["parent"]
+    with store.lock():
+        return write_history(encryption_manager, store, encrypted_history)
+
+
+def export_history(store: HistoryStore, since: Optional[str] = None) -> Optional[str]:
+    """Export the encrypted history together with its signed manifest
+
+    With since (the checkpoint id of an earlier export), only the records
+    added after that checkpoint are included. Raises ValueError if the
+    checkpoint is no longer part of the history.
+    """
+    with store.lock(exclusive=False):
+        if not store.exists():
+            return None
+        records = store.read_records()
+        manifest = (store.read_state(MANIFEST_FILE) or {}).get("current")
+    if not manifest:
+        # Imports reject bundles without one, so a stripped manifest cannot hide truncation
+        raise ValueError("Unlock the history once before exporting it")
+    base = None
+    if since:
+        base = since.strip()
+        records = records[find_checkpoint(records, base):]
+    return json.dumps({
+        "format": EXPORT_FORMAT,
+        "version": EXPORT_VERSION,
+        "checkpoint": checkpoint_id(manifest),
+        "base": base,
+        "manifest": manifest,
+        "records": records
+    }, indent=2)
+
+
+def current_checkpoint(store: HistoryStore) -> Optional[str]:
+    """Checkpoint id of the history as last saved, to export later changes from"""
+    return checkpoint_id((store.read_state(MANIFEST_FILE) or {}).get("current"))
+
+
+def _read_backup(uploaded_file) -> Dict:
+    backup = json.loads(uploaded_file.read().decode())
+    if isinstance(backup, list):
+        # Exported before manifests existed
+        backup = {"manifest": None, "records": backup}
+    elif not backup.get("manifest"):
+        # Only plain record lists predate manifests; a bundle without one was stripped
+        raise ValueError("the backup's integrity manifest is missing")
+    backup["name"] = getattr(uploaded_file, "name", "backup")
+    return backup
+
+
+def _verified_records(backup: Dict, encryption_manager: EncryptionManager) -> List[Dict]:
+    """Records of a full backup, checked against its manifest or decrypted in full"""
+    records = backup["records"]
+    if backup["manifest"]:
+        if not manifest_matches(encryption_manager, backup["manifest"], records):
+            raise ValueError(_INTEGRITY_ERROR)
+        for i in sample_indices(len(records)):
+            decrypt_record(encryption_manager, records[i])
+    else:
+        # Validate by attempting to decrypt
+        for msg in records:
+            decrypt_record(encryption_manager, msg)
+    return records
+
+
+def _apply_delta(records: List[Dict], delta: Dict, encryption_manager: EncryptionManager) -> List[Dict]:
+    """records extended by a delta export, verified against the delta's manifest"""
+    manifest = delta["manifest"]
+    if manifest["count"] <= len(records) and manifest_matches(encryption_manager, manifest,
+                                                              records[:manifest["count"]]):
+        return records  # Already applied
+    start = find_checkpoint(records, delta["base"])
+    delta_ids = {record_id(record) for record in delta["records"]}
+    if any(record_id(record) not in delta_ids for record in records[start:]):
+        raise ValueError("changes do not continue this history")
+    # Records already present since the delta's base are replaced by (and must match) the delta's
+    combined = records[:start] + delta["records"]
+    if not manifest_matches(encryption_manager, manifest, combined):
+        raise ValueError(_INTEGRITY_ERROR)
+    for i in sample_indices(len(delta["records"])):
+        decrypt_record(encryption_manager, delta["records"][i])
+    return combined
+
+
+def import_history(uploaded_files, encryption_manager: EncryptionManager, store: HistoryStore):
+    """Import and validate encrypted history files
+
+    Takes one file or a list: at most one full backup, plus any delta exports
+    (applied in order onto the full backup, or onto the current history if
+    none is given). Backups with a manifest are verified against it and
+    spot-checked by decrypting a sample; older plain record lists are
+    decrypted in full.
+    """
+    if not isinstance(uploaded_files, (list, tuple)):
+        uploaded_files = [uploaded_files]
+    try:
+        backups = [_read_backup(f) for f in uploaded_files]
+        full = [b for b in backups if not b.get("base")]
+        deltas = sorted((b for b in backups if b.get("base")), key=lambda b: b["manifest"]["count"])
+        if len(full) > 1:
+            raise ValueError("choose at most one full backup")
+
+        with store.lock():
+            if full:
+                records = _verified_records(full[0], encryption_manager)
+            else:
+                records = store.read_records()
+                check_store_manifest(encryption_manager, store, records)
+            for delta in deltas:
+                try:
+                    records = _apply_delta(records, delta, encryption_manager)
+                except ValueError as e:
+                    raise ValueError(f"{delta['name']}: {str(e)}")
+
+            # Save to store
+            write_history(encryption_manager, store, records)
+            if full:
+                # Positions in the retrieval index no longer refer to the same messages
+                store.remove_state(MEMORY_FILE)
+
+        if deltas:
+            return True, f"History imported successfully (change files applied: {len(deltas)})"
+        return True, "History imported successfully"
+    except Exception as e:
+        return False, f"Import failed: {str(e)}"
+
+
+def migrate_history(encryption_manager: EncryptionManager, store: HistoryStore,
+                    batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Re-encrypt records written by another engine (e.g. legacy Fernet) with the current one
+
+    Works in batches, each under the store's lock and re-reading the file, so
+    sessions can keep appending in between. Returns the number of records migrated.
+    """
+    migrated = 0
+    while True:
+        with store.lock():
+            records = store.read_records()
+            pending = [i for i, record in enumerate(records)
+                       if encryption_manager.needs_migration(record["content"])][:batch_size]
+            if not pending:
+                return migrated
+            for i in pending:
+                record = records[i]
+                content = decrypt_record(encryption_manager, record)
+                records[i] = reencrypt_record(encryption_manager, record, content)
+            write_history(encryption_manager, store, records)
+        migrated += len(pending)
+
+
+def start_background_migration(encryption_manager: EncryptionManager, store: HistoryStore) -> Optional[threading.Thread]:
+    """Run migrate_history in a daemon thread, at most once at a time per store"""
+    with _migrations_lock:
+        if store.directory in _migrations:
+            return None
+        _migrations.add(store.directory)
+
+    def migrate():
+        try:
+            migrate_history(encryption_manager, store)
+        except (ValueError, KeyError, OSError):
+            # Left for the next unlock; the records still decrypt as they are
+            pass
+        finally:
+            with _migrations_lock:
+                _migrations.discard(store.directory)
+
+    thread = threading.Thread(target=migrate, name="uncensorhub-migration", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,319 @@
+"""
+UncensorHub: Inference backends
+Local Ollama and cloud GPU chat clients. The ollama and requests packages
+are imported on the first inference call rather than at module import.
+"""
+
+import importlib.util
+import threading
+import time
+from typing import Dict, List, Mapping, Optional, Sequence
+
+from . import config
+from .config import INFERENCE_BACKENDS
+from .templates import PromptCache, max_input_tokens, render_prompt, template_for
+
+HF_MAX_NEW_TOKENS = 1024
+
+# Any sequence of role/content mappings: plain dicts or a MessageStore view
+ChatMessages = Sequence[Mapping[str, str]]
+
+
+def payload_messages(messages: ChatMessages, system_prompt: Optional[str] = None) -> List[Dict]:
+    """Plain role/content dicts for one request body (JSON and ollama<0.4 need real dicts)"""
+    payload = [{"role": "system", "content": system_prompt}] if system_prompt is not None else []
+    payload.extend({"role": msg["role"], "content": msg["content"]} for msg in messages)
+    return payload
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _requests():
+    """Import requests on first use"""
+    import requests
+    return requests
+
+
+def http_session():
+    """The process-wide requests session, so turns reuse warm HTTPS connections"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _requests().Session()
+        return _session
+
+
+def ollama_available() -> bool:
+    """Whether the ollama library is installed, without importing it"""
+    return importlib.util.find_spec("ollama") is not None
+
+
+def ollama_client(host: Optional[str] = None, timeout: Optional[float] = None):
+    """Create an Ollama client, importing the library on first use"""
+    from ollama import Client
+    return Client(host=host or config.OLLAMA_HOST, timeout=timeout)
+
+
+def ollama_chat(client, model: str, messages: ChatMessages, system_prompt: Optional[str], usage: Dict,
+                options: Optional[Dict] = None) -> str:
+    """One Ollama chat request, laid out so that consecutive turns share a byte-identical prefix
+
+    Ollama keeps the evaluated prompt of a model's last request and only
+    evaluates what follows the part a new request has in common with it. The
+    system prompt is therefore sent as the first message (not as an option),
+    the messages are serialized the same way every turn, and keep_alive holds
+    the model loaded between turns. Pass the same options every turn.
+    """
+    response = client.chat(
+        model=model,
+        messages=payload_messages(messages, system_prompt),
+        options=options,
+        keep_alive=config.OLLAMA_KEEP_ALIVE
+    )
+    record_ollama_usage(response, usage)
+    return response['message']['content']
+
+
+def _record_openai_usage(result: Dict, usage: Dict):
+    """Copy OpenAI-style token counts into usage"""
+    reported = result.get("usage") or {}
+    for key in ("prompt_tokens", "completion_tokens"):
+        if isinstance(reported.get(key), int):
+            usage[key] = reported[key]
+
+
+def record_ollama_usage(response, usage: Dict):
+    """Copy Ollama's token counts and nanosecond timings into usage"""
+    if response.get("prompt_eval_count") is not None:
+        usage["prompt_tokens"] = response.get("prompt_eval_count")
+    if response.get("eval_count") is not None:
+        usage["completion_tokens"] = response.get("eval_count")
+    if response.get("prompt_eval_duration") is not None:
+        usage["prefill_seconds"] = response.get("prompt_eval_duration") / 1e9
+        usage["ttft_seconds"] = ((response.get("load_duration") or 0) + response.get("prompt_eval_duration")) / 1e9
+    if response.get("eval_duration"):
+        usage["generation_seconds"] = response.get("eval_duration") / 1e9
+
+
+class InferenceError(Exception):
+    """Raised when a backend request fails or returns an unusable response"""
+
+
+class CloudInferenceClient:
+    """Unified client for cloud GPU inference"""
+
+    def __init__(self, backend: str, api_key: Optional[str] = None, custom_url: Optional[str] = None,
+                 prompt_cache: Optional[PromptCache] = None):
+        self.backend = backend
+        self.api_key = api_key
+        self.custom_url = custom_url
+        self.backend_config = INFERENCE_BACKENDS.get(backend, {})
+        # Rendered Hugging Face prompt of the previous turn (pass the session's to reuse it)
+        self.prompt_cache = prompt_cache if prompt_cache is not None else PromptCache()
+
+    def chat(self, model: str, messages: ChatMessages, system_prompt: str, usage: Optional[Dict] = None) -> str:
+        """Send chat request to cloud inference backend
+
+        If a usage dict is given, token counts reported by the backend are added to it.
+        """
+        backend_type = self.backend_config.get("type")
+        usage = usage if usage is not None else {}
+
+        if backend_type == "huggingface":
+            return self._huggingface_chat(model, messages, system_prompt)
+        elif backend_type == "together":
+            return self._together_chat(model, messages, system_prompt, usage)
+        elif backend_type == "openai":
+            return self._openai_chat(model, messages, system_prompt, usage)
+        else:
+            raise ValueError(f"Unsupported backend type: {backend_type}")
+
+    def endpoint(self, model: str) -> str:
+        """URL that chat requests for model are posted to"""
+        backend_type = self.backend_config.get("type")
+        if backend_type == "huggingface":
+            return f"{self.backend_config['api_url']}{model}"
+        if backend_type == "openai":
+            return self.custom_url or "https://api.openai.com/v1/chat/completions"
+        return self.backend_config['api_url']
+
+    def warm_up(self, model: str):
+        """Open the HTTPS connection the first chat request will reuse"""
+        requests = _requests()
+        try:
+            http_session().head(self.endpoint(model), timeout=10)
+        except requests.exceptions.RequestException as e:
+            raise InferenceError(str(e)) from e
+
+    def _huggingface_chat(self, model: str, messages: ChatMessages, system_prompt: str) -> str:
+        """Hugging Face Inference API"""
+        url = self.endpoint(model)
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+
+        # Render in the model's chat template, dropping the oldest messages beyond its input budget
+        template, context_tokens = template_for(model)
+        try:
+            prompt = render_prompt(template, system_prompt, messages,
+                                   max_input_tokens(context_tokens, HF_MAX_NEW_TOKENS), self.prompt_cache)
+        except ValueError as e:
+            raise InferenceError(str(e)) from e
+
+        payload = {
+            "inputs": prompt,
+            "parameters": {
+                "max_new_tokens": HF_MAX_NEW_TOKENS,
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "return_full_text": False
+            }
+        }
+        if template.stop:
+            payload["parameters"]["stop"] = template.stop
+
+        requests = _requests()
+        try:
+            response = http_session().post(url, headers=headers, json=payload, timeout=60)
+            response.raise_for_status()
+            result = response.json()
+
+            if isinstance(result, list) and len(result) > 0:
+                return template.strip_stop(result[0].get("generated_text", "No response generated"))
+            elif isinstance(result, dict):
+                if "generated_text" not in result:
+                    raise InferenceError(result.get("error", "Unknown error"))
+                return template.strip_stop(result["generated_text"])
+            else:
+                return str(result)
+        except requests.exceptions.RequestException as e:
+            raise InferenceError(str(e)) from e
+
+    def _together_chat(self, model: str, messages: ChatMessages, system_prompt: str, usage: Dict) -> str:
+        """Together AI API (OpenAI-compatible)"""
+        url = self.endpoint(model)
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        # Format messages with system prompt
+        formatted_messages = payload_messages(messages, system_prompt)
+
+        payload = {
+            "model": model,
+            "messages": formatted_messages,
+            "max_tokens": 1024,
+            "temperature": 0.7,
+            "top_p": 0.9
+        }
+
+        requests = _requests()
+        try:
+            response = http_session().post(url, headers=headers, json=payload, timeout=60)
+            response.raise_for_status()
+            result = response.json()
+            _record_openai_usage(result, usage)
+            return result["choices"][0]["message"]["content"]
+        except requests.exceptions.RequestException as e:
+            raise InferenceError(str(e)) from e
+        except (KeyError, IndexError) as e:
+            raise InferenceError(f"Unexpected response format: {str(e)}") from e
+
+    def _openai_chat(self, model: str, messages: ChatMessages, system_prompt: str, usage: Dict) -> str:
+        """OpenAI-compatible API"""
+        url = self.endpoint(model)
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        # Format messages with system prompt
+        formatted_messages = payload_messages(messages, system_prompt)
+
+        payload = {
+            "model": model,
+            "messages": formatted_messages,
+            "max_tokens": 1024,
+            "temperature": 0.7
+        }
+
+        requests = _requests()
+        try:
+            response = http_session().post(url, headers=headers, json=payload, timeout=60)
+            response.raise_for_status()
+            result = response.json()
+            _record_openai_usage(result, usage)
+            return result["choices"][0]["message"]["content"]
+        except requests.exceptions.RequestException as e:
+            raise InferenceError(str(e)) from e
+        except (KeyError, IndexError) as e:
+            raise InferenceError(f"Unexpected response format: {str(e)}") from e
+
+
+def chat_completion(messages: ChatMessages, system_prompt: str, backend: str, model: str,
+                    api_key: Optional[str] = None, custom_url: Optional[str] = None,
+                    usage: Optional[Dict] = None, prompt_cache: Optional[PromptCache] = None) -> str:
+    """Get AI response from selected backend, raising InferenceError on failure
+
+    If a usage dict is given it receives "request_seconds" plus whatever token
+    counts and timings the backend reports ("prompt_tokens", "completion_tokens",
+    "ttft_seconds", "prefill_seconds", "generation_seconds"). Pass the
+    conversation's prompt_cache so Hugging Face prompts are rendered incrementally.
+    """
+    usage = usage if usage is not None else {}
+    started = time.perf_counter()
+    try:
+        return _chat_completion(messages, system_prompt, backend, model, api_key, custom_url, usage, prompt_cache)
+    finally:
+        usage["request_seconds"] = time.perf_counter() - started
+
+
+def _chat_completion(messages: ChatMessages, system_prompt: str, backend: str, model: str,
+                     api_key: Optional[str], custom_url: Optional[str], usage: Dict,
+                     prompt_cache: Optional[PromptCache]) -> str:
+
+    if backend == "Local Ollama":
+        if not ollama_available():
+            raise InferenceError("Ollama library not installed. Install with: pip install ollama")
+
+        try:
+            return ollama_chat(ollama_client(), model, messages, system_prompt, usage, {"temperature": 0.7})
+        except Exception as e:
+            raise InferenceError(str(e)) from e
+    else:
+        # Cloud inference
+        if not api_key:
+            raise InferenceError("API key required for cloud inference")
+
+        client = CloudInferenceClient(backend, api_key, custom_url, prompt_cache)
+        return client.chat(model, messages, system_prompt, usage)
+
+
+def warm_up(backend: str, model: str, custom_url: Optional[str] = None):
+    """Get a backend ready for the first chat request, raising InferenceError on failure
+
+    Local Ollama loads the model into memory (a generate request with no
+    prompt does only that); cloud backends open their HTTPS connection.
+    """
+    if backend == "Local Ollama":
+        if not ollama_available():
+            raise InferenceError("Ollama library not installed. Install with: pip install ollama")
+        try:
+            ollama_client().generate(model=model, prompt="", keep_alive=config.OLLAMA_KEEP_ALIVE)
+        except Exception as e:
+            raise InferenceError(str(e)) from e
+    else:
+        CloudInferenceClient(backend, custom_url=custom_url).warm_up(model)
+
+
+def get_ai_response(messages: ChatMessages, system_prompt: str, backend: str, model: str,
+                    api_key: Optional[str] = None, custom_url: Optional[str] = None,
+                    usage: Optional[Dict] = None, prompt_cache: Optional[PromptCache] = None) -> str:
+    """Get AI response from selected backend, reporting failures as an "Error: ..." reply"""
+    try:
+        return chat_completion(messages, system_prompt, backend, model, api_key, custom_url, usage, prompt_cache)
+    except Exception as e:
+        if usage is not None:
+            usage["failed"] = True
+        return f"Error: {str(e)}"
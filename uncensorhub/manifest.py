@@ -0,0 +1,187 @@
+"""
+UncensorHub: Signed integrity manifests
+
+A manifest records how many encrypted records a history holds and a SHA-256
+hash chain over them (role, timestamp, ciphertext and parent, in order),
+signed with an HMAC key derived from the session key. Checking it needs only
+hashing, no decryption, yet any modified, reordered, dropped or truncated
+record breaks the chain or the count. Imports verify the manifest and then decrypt only a
+sample of records.
+
+A checkpoint id names a point in a history's chain ("<count>-<chain prefix>"),
+so a delta export can carry just the records added after it; record ids
+(hashes of single records) let overlapping deltas be de-duplicated.
+
+Each store keeps its manifest in a sidecar file, written after the history
+under the same lock. A crash in between leaves an append longer than its
+manifest, accepted once the extra records decrypt; a replacement stages its
+manifest as "pending" first, so the file it leaves is covered either way.
+Nothing older than the manifest in force is ever accepted.
+"""
+
+import hashlib
+import hmac
+import json
+import random
+from typing import Dict, List, Optional
+
+from .crypto import EncryptionManager
+from .store import MANIFEST_FILE, HistoryStore
+
+MANIFEST_VERSION = 1
+SAMPLE_SIZE = 16
+CHECKPOINT_CHAIN_CHARS = 32
+_GENESIS = "0" * 64
+
+
+def _record_bytes(record: Dict) -> bytes:
+    fields = [record["role"], record["timestamp"], record["content"]]
+    if "parent" in record:
+        fields.append(str(record["parent"]))
+    return "\x00".join(fields).encode()
+
+
+def record_id(record: Dict) -> str:
+    """Stable id of an encrypted record (the hash of its role, timestamp, ciphertext and parent)"""
+    return hashlib.sha256(_record_bytes(record)).hexdigest()
+
+
+def extend_chain(chain: str, records: List[Dict]) -> str:
+    """Fold records into a hex hash chain"""
+    digest = bytes.fromhex(chain)
+    for record in records:
+        digest = hashlib.sha256(digest + hashlib.sha256(_record_bytes(record)).digest()).digest()
+    return digest.hex()
+
+
+def checkpoint_id(manifest: Optional[Dict]) -> Optional[str]:
+    """Id of the point in a history a manifest covers, for requesting later changes"""
+    if not manifest:
+        return None
+    return f"{manifest['count']}-{manifest['chain'][:CHECKPOINT_CHAIN_CHARS]}"
+
+
+def find_checkpoint(records: List[Dict], checkpoint: str) -> int:
+    """Number of leading records the checkpoint covers
+
+    Raises ValueError if the records do not start with the checkpointed history
+    (e.g. it was cleared, re-keyed or migrated since).
+    """
+    count, _, chain = checkpoint.strip().partition("-")
+    if not count.isdigit() or len(chain) != CHECKPOINT_CHAIN_CHARS:
+        raise ValueError(f"Invalid checkpoint id {checkpoint!r}")
+    count = int(count)
+    if count > len(records) or extend_chain(_GENESIS, records[:count])[:CHECKPOINT_CHAIN_CHARS] != chain:
+        raise ValueError(f"Checkpoint {checkpoint} is not part of this history; export a full backup instead")
+    return count
+
+
+def _mac(encryption_manager: EncryptionManager, count: int, chain: str) -> str:
+    key = encryption_manager.derive_subkey("manifest v1")
+    message = json.dumps({"version": MANIFEST_VERSION, "count": count, "chain": chain}, sort_keys=True)
+    return hmac.new(key, message.encode(), hashlib.sha256).hexdigest()
+
+
+def sign_manifest(encryption_manager: EncryptionManager, count: int, chain: str) -> Dict:
+    return {"version": MANIFEST_VERSION, "count": count, "chain": chain,
+            "mac": _mac(encryption_manager, count, chain)}
+
+
+def build_manifest(encryption_manager: EncryptionManager, records: List[Dict]) -> Dict:
+    """Signed manifest covering exactly these records"""
+    return sign_manifest(encryption_manager, len(records), extend_chain(_GENESIS, records))
+
+
+def manifest_authentic(encryption_manager: EncryptionManager, manifest: Optional[Dict]) -> bool:
+    """Whether a manifest was signed with this manager's key"""
+    if not manifest or manifest.get("version") != MANIFEST_VERSION:
+        return False
+    expected = _mac(encryption_manager, manifest["count"], manifest["chain"])
+    return hmac.compare_digest(expected, manifest["mac"])
+
+
+def manifest_matches(encryption_manager: EncryptionManager, manifest: Optional[Dict], records: List[Dict]) -> bool:
+    """Whether a manifest is authentic and covers exactly these records"""
+    return (manifest_authentic(encryption_manager, manifest) and manifest["count"] == len(records)
+            and extend_chain(_GENESIS, records) == manifest["chain"])
+
+
+def write_history(encryption_manager: EncryptionManager, store: HistoryStore, records: List[Dict]) -> int:
+    """Replace a store's history and sign it (call under the store lock), returning the bytes written"""
+    manifest = build_manifest(encryption_manager, records)
+    state = store.read_state(MANIFEST_FILE) or {}
+    store.write_state(MANIFEST_FILE, {"current": state.get("current"), "pending": manifest})
+    written = store.write_records(records)
+    store.write_state(MANIFEST_FILE, {"current": manifest})
+    return written
+
+
+def append_history(encryption_manager: EncryptionManager, store: HistoryStore, records: List[Dict]) -> int:
+    """Append records to a store's history and extend its manifest over them (call under the store lock)
+
+    Returns the bytes written. A manifest that does not cover the rest of the
+    file (an earlier append was interrupted) is left for check_store_manifest.
+    """
+    written = store.append_records(records)
+    current = (store.read_state(MANIFEST_FILE) or {}).get("current")
+    count = store.record_count()
+    if current and current["count"] + len(records) == count:
+        manifest = sign_manifest(encryption_manager, count, extend_chain(current["chain"], records))
+    elif not current and len(records) == count:
+        manifest = build_manifest(encryption_manager, records)
+    else:
+        return written
+    store.write_state(MANIFEST_FILE, {"current": manifest})
+    return written
+
+
+def check_store_manifest(encryption_manager: EncryptionManager, store: HistoryStore, records: List[Dict]):
+    """Verify a store's records against its manifest, creating or repairing it where that is safe
+
+    A history without a manifest (written by an earlier version) gets one once
+    a sample of its records decrypts. One that a pending replacement covers,
+    or that extends the signed records with ones that decrypt under this key,
+    was interrupted before its manifest was written and is signed. A copy
+    read just before another session appended is accepted if the grown file
+    matches. Raises ValueError for anything else, including a truncated history.
+    """
+    from .history import decrypt_record  # history imports this module
+
+    with store.lock():
+        state = store.read_state(MANIFEST_FILE) or {}
+        current = state.get("current")
+        if manifest_matches(encryption_manager, current, records):
+            return
+        on_disk = store.read_records()
+        if on_disk != records:
+            # Read before another session's save finished; only an append leaves them verifiable
+            if on_disk[:len(records)] == records and manifest_matches(encryption_manager, current, on_disk):
+                return
+            raise ValueError("The history was changed by another session while loading; try again")
+        if manifest_matches(encryption_manager, state.get("pending"), records):
+            pass  # A replacement interrupted before its manifest was committed
+        elif current:
+            if not manifest_authentic(encryption_manager, current):
+                raise ValueError("Invalid passphrase or corrupted data")
+            count = current["count"]
+            if count >= len(records) or extend_chain(_GENESIS, records[:count]) != current["chain"]:
+                raise ValueError("History integrity check failed: records were modified, reordered or truncated")
+            # An append interrupted before its manifest: the extra records must be this key's own
+            try:
+                for record in records[count:]:
+                    decrypt_record(encryption_manager, record)
+            except ValueError:
+                raise ValueError("History integrity check failed: records were added that do not decrypt")
+        else:
+            # Never sign a history with a key that cannot read it
+            for i in sample_indices(len(records)):
+                decrypt_record(encryption_manager, records[i])
+        store.write_state(MANIFEST_FILE, {"current": build_manifest(encryption_manager, records)})
+
+
+def sample_indices(count: int, size: int = SAMPLE_SIZE) -> List[int]:
+    """Random record indices to decrypt, always including the first and last"""
+    if count <= size:
+        return list(range(count))
+    picked = set(random.SystemRandom().sample(range(1, count - 1), size - 2))
+    return sorted(picked | {0, count - 1})
@@ -0,0 +1,345 @@
+"""
+UncensorHub: Compact in-session message store
+
+A session keeps its decrypted chat as slotted Message records (interned
+roles, float timestamps) instead of one dict per message. Each record is a
+read-only mapping of its "role" and "content", so views of the store can be
+handed to the inference backends without keeping a payload copy per session;
+request bodies are built from the view only for the duration of a request.
+Once the resident messages exceed the session's memory cap, the oldest ones
+that are already saved are dropped from memory; they remain in the encrypted
+history file (and in exports) but are no longer rendered or sent to the model.
+
+Regenerating a reply or editing a message starts a new branch: the history
+file stays an append-only list, and each record may name its parent, so
+branches share their common prefix. The session holds the parent links and
+the active path (record indices); only messages on the active path are
+decrypted, and switching branches decrypts just the part that differs.
+"""
+
+import json
+import sys
+import time
+from array import array
+from collections.abc import Mapping, Sequence
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .config import SESSION_MEMORY_CAP_BYTES
+from .crypto import EncryptionManager
+from .history import decrypt_record, encrypt_record, record_parent
+from .manifest import append_history, check_store_manifest
+from .store import HistoryStore
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_API_FIELDS = ("role", "content")
+
+
+def parse_timestamp(value: Union[str, float, int]) -> float:
+    """Convert a stored timestamp ("%Y-%m-%d %H:%M:%S" local time) to epoch seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+
+
+def format_timestamp(timestamp: float) -> str:
+    """Format epoch seconds the way timestamps are displayed and stored"""
+    return datetime.fromtimestamp(timestamp).strftime(TIMESTAMP_FORMAT)
+
+
+class Message(Mapping):
+    """One chat message; as a mapping it exposes only the API fields role and content"""
+
+    __slots__ = ("role", "content", "timestamp")
+
+    def __init__(self, role: str, content: str, timestamp: Optional[float] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_API_FIELDS)
+
+    def __len__(self) -> int:
+        return len(_API_FIELDS)
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, {len(self.content)} chars, {format_timestamp(self.timestamp)})"
+
+
+# Per-message cost besides the content string: the record, its float and the list slot
+_RECORD_OVERHEAD = sys.getsizeof(Message("user", "", 0.0)) + sys.getsizeof(0.0) + 8
+
+
+def _message_bytes(message: Message) -> int:
+    return sys.getsizeof(message.content) + _RECORD_OVERHEAD
+
+
+class MessageView(Sequence):
+    """Live read-only view of the resident messages, e.g. as an API payload"""
+
+    __slots__ = ("_messages",)
+
+    def __init__(self, messages: List[Message]):
+        self._messages = messages
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+
+class ConversationTree:
+    """Parent links of every record in a history file, for walking branches without decrypting"""
+
+    def __init__(self):
+        self._parents = array("q")
+        self._newest_child = array("q", [-1])  # By parent index + 1 (slot 0: first messages)
+        self._branches: Dict[int, List[int]] = {}  # Children of the parents with more than one
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    def add(self, parent: int) -> int:
+        """Add a record replying to parent (-1 for none), returning its index"""
+        index = len(self._parents)
+        if not -1 <= parent < index:
+            raise ValueError(f"Corrupted history file: record {index} has an invalid parent")
+        sibling = self._newest_child[parent + 1]
+        if sibling >= 0:
+            self._branches.setdefault(parent, [sibling]).append(index)
+        self._parents.append(parent)
+        self._newest_child[parent + 1] = index
+        self._newest_child.append(-1)
+        return index
+
+    def extend(self, records: List[Dict]):
+        """Add the records past the ones already in the tree"""
+        for index in range(len(self._parents), len(records)):
+            self.add(record_parent(records[index], index))
+
+    def children(self, parent: int) -> List[int]:
+        """Records replying to parent (-1: the first messages of conversations), oldest first"""
+        newest = self._newest_child[parent + 1]
+        return self._branches.get(parent) or ([newest] if newest >= 0 else [])
+
+    def path_to(self, index: int) -> List[int]:
+        """Record indices from the start of the conversation down to index"""
+        path = []
+        while index >= 0:
+            path.append(index)
+            index = self._parents[index]
+        return path[::-1]
+
+    def newest_path_from(self, index: int) -> List[int]:
+        """index followed by its newest reply, that reply's newest reply and so on"""
+        path = [index]
+        while self._newest_child[path[-1] + 1] >= 0:
+            path.append(self._newest_child[path[-1] + 1])
+        return path
+
+
+class MessageStore:
+    """A session's chat messages, bounded in memory and persisted to its HistoryStore
+
+    Iterating yields the resident (most recent) messages; len() counts every
+    message, including the older ones kept only in encrypted storage.
+    """
+
+    def __init__(self, encryption_manager: EncryptionManager, store: HistoryStore,
+                 memory_cap: int = SESSION_MEMORY_CAP_BYTES):
+        self.encryption_manager = encryption_manager
+        self.store = store
+        self.memory_cap = memory_cap
+        self._messages: List[Message] = []
+        self._spilled = 0
+        self._saved = 0
+        self._resident_bytes = 0
+        self._tree = ConversationTree()
+        self._path: List[int] = []  # Record indices of the saved messages on the active branch
+
+    @classmethod
+    def load(cls, encryption_manager: EncryptionManager, store: HistoryStore,
+             memory_cap: int = SESSION_MEMORY_CAP_BYTES) -> "MessageStore":
+        """Decrypt the newest messages that fit the memory cap, leaving older ones on disk
+
+        The active branch is the one ending with the newest record. Raises
+        ValueError if the history cannot be read or decrypted.
+        """
+        try:
+            records = store.shared_records()
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Corrupted history file: {str(e)}")
+        check_store_manifest(encryption_manager, store, records)
+
+        messages = cls(encryption_manager, store, memory_cap)
+        messages._tree.extend(records)
+        messages._activate(messages._tree.path_to(len(records) - 1), 0, records)
+        return messages
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    @property
+    def spilled(self) -> int:
+        """Number of older messages kept only in encrypted storage"""
+        return self._spilled
+
+    @property
+    def resident_bytes(self) -> int:
+        """Approximate memory held by the resident messages"""
+        return self._resident_bytes
+
+    def record_index(self, position: int) -> int:
+        """Index in the history file of the saved message at position on the active branch"""
+        return self._path[position]
+
+    def alternatives(self, position: int) -> Tuple[int, int]:
+        """(which, how many) versions of the message at position exist, e.g. regenerated replies"""
+        if position >= len(self._path):
+            return 0, 1
+        siblings = self._tree.children(self._path[position - 1] if position else -1)
+        return siblings.index(self._path[position]), len(siblings)
+
+    def switch(self, position: int, step: int) -> int:
+        """Show another version of the message at position (step versions on, wrapping around)
+
+        The branch continues with the newest messages under that version.
+        Unsaved messages are discarded. Returns position, from which on the
+        messages changed.
+        """
+        which, count = self.alternatives(position)
+        siblings = self._tree.children(self._path[position - 1] if position else -1)
+        path = self._path[:position] + self._tree.newest_path_from(siblings[(which + step) % count])
+        self._drop_unsaved()
+        self._activate(path, position)
+        return position
+
+    def rewind(self, position: int) -> int:
+        """End the active branch before position, to regenerate or edit the message there
+
+        The messages from position on stay in the history file as a branch of
+        their own; messages appended next start a new one. Returns position.
+        """
+        if position >= len(self._path):
+            while len(self) > position:
+                self._resident_bytes -= _message_bytes(self._messages.pop())
+            return position
+        self._drop_unsaved()
+        self._activate(self._path[:position], position)
+        return position
+
+    def append(self, role: str, content: str, timestamp: Optional[float] = None) -> Message:
+        """Add a message (unsaved until the next save())"""
+        message = Message(role, content, timestamp)
+        self._messages.append(message)
+        self._resident_bytes += _message_bytes(message)
+        return message
+
+    def api_messages(self) -> MessageView:
+        """The resident messages as role/content mappings, without copying them"""
+        return MessageView(self._messages)
+
+    def save(self) -> int:
+        """Encrypt and append the unsaved messages, then enforce the memory cap
+
+        Returns the size of the history file written (0 if nothing was unsaved).
+        Raises ValueError if the store was re-keyed by another session.
+        """
+        unsaved = self._messages[self._saved:]
+        written = 0
+        if unsaved:
+            # Encrypt under the lock so a finishing re-key cannot switch keys in between
+            with self.store.lock():
+                if self.store.load_or_create_salt() != self.encryption_manager.salt:
+                    raise ValueError("The passphrase was changed in another session; lock and unlock again")
+                start = self.store.record_count()
+                if start < len(self._tree):
+                    raise ValueError("The history was replaced in another session; lock and unlock again")
+                if start > len(self._tree):
+                    self._tree.extend(self.store.shared_records())  # Appended by another session
+                parent = self._path[-1] if self._path else -1
+                records, parents = [], []
+                for index, message in enumerate(unsaved, start):
+                    record = encrypt_record(self.encryption_manager, message.role, message.content,
+                                            format_timestamp(message.timestamp))
+                    if parent != index - 1:
+                        record["parent"] = parent
+                    records.append(record)
+                    parents.append(parent)
+                    parent = index
+                written = append_history(self.encryption_manager, self.store, records)
+                self._path.extend(self._tree.add(parent) for parent in parents)
+            self._saved = len(self._messages)
+        self._spill()
+        return written
+
+    def switch_encryption_manager(self, encryption_manager: EncryptionManager):
+        """Encrypt future saves with a new key (called under the store lock when a re-key finishes)"""
+        self.encryption_manager = encryption_manager
+
+    def clear(self):
+        """Forget every message, in memory and in the encrypted history file"""
+        self.store.clear()
+        self._messages = []
+        self._spilled = 0
+        self._saved = 0
+        self._resident_bytes = 0
+        self._tree = ConversationTree()
+        self._path = []
+
+    def _drop_unsaved(self):
+        while len(self._messages) > self._saved:
+            self._resident_bytes -= _message_bytes(self._messages.pop())
+
+    def _activate(self, path: List[int], changed: int, records: Optional[List[Dict]] = None):
+        """Make path (record indices) the active branch; it matches the current one before changed
+
+        As on load, the newest messages that fit the memory cap are resident;
+        shared ones already in memory are reused rather than decrypted again.
+        """
+        reusable = self._messages[:self._saved]
+        newest_first: List[Message] = []
+        resident_bytes = 0
+        for position in range(len(path) - 1, -1, -1):
+            if self._spilled <= position < min(changed, self._spilled + len(reusable)):
+                message = reusable[position - self._spilled]
+            else:
+                if records is None:
+                    records = self.store.shared_records()
+                record = records[path[position]]
+                message = Message(record["role"], decrypt_record(self.encryption_manager, record),
+                                  parse_timestamp(record["timestamp"]))
+            size = _message_bytes(message)
+            if newest_first and resident_bytes + size > self.memory_cap:
+                break
+            newest_first.append(message)
+            resident_bytes += size
+        self._path = path
+        self._messages = newest_first[::-1]
+        self._spilled = len(path) - len(newest_first)
+        self._saved = len(newest_first)
+        self._resident_bytes = resident_bytes
+
+    def _spill(self):
+        """Drop the oldest saved messages while over the cap, always keeping the newest"""
+        drop = 0
+        while (self._resident_bytes > self.memory_cap and drop < self._saved
+               and drop < len(self._messages) - 1):
+            self._resident_bytes -= _message_bytes(self._messages[drop])
+            drop += 1
+        if drop:
+            del self._messages[:drop]
+            self._saved -= drop
+            self._spilled += drop
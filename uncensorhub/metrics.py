@@ -0,0 +1,263 @@
+"""
+UncensorHub: Timing spans and metrics export
+
+TurnTimer records how long each stage of an unlock or chat turn took, both
+for the sidebar breakdown and for process-wide histograms. The registry
+renders counters and histograms in the Prometheus text format, written to
+UNCENSORHUB_METRICS_FILE and/or served on UNCENSORHUB_METRICS_PORT.
+Only durations, sizes and counts are recorded, never message content.
+"""
+
+import bisect
+import os
+import tempfile
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+METRICS_FILE_ENV = "UNCENSORHUB_METRICS_FILE"
+METRICS_PORT_ENV = "UNCENSORHUB_METRICS_PORT"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+TOKEN_BUCKETS = (10, 50, 100, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        # Per label set: [per-bucket counts..., +Inf count], sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _format_number(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total[0])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float], labels: Sequence[str] = ()) -> Histogram:
+        metric = Histogram(name, help_text, buckets, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "uncensorhub_stage_seconds", "Duration of each unlock or chat turn stage", SECONDS_BUCKETS, ["stage"])
+TTFT_SECONDS = REGISTRY.histogram(
+    "uncensorhub_ttft_seconds", "Backend time to first token (model load plus prompt evaluation)",
+    SECONDS_BUCKETS, ["backend"])
+PREFILL_TOKENS = REGISTRY.histogram(
+    "uncensorhub_prefill_tokens", "Prompt tokens the backend evaluated (Ollama: those past its cached prefix)",
+    TOKEN_BUCKETS, ["backend"])
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "uncensorhub_tokens_per_second", "Generation speed reported by the backend", RATE_BUCKETS, ["backend"])
+SAVE_BYTES = REGISTRY.histogram(
+    "uncensorhub_save_bytes", "Size of the encrypted history written per save", BYTES_BUCKETS)
+DECRYPT_SECONDS = REGISTRY.histogram(
+    "uncensorhub_decrypt_seconds", "Time to read and decrypt a history on unlock or import", SECONDS_BUCKETS)
+TURNS_TOTAL = REGISTRY.counter("uncensorhub_turns_total", "Chat turns completed", ["backend"])
+INFERENCE_ERRORS_TOTAL = REGISTRY.counter(
+    "uncensorhub_inference_errors_total", "Chat turns whose backend request failed", ["backend"])
+SAVED_BYTES_TOTAL = REGISTRY.counter("uncensorhub_saved_bytes_total", "Encrypted history bytes written")
+
+
+class TurnTimer:
+    """Collects named stage durations for one unlock or chat turn"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time the enclosed block as a stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage: str, seconds: float):
+        """Record a stage measured elsewhere (e.g. reported by the backend)"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def summary(self) -> str:
+        """Compact one-line breakdown for the sidebar"""
+        return " · ".join(f"{stage} {_format_duration(seconds)}" for stage, seconds in self.stages.items())
+
+
+def _format_duration(seconds: float) -> str:
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+def record_inference(timer: TurnTimer, backend: str, usage: Dict):
+    """Fold the usage dict filled by chat_completion/get_ai_response into the turn and the histograms
+
+    Backends that report no generation time (the cloud APIs) get tokens/sec
+    over the whole request instead.
+    """
+    TURNS_TOTAL.inc(backend=backend)
+    if usage.get("failed"):
+        INFERENCE_ERRORS_TOTAL.inc(backend=backend)
+        return
+    if "ttft_seconds" in usage:
+        timer.add("ttft", usage["ttft_seconds"])
+        TTFT_SECONDS.observe(usage["ttft_seconds"], backend=backend)
+    if "prefill_seconds" in usage:
+        timer.add("prefill", usage["prefill_seconds"])
+        PREFILL_TOKENS.observe(usage.get("prompt_tokens") or 0, backend=backend)
+    if "generation_seconds" in usage:
+        timer.add("generation", usage["generation_seconds"])
+    seconds = usage.get("generation_seconds") or usage.get("request_seconds")
+    if usage.get("completion_tokens") and seconds:
+        TOKENS_PER_SECOND.observe(usage["completion_tokens"] / seconds, backend=backend)
+
+
+def record_save(size: int):
+    SAVE_BYTES.observe(size)
+    SAVED_BYTES_TOTAL.inc(size)
+
+
+def export_metrics(path: Optional[str] = None):
+    """Atomically write the Prometheus text exposition to path (or $UNCENSORHUB_METRICS_FILE)"""
+    path = path or os.environ.get(METRICS_FILE_ENV)
+    if not path:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    with os.fdopen(fd, 'w') as f:
+        f.write(REGISTRY.render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = REGISTRY.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_failed = False  # The port could not be bound; not retried on every rerun
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on localhost once per process (no-op without a port)
+
+    If the port is taken (e.g. by another app process), warns once and
+    returns None: metrics are optional and never stop the chat.
+    """
+    global _server, _server_failed
+    if port is None:
+        port = int(os.environ.get(METRICS_PORT_ENV, "0") or 0)
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            if _server_failed:
+                return None
+            try:
+                _server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+            except OSError as e:
+                _server_failed = True
+                warnings.warn(f"Metrics server not started on port {port}: {str(e)}", RuntimeWarning)
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
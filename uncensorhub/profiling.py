@@ -0,0 +1,180 @@
+"""
+UncensorHub: Opt-in profiling of Streamlit reruns
+
+Set UNCENSORHUB_PROFILE to "cprofile", "tracemalloc" or both
+("cprofile,tracemalloc") to wrap main() and write plain-text reports to
+UNCENSORHUB_PROFILE_DIR (default: "profiles"):
+
+    UNCENSORHUB_PROFILE_EVERY=N     profile every Nth rerun of this process
+    UNCENSORHUB_PROFILE_SLOW_MS=T   profile every rerun, keep reports only for
+                                    reruns slower than T ms
+
+tracemalloc keeps tracing (one frame deep, which keeps snapshots cheap) from
+the first profiled rerun on, so each report lists live allocations and their
+growth since the previous report, which is what reveals sessions that slowly
+get heavier.
+
+Reports never contain message content: they are built solely from code
+locations (file, line, function name) and numbers (call counts, times,
+allocation sizes). No raw snapshots, object reprs, arguments or locals are
+ever written.
+"""
+
+import cProfile
+import itertools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List, Optional
+
+PROFILE_ENV = "UNCENSORHUB_PROFILE"
+PROFILE_EVERY_ENV = "UNCENSORHUB_PROFILE_EVERY"
+PROFILE_SLOW_MS_ENV = "UNCENSORHUB_PROFILE_SLOW_MS"
+PROFILE_DIR_ENV = "UNCENSORHUB_PROFILE_DIR"
+DEFAULT_PROFILE_DIR = "profiles"
+TOP_ENTRIES = 40
+
+_rerun_counter = itertools.count(1)
+# Python 3.12+ allows one active cProfile per process, so concurrent
+# sessions take turns; a rerun that finds it busy is simply not profiled
+_cprofile_lock = threading.Lock()
+_snapshot_lock = threading.Lock()
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+class ProfileSettings:
+    """Profiling options read from the environment"""
+
+    def __init__(self, cprofile: bool = False, tracemalloc: bool = False, every: int = 0,
+                 slow_ms: Optional[float] = None, directory: str = DEFAULT_PROFILE_DIR):
+        self.cprofile = cprofile
+        self.tracemalloc = tracemalloc
+        self.every = every
+        self.slow_ms = slow_ms
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls) -> "ProfileSettings":
+        modes = {m.strip().lower() for m in os.environ.get(PROFILE_ENV, "").split(",") if m.strip()}
+        slow_ms = os.environ.get(PROFILE_SLOW_MS_ENV)
+        return cls(
+            cprofile="cprofile" in modes,
+            tracemalloc="tracemalloc" in modes,
+            every=int(os.environ.get(PROFILE_EVERY_ENV, "0") or 0),
+            slow_ms=float(slow_ms) if slow_ms else None,
+            directory=os.environ.get(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR)
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return (self.cprofile or self.tracemalloc) and (self.every > 0 or self.slow_ms is not None)
+
+
+def run(main: Callable, settings: Optional[ProfileSettings] = None):
+    """Call main(), profiling this rerun if the settings select it
+
+    Streamlit ends reruns early by raising (st.rerun, st.stop); profilers are
+    stopped and the exception propagates unchanged.
+    """
+    settings = settings or ProfileSettings.from_env()
+    if not settings.enabled:
+        return main()
+
+    rerun = next(_rerun_counter)
+    sampled = settings.every > 0 and rerun % settings.every == 0
+    if not sampled and settings.slow_ms is None:
+        return main()
+
+    profiler = None
+    if settings.cprofile and _cprofile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+    if settings.tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start(1)
+    started = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        return main()
+    finally:
+        if profiler:
+            profiler.disable()
+            _cprofile_lock.release()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        slow = settings.slow_ms is not None and elapsed_ms >= settings.slow_ms
+        if sampled or slow:
+            snapshot = tracemalloc.take_snapshot() if settings.tracemalloc else None
+            reason = "slow" if slow else "sampled"
+            _write_report(settings.directory, rerun, reason, elapsed_ms, profiler, snapshot)
+
+
+def _write_report(directory: str, rerun: int, reason: str, elapsed_ms: float,
+                  profiler: Optional[cProfile.Profile], snapshot: Optional[tracemalloc.Snapshot]):
+    global _last_snapshot
+    lines = [
+        f"UncensorHub rerun profile: rerun {rerun}, {reason}, {elapsed_ms:.1f} ms",
+        f"Written {datetime.now().isoformat(timespec='seconds')}, pid {os.getpid()}",
+        ""
+    ]
+    if profiler:
+        lines.extend(_cprofile_section(profiler))
+    if snapshot:
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ])
+        with _snapshot_lock:
+            previous, _last_snapshot = _last_snapshot, snapshot
+        lines.extend(_tracemalloc_section(snapshot, previous))
+
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-pid{os.getpid()}-rerun{rerun}-{reason}.txt"
+    fd = os.open(os.path.join(directory, name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _location(filename: str, lineno: int, function: str = "") -> str:
+    suffix = f"({function})" if function else ""
+    return f"{filename}:{lineno}{suffix}"
+
+
+def _cprofile_section(profiler: cProfile.Profile) -> List[str]:
+    """Top functions by cumulative time, from code locations and counters only"""
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_ENTRIES]
+    lines = [
+        f"== cProfile: top {len(rows)} functions by cumulative time ==",
+        f"{'ncalls':>10} {'tottime':>10} {'cumtime':>10}  location"
+    ]
+    for (filename, lineno, function), (_, ncalls, tottime, cumtime, _) in rows:
+        lines.append(f"{ncalls:>10} {tottime:10.4f} {cumtime:10.4f}  {_location(filename, lineno, function)}")
+    lines.append("")
+    return lines
+
+
+def _tracemalloc_section(snapshot: tracemalloc.Snapshot,
+                         previous: Optional[tracemalloc.Snapshot]) -> List[str]:
+    """Top allocation sites and growth since the last profiled rerun, by location only"""
+    stats = snapshot.statistics("lineno")
+    total = sum(stat.size for stat in stats)
+    lines = [
+        f"== tracemalloc: {total / 1024:.1f} KiB live, top {min(TOP_ENTRIES, len(stats))} allocation sites ==",
+        f"{'size KiB':>10} {'blocks':>8}  location"
+    ]
+    for stat in stats[:TOP_ENTRIES]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} {stat.count:>8}  {_location(frame.filename, frame.lineno)}")
+    if previous is not None:
+        lines.append("")
+        lines.append("== tracemalloc: growth since previous profiled rerun ==")
+        lines.append(f"{'diff KiB':>10} {'blocks':>8}  location")
+        for diff in snapshot.compare_to(previous, "lineno")[:TOP_ENTRIES]:
+            frame = diff.traceback[0]
+            lines.append(f"{diff.size_diff / 1024:+10.1f} {diff.count_diff:>+8}  "
+                         f"{_location(frame.filename, frame.lineno)}")
+    lines.append("")
+    return lines
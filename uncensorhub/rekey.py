@@ -0,0 +1,220 @@
+"""
+UncensorHub: Passphrase change (re-keying)
+
+A re-key moves a store's history from the current key to one derived from a
+new passphrase and a fresh salt. Records are re-encrypted in small batches,
+each under the store's lock, so sessions keep saving in between; their new
+records land at the end of the file and are picked up by later batches.
+
+After every batch a checkpoint (.rekey.json) records the progress together
+with the new key, wrapped under the old one, so an interrupted re-key
+resumes on the next unlock with the old passphrase. The new salt is
+installed (and a passphrase-derived store moved to its new id) only once
+every record is under the new key; until then the old passphrase stays valid.
+
+A passphrase-derived store is moved before its salt is replaced, with the
+move recorded in the checkpoint first: until the move, the old passphrase
+resumes the job; after it, unlocking with the new one installs the salt.
+"""
+
+import base64
+import hmac
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from .crypto import EncryptionManager
+from .history import decrypt_record, reencrypt_record
+from .manifest import write_history
+from .store import PASSPHRASE_STORE_PREFIX, HistoryStore, derive_store_id, relocate_store
+
+REKEY_FILE = ".rekey.json"
+REKEY_BATCH_SIZE = 200
+_WRAP_ASSOCIATED_DATA = b"uncensorhub rekey"
+
+_jobs: Dict[str, "RekeyJob"] = {}
+_jobs_lock = threading.Lock()
+
+
+class RekeyJob:
+    """Re-encrypts one store's history from the old manager's key to the new one's"""
+
+    def __init__(self, store: HistoryStore, old_manager: EncryptionManager, new_manager: EncryptionManager,
+                 store_id: Optional[str] = None, batch_size: int = REKEY_BATCH_SIZE):
+        self.store = store
+        self.old_manager = old_manager
+        self.new_manager = new_manager
+        self.store_id = store_id
+        self._directory = store.directory  # Registered under it, before any move
+        self.batch_size = batch_size
+        self.done = 0
+        self.total = 0
+        self.error: Optional[str] = None
+        self._listeners: List[Callable[[EncryptionManager], None]] = []
+        self._run_lock = threading.Lock()
+        self._finished = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    @property
+    def progress(self) -> float:
+        """Fraction of records re-keyed so far"""
+        return min(1.0, self.done / self.total) if self.total else float(self.finished)
+
+    def on_switch(self, callback: Callable[[EncryptionManager], None]):
+        """Call callback(new_manager) under the store lock at the moment the new key takes over"""
+        self._listeners.append(callback)
+
+    def run(self) -> EncryptionManager:
+        """Re-key every record, or wait for the thread already doing so; returns the new manager
+
+        Raises ValueError if a record cannot be decrypted under either key.
+        """
+        with self._run_lock:
+            if not self._finished.is_set():
+                try:
+                    while not self._run_batch():
+                        pass
+                except (ValueError, KeyError, OSError) as e:
+                    self.error = str(e)
+                finally:
+                    self._finished.set()
+                    with _jobs_lock:
+                        if _jobs.get(self._directory) is self:
+                            del _jobs[self._directory]
+        if self.error:
+            raise ValueError(f"Passphrase change failed: {self.error}")
+        return self.new_manager
+
+    def _run_batch(self) -> bool:
+        """Re-key the next batch and checkpoint it; True once the new key has taken over"""
+        with self.store.lock():
+            checkpoint = self.store.read_state(REKEY_FILE)
+            if checkpoint is None:
+                # Completed by another process
+                self.done = self.total
+                return True
+            records = self.store.read_records()
+            start = checkpoint["done"]
+            end = min(start + self.batch_size, len(records))
+            for i in range(start, end):
+                records[i] = self._rekey_record(records[i])
+            self.done, self.total = max(start, end), len(records)
+            complete = end >= len(records)
+            if end > start or complete:
+                # The manifest is signed with whichever key is in force once this batch is written
+                write_history(self.new_manager if complete else self.old_manager, self.store, records)
+            if not complete:
+                self.store.write_state(REKEY_FILE, dict(checkpoint, done=end))
+                return False
+
+            if self.store_id:
+                self.store.write_state(REKEY_FILE, dict(checkpoint, done=end, step="relocate"))
+                relocate_store(self.store, self.store_id)
+            self.store.replace_salt(self.new_manager.salt)
+            self.store.remove_state(REKEY_FILE)
+            for callback in self._listeners:
+                callback(self.new_manager)
+            return True
+
+    def _rekey_record(self, record: Dict) -> Dict:
+        try:
+            content = decrypt_record(self.old_manager, record)
+        except ValueError:
+            # Already re-keyed by a batch that was interrupted before its checkpoint
+            decrypt_record(self.new_manager, record)
+            return record
+        return reencrypt_record(self.new_manager, record, content)
+
+
+def _register(job: RekeyJob) -> RekeyJob:
+    with _jobs_lock:
+        return _jobs.setdefault(job._directory, job)
+
+
+def active_rekey(store: HistoryStore) -> Optional[RekeyJob]:
+    """The re-key of this store currently running in this process, if any"""
+    with _jobs_lock:
+        return _jobs.get(store.directory)
+
+
+def start_rekey(store: HistoryStore, encryption_manager: EncryptionManager,
+                current_passphrase: str, new_passphrase: str) -> RekeyJob:
+    """Check the current passphrase and set up a re-key to the new one (call run() to perform it)"""
+    if active_rekey(store) or store.read_state(REKEY_FILE):
+        raise ValueError("A passphrase change is already in progress")
+    current = EncryptionManager(current_passphrase, store, encryption_manager.engine)
+    if not hmac.compare_digest(current.key, encryption_manager.key):
+        raise ValueError("Current passphrase is incorrect")
+
+    store_id = None
+    if os.path.basename(store.directory).startswith(PASSPHRASE_STORE_PREFIX):
+        store_id = derive_store_id(passphrase=new_passphrase, data_dir=os.path.dirname(store.directory))
+        if HistoryStore(os.path.join(os.path.dirname(store.directory), store_id)).exists():
+            raise ValueError("A history store already exists for that passphrase")
+
+    new_manager = EncryptionManager(new_passphrase, engine=encryption_manager.engine, salt=os.urandom(16))
+    wrapped_key = encryption_manager.encrypt(base64.urlsafe_b64encode(new_manager.key).decode(),
+                                             _WRAP_ASSOCIATED_DATA)
+    store.write_state(REKEY_FILE, {
+        "salt": base64.urlsafe_b64encode(new_manager.salt).decode(),
+        "key": wrapped_key,
+        "engine": new_manager.engine,
+        "store_id": store_id,
+        "done": 0
+    })
+    return _register(RekeyJob(store, encryption_manager, new_manager, store_id))
+
+
+def pending_rekey(store: HistoryStore, encryption_manager: EncryptionManager) -> Optional[RekeyJob]:
+    """A re-key that must finish before this store can be loaded, if one was started
+
+    Returns the job running in this process, or one resumed from the checkpoint
+    of an interrupted re-key, provided encryption_manager holds the old key.
+    """
+    job = active_rekey(store)
+    if job:
+        return job if hmac.compare_digest(job.old_manager.key, encryption_manager.key) else None
+
+    checkpoint = store.read_state(REKEY_FILE)
+    if checkpoint is None:
+        return None
+    try:
+        key = base64.urlsafe_b64decode(encryption_manager.decrypt(checkpoint["key"], _WRAP_ASSOCIATED_DATA))
+    except ValueError:
+        return None
+    salt = base64.urlsafe_b64decode(checkpoint["salt"])
+    new_manager = EncryptionManager.from_key(key, salt, checkpoint["engine"])
+    return _register(RekeyJob(store, encryption_manager, new_manager, checkpoint["store_id"]))
+
+
+def finish_relocation(store: HistoryStore) -> bool:
+    """Install the new salt of a re-key interrupted after moving its store; True if one was finished
+
+    Call before the salt is loaded. The move only happens once every record
+    is under the new key, so the checkpoint's salt is all that is missing.
+    """
+    if store.read_state(REKEY_FILE) is None:
+        return False  # Checked first: the exclusive lock would create a store that was never written
+    with store.lock():
+        checkpoint = store.read_state(REKEY_FILE)
+        if not checkpoint or checkpoint.get("store_id") != os.path.basename(store.directory):
+            return False
+        store.replace_salt(base64.urlsafe_b64decode(checkpoint["salt"]))
+        store.remove_state(REKEY_FILE)
+        return True
+
+
+def start_background_rekey(job: RekeyJob) -> threading.Thread:
+    """Run a re-key in a daemon thread; check job.progress, job.finished and job.error"""
+    def rekey():
+        try:
+            job.run()
+        except ValueError:
+            pass  # Kept in job.error for the session to report
+
+    thread = threading.Thread(target=rekey, name="uncensorhub-rekey", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,297 @@
+"""
+UncensorHub: Retrieval memory over past conversations
+
+Instead of resending the whole history, a turn can send the most recent
+messages plus only the earlier turns most similar to the new question.
+Saved messages are embedded with a local Ollama embedding model into a
+NumPy index that grows as messages are saved. The index lives in the user's
+store (.memory.json) encrypted with the session key, in chunks, so an update
+encrypts only the new vectors. Embeddings never leave the machine, whichever
+backend answers.
+
+Retrieval is best-effort: with no embedding model, an index that does not yet
+cover the older messages, or a question that takes longer than the latency
+budget to embed, the turn sends the resident history as before.
+"""
+
+import base64
+import hashlib
+import importlib.util
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .config import EMBEDDING_MODEL, RETRIEVAL_BUDGET_SECONDS, RETRIEVAL_RECENT_MESSAGES, RETRIEVAL_TOP_K
+from .crypto import EncryptionManager
+from .history import decrypt_record
+from .inference import ChatMessages, ollama_available, ollama_client
+from .messages import MessageStore
+from .store import MEMORY_FILE, HistoryStore
+
+INDEX_BATCH = 32  # Messages embedded per index() call, so a long history is indexed over several turns
+INDEX_TIMEOUT_SECONDS = 30.0
+RETRY_SECONDS = 60.0  # Before trying an embedding model that failed again
+MAX_CHUNKS = 32  # Chunks are merged into one beyond this
+MAX_EMBED_CHARS = 4000
+_DIGEST_BYTES = 8
+MEMORY_PREAMBLE = "Relevant turns from earlier in this conversation:"
+
+
+def _np():
+    """Import NumPy on first use"""
+    import numpy
+    return numpy
+
+
+def _digest(content: str) -> bytes:
+    return hashlib.sha256(content.encode()).digest()[:_DIGEST_BYTES]
+
+
+class RetrievalMemory:
+    """A session's embedding index over its saved messages, by position on the active branch"""
+
+    def __init__(self, encryption_manager: EncryptionManager, store: HistoryStore,
+                 model: str = EMBEDDING_MODEL, budget: float = RETRIEVAL_BUDGET_SECONDS, client=None):
+        self.encryption_manager = encryption_manager
+        self.store = store
+        self.model = model
+        self.budget = budget
+        self.last_error: Optional[str] = None
+        self._clients = {} if client is None else None  # Ollama clients by timeout
+        self._client = client
+        self._matrix = None  # Unit vectors; rows past count are spare capacity
+        self._digests = bytearray()  # Short content hashes, to notice a history replaced under the index
+        self._roles = ""  # "u" or "a" per message
+        self._chunks: List[Dict] = []
+        self._retry_at = 0.0
+
+    @classmethod
+    def load(cls, encryption_manager: EncryptionManager, store: HistoryStore, state: Optional[Dict] = None,
+             **kwargs) -> "RetrievalMemory":
+        """Decrypt the store's index (an unreadable or outdated one is rebuilt as messages are indexed)
+
+        Pass state if the index file was already read.
+        """
+        memory = cls(encryption_manager, store, **kwargs)
+        if memory.enabled:
+            memory._load_state(state if state is not None else store.read_state(MEMORY_FILE))
+        return memory
+
+    @property
+    def enabled(self) -> bool:
+        """Whether an embedding model is configured and NumPy and ollama are installed"""
+        return bool(self.model) and (self._client is not None or ollama_available()) \
+            and importlib.util.find_spec("numpy") is not None
+
+    @property
+    def available(self) -> bool:
+        """Whether retrieval is enabled and the model has not failed recently"""
+        return self.enabled and time.monotonic() >= self._retry_at
+
+    @property
+    def count(self) -> int:
+        """Number of messages (from the start of the history) in the index"""
+        return len(self._digests) // _DIGEST_BYTES
+
+    def index(self, messages: MessageStore, limit: int = INDEX_BATCH) -> int:
+        """Embed saved messages not yet in the index, oldest first, at most limit per call
+
+        Call after messages.save(). Returns the number of messages indexed.
+        """
+        if self.count > len(messages):
+            self.reset()  # The history was cleared or replaced
+        start, end = self.count, min(len(messages), self.count + limit)
+        if start >= end or not self.available:
+            return 0
+        try:
+            entries = self._entries(messages, range(start, end))
+        except ValueError as e:
+            # Older messages under a key being replaced (a passphrase change is running)
+            self.last_error = str(e)
+            return 0
+        vectors = self._embed([content for _, content in entries], INDEX_TIMEOUT_SECONDS)
+        if vectors is None:
+            return 0
+        digests = b"".join(_digest(content) for _, content in entries)
+        roles = "".join("u" if role == "user" else "a" for role, _ in entries)
+        with self.store.lock():
+            state = self.store.read_state(MEMORY_FILE)
+            if state and state.get("model") == self.model and state["count"] != start:
+                # Another session of this store indexed in the meantime; adopt its index
+                self._load_state(state)
+                return 0
+            self._add(vectors, digests, roles)
+            self._chunks.append(self._seal(start, vectors, digests, roles))
+            if len(self._chunks) > MAX_CHUNKS:
+                self._chunks = [self._seal_all()]
+            self._write_state()
+        return end - start
+
+    def context(self, messages: MessageStore, recent: int = RETRIEVAL_RECENT_MESSAGES,
+                top_k: int = RETRIEVAL_TOP_K) -> Optional[ChatMessages]:
+        """Messages to send for the newest one: the earlier turns most like it, then the recent ones
+
+        Returns None when the resident history should be sent instead: retrieval
+        is unavailable or over budget, every message is recent anyway, the
+        index does not yet cover the older messages, or the ones it picked do
+        not decrypt under the session's key (e.g. during a passphrase change).
+        """
+        resident = messages.api_messages()
+        window_start = len(messages) - recent
+        if window_start <= 0 or not resident or not self.available or self.count < window_start:
+            return None
+        query = self._embed([resident[-1]["content"]], self.budget)
+        if query is None:
+            return None
+
+        np = _np()
+        scores = self._matrix[:window_start] @ query[0]
+        # Each turn is at most two messages, so the best 2 * top_k messages yield top_k turns
+        candidates = min(2 * top_k, window_start)
+        best = np.argpartition(-scores, candidates - 1)[:candidates]
+        positions = set()
+        turns = 0
+        for position in best[np.argsort(-scores[best])].tolist():
+            # Retrieve whole turns: a question together with its answer
+            if self._roles[position] == "a" and position > 0 and self._roles[position - 1] == "u":
+                turn = {position - 1, position}
+            elif self._roles[position] == "u" and position + 1 < window_start and self._roles[position + 1] == "a":
+                turn = {position, position + 1}
+            else:
+                turn = {position}
+            if not turn & positions:
+                positions |= turn
+                turns += 1
+                if turns == top_k:
+                    break
+        positions = sorted(positions)
+        try:
+            entries = self._entries(messages, positions)
+        except ValueError as e:
+            # Spilled messages already re-keyed (or not yet migrated) do not decrypt under the
+            # session's key; send the resident history this turn
+            self.last_error = str(e)
+            return None
+
+        lines = [MEMORY_PREAMBLE]
+        for position, (role, content) in zip(positions, entries):
+            if _digest(content) != bytes(self._digests[position * _DIGEST_BYTES:(position + 1) * _DIGEST_BYTES]):
+                # The history was replaced under the index; start over
+                self.reset()
+                return None
+            lines.append(f"{'User' if role == 'user' else 'Assistant'}: {content}")
+        return [{"role": "system", "content": "\n\n".join(lines)}] + list(resident[-recent:])
+
+    def rewind(self, position: int):
+        """Forget the messages from position on, after MessageStore.rewind() or switch()"""
+        if position >= self.count:
+            return
+        if position == 0:
+            self.reset()
+            return
+        self._digests = self._digests[:position * _DIGEST_BYTES]
+        self._roles = self._roles[:position]
+        with self.store.lock():
+            self._chunks = [self._seal_all()]
+            self._write_state()
+
+    def switch_encryption_manager(self, encryption_manager: EncryptionManager):
+        """Re-encrypt the index under a new key (called under the store lock when a re-key finishes)"""
+        self.encryption_manager = encryption_manager
+        if self.count:
+            self._chunks = [self._seal_all()]
+            self._write_state()
+
+    def reset(self):
+        """Forget the index, in memory and in the store"""
+        self._matrix, self._digests, self._roles, self._chunks = None, bytearray(), "", []
+        self.store.remove_state(MEMORY_FILE)
+
+    def _embed(self, texts: Sequence[str], timeout: float):
+        """Unit embedding vectors for texts, or None if the model failed or was too slow"""
+        np = _np()
+        started = time.monotonic()
+        try:
+            client = self._client_for(timeout)
+            response = client.embed(model=self.model, input=[text[:MAX_EMBED_CHARS] for text in texts])
+            vectors = np.asarray(response["embeddings"], dtype=np.float32)
+            if vectors.shape[0] != len(texts) or (self.count and vectors.shape[1] != self._matrix.shape[1]):
+                raise ValueError(f"unexpected embedding shape {vectors.shape}")
+        except Exception as e:
+            self.last_error = str(e)
+            if time.monotonic() - started < timeout:
+                # Not just slow: the model is missing or Ollama is down
+                self._retry_at = time.monotonic() + RETRY_SECONDS
+            return None
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _client_for(self, timeout: float):
+        if self._client is not None:
+            return self._client
+        if timeout not in self._clients:
+            self._clients[timeout] = ollama_client(timeout=timeout)
+        return self._clients[timeout]
+
+    def _entries(self, messages: MessageStore, positions: Sequence[int]) -> List[Tuple[str, str]]:
+        """(role, content) of messages by history position, decrypting those no longer resident"""
+        resident = messages.api_messages()
+        entries = {p: (resident[p - messages.spilled]["role"], resident[p - messages.spilled]["content"])
+                   for p in positions if p >= messages.spilled}
+        spilled = [p for p in positions if p < messages.spilled]
+        if spilled:
+            records = self.store.shared_records()
+            for p in spilled:
+                record = records[messages.record_index(p)]
+                entries[p] = (record["role"], decrypt_record(self.encryption_manager, record))
+        return [entries[p] for p in positions]
+
+    def _add(self, vectors, digests: bytes, roles: str):
+        np = _np()
+        count, needed = self.count, self.count + len(vectors)
+        if self._matrix is None or needed > len(self._matrix):
+            grown = np.empty((max(needed, 2 * count, 64), vectors.shape[1]), dtype=np.float32)
+            if count:
+                grown[:count] = self._matrix[:count]
+            self._matrix = grown
+        self._matrix[count:needed] = vectors
+        self._digests += digests
+        self._roles += roles
+
+    def _associated_data(self, start: int) -> bytes:
+        return f"uncensorhub memory {self.model} {start}".encode()
+
+    def _seal(self, start: int, vectors, digests: bytes, roles: str) -> Dict:
+        chunk = json.dumps({
+            "shape": list(vectors.shape),
+            "vectors": base64.b64encode(vectors.astype("<f4").tobytes()).decode(),
+            "digests": base64.b64encode(digests).decode(),
+            "roles": roles
+        })
+        return {"start": start, "data": self.encryption_manager.encrypt(chunk, self._associated_data(start))}
+
+    def _seal_all(self) -> Dict:
+        return self._seal(0, self._matrix[:self.count], bytes(self._digests), self._roles)
+
+    def _write_state(self):
+        self.store.write_state(MEMORY_FILE, {"model": self.model, "count": self.count, "chunks": self._chunks})
+
+    def _load_state(self, state: Optional[Dict]):
+        self._matrix, self._digests, self._roles, self._chunks = None, bytearray(), "", []
+        if not state or state.get("model") != self.model:
+            return
+        np = _np()
+        try:
+            for chunk in state["chunks"]:
+                if chunk["start"] != self.count:
+                    raise ValueError("index chunks out of order")
+                sealed = json.loads(self.encryption_manager.decrypt(chunk["data"],
+                                                                    self._associated_data(chunk["start"])))
+                vectors = np.frombuffer(base64.b64decode(sealed["vectors"]), dtype="<f4")
+                self._add(vectors.reshape(sealed["shape"]), base64.b64decode(sealed["digests"]), sealed["roles"])
+            self._chunks = list(state["chunks"])
+        except (ValueError, KeyError) as e:
+            # Written under another key or damaged: rebuild it
+            self.last_error = str(e)
+            self._matrix, self._digests, self._roles, self._chunks = None, bytearray(), "", []
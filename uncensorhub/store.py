@@ -0,0 +1,293 @@
+"""
+UncensorHub: Per-user encrypted history stores
+Each user gets a private directory with its own salt and history file.
+Writes are atomic and guarded by advisory file locks so concurrent
+Streamlit sessions on a shared server never clobber each other.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Advisory locking is POSIX-only; elsewhere we fall back to in-process locks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Configuration
+DATA_DIR = os.environ.get("UNCENSORHUB_DATA_DIR", "user_stores")
+HISTORY_FILE = "encrypted_history.json"
+SALT_FILE = ".salt"
+LOCK_FILE = ".lock"
+MANIFEST_FILE = ".manifest.json"
+MEMORY_FILE = ".memory.json"
+STORE_ID_SALT_FILE = ".store_id_salt"
+STORE_ID_ITERATIONS = 100000
+USER_STORE_PREFIX = "u-"
+PASSPHRASE_STORE_PREFIX = "k-"
+
+_store_cache: Dict[str, "HistoryStore"] = {}
+_store_cache_lock = threading.Lock()
+
+
+class HistoryStore:
+    """A single user's encrypted history directory"""
+
+    def __init__(self, directory: str):
+        self._set_directory(directory)
+        # flock() does not serialize threads sharing a descriptor, and is a
+        # no-op without fcntl, so threads of this process also take this lock
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._prefetched: Optional[Tuple[Tuple[int, int, int], List[Dict]]] = None
+        # (file version, parsed records): rereading is skipped until the file is replaced
+        self._records: Optional[Tuple[Optional[Tuple[int, int, int]], List[Dict]]] = None
+
+    def _set_directory(self, directory: str):
+        self.directory = directory
+        self.history_path = os.path.join(directory, HISTORY_FILE)
+        self.salt_path = os.path.join(directory, SALT_FILE)
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+
+    @contextmanager
+    def lock(self, exclusive: bool = True):
+        """Hold the store's advisory lock (shared for readers, exclusive for writers)
+
+        Re-entrant within a thread: nested calls run under the outermost lock,
+        so a read-modify-write sequence takes the exclusive lock first. The
+        directory is created by the first writer, not by opening the store.
+        """
+        with self._thread_lock:
+            if exclusive:
+                os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # Readers of a store nothing was written to yet have nothing to lock
+            if fcntl is None or self._lock_depth or not os.path.isdir(self.directory):
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load_or_create_salt(self) -> bytes:
+        """Load this store's salt, creating it on first use"""
+        with self.lock():
+            if os.path.exists(self.salt_path):
+                with open(self.salt_path, 'rb') as f:
+                    return f.read()
+            salt = os.urandom(16)
+            self._atomic_write(self.salt_path, salt)
+            return salt
+
+    def replace_salt(self, salt: bytes):
+        """Atomically install a new salt (after the history was re-keyed to it)"""
+        with self.lock():
+            self._atomic_write(self.salt_path, salt)
+
+    def exists(self) -> bool:
+        """Whether a history file has been written for this store"""
+        return os.path.exists(self.history_path)
+
+    def read_records(self) -> List[Dict]:
+        """Read the encrypted history records (a list the caller may modify)"""
+        return list(self.shared_records())
+
+    def shared_records(self) -> List[Dict]:
+        """The encrypted history records, shared with other readers: do not modify the list or its records
+
+        The parsed file is kept (encrypted) until another write replaces it,
+        so repeated reads, e.g. switching branches, do not parse it again.
+        """
+        with self.lock(exclusive=False):
+            prefetched, self._prefetched = self._prefetched, None
+            version = self._history_version()
+            if self._records and self._records[0] == version:
+                return self._records[1]
+            if prefetched and prefetched[0] == version:
+                records = prefetched[1]
+            elif version is None:
+                records = []
+            else:
+                with open(self.history_path, 'r') as f:
+                    records = json.load(f)
+            self._records = (version, records)
+            return records
+
+    def record_count(self) -> int:
+        """Number of history records, parsing the file only if another process wrote it since"""
+        return len(self.shared_records())
+
+    def prefetch_records(self):
+        """Read the history ahead of a read_records() call expected shortly (e.g. while a key is derived)
+
+        That call returns these records unless the file was replaced in
+        between; read errors are left for it to report.
+        """
+        try:
+            with self.lock(exclusive=False):
+                if os.path.exists(self.history_path):
+                    version = self._history_version()
+                    with open(self.history_path, 'r') as f:
+                        self._prefetched = (version, json.load(f))
+        except (OSError, ValueError):
+            self._prefetched = None
+
+    def _history_version(self) -> Optional[Tuple[int, int, int]]:
+        """Identifies the history file's contents: every write replaces the file"""
+        try:
+            stat = os.stat(self.history_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def write_records(self, records: List[Dict]) -> int:
+        """Atomically replace the encrypted history records, returning the bytes written"""
+        data = json.dumps(records, indent=2).encode()
+        with self.lock():
+            self._atomic_write(self.history_path, data)
+            self._records = (self._history_version(), list(records))
+        return len(data)
+
+    def append_records(self, records: List[Dict]) -> int:
+        """Atomically append encrypted records to the stored history, returning the bytes written"""
+        with self.lock():
+            existing = self.read_records() + list(records)
+            data = json.dumps(existing, indent=2).encode()
+            self._atomic_write(self.history_path, data)
+            self._records = (self._history_version(), existing)
+        return len(data)
+
+    def read_raw(self) -> Optional[str]:
+        """Read the encrypted history file verbatim (for export)"""
+        with self.lock(exclusive=False):
+            if not os.path.exists(self.history_path):
+                return None
+            with open(self.history_path, 'r') as f:
+                return f.read()
+
+    def write_raw(self, content: str):
+        """Atomically replace the encrypted history file verbatim (for import)"""
+        with self.lock():
+            self._atomic_write(self.history_path, content.encode())
+
+    def read_state(self, name: str) -> Optional[Dict]:
+        """Read a JSON sidecar file kept next to the history (e.g. a checkpoint)"""
+        with self.lock(exclusive=False):
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r') as f:
+                return json.load(f)
+
+    def write_state(self, name: str, state: Dict):
+        """Atomically replace a JSON sidecar file"""
+        with self.lock():
+            self._atomic_write(os.path.join(self.directory, name), json.dumps(state).encode())
+
+    def remove_state(self, name: str):
+        """Delete a JSON sidecar file if present"""
+        with self.lock():
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """Delete the encrypted history file, its manifest and retrieval index, keeping the salt"""
+        with self.lock():
+            if os.path.exists(self.history_path):
+                os.remove(self.history_path)
+            self.remove_state(MANIFEST_FILE)
+            self.remove_state(MEMORY_FILE)
+
+    def _atomic_write(self, path: str, data: bytes):
+        """Write via a temp file and rename so readers never see partial data"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def _load_or_create_store_id_salt(data_dir: str) -> bytes:
+    """Installation-wide salt used only to derive anonymous store ids"""
+    os.makedirs(data_dir, mode=0o700, exist_ok=True)
+    salt_path = os.path.join(data_dir, STORE_ID_SALT_FILE)
+    try:
+        fd = os.open(salt_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(salt_path, 'rb') as f:
+            return f.read()
+    salt = os.urandom(16)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(salt)
+    return salt
+
+
+def derive_store_id(user_id: Optional[str] = None, passphrase: Optional[str] = None,
+                    data_dir: str = DATA_DIR) -> str:
+    """Map a user id, or failing that a passphrase, to a store directory name
+
+    Passphrase-derived ids use PBKDF2 with the same cost as the encryption key,
+    so the directory name is no cheaper to brute-force than the key itself.
+    """
+    if user_id:
+        return USER_STORE_PREFIX + hashlib.sha256(user_id.encode()).hexdigest()[:32]
+    if not passphrase:
+        raise ValueError("A user id or passphrase is required to select a store")
+    salt = _load_or_create_store_id_salt(data_dir)
+    digest = hashlib.pbkdf2_hmac("sha256", passphrase.encode(), salt, STORE_ID_ITERATIONS)
+    return PASSPHRASE_STORE_PREFIX + digest.hex()[:32]
+
+
+def relocate_store(store: HistoryStore, store_id: str):
+    """Move a store to another id in the same data directory (its id derives from a changed passphrase)
+
+    A store already at that id is replaced if it holds no history, e.g. one
+    that only got a salt because someone unlocked with the new passphrase.
+    """
+    directory = os.path.join(os.path.dirname(store.directory), store_id)
+    with _store_cache_lock, store.lock():
+        if os.path.isdir(directory):
+            target = _store_cache.get(directory) or HistoryStore(directory)
+            with target.lock():
+                if target.exists():
+                    raise ValueError("A history store already exists for that passphrase")
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+                os.rmdir(directory)
+        os.rename(store.directory, directory)
+        _store_cache.pop(store.directory, None)
+        store._set_directory(directory)
+        _store_cache[directory] = store
+
+
+def open_store(user_id: Optional[str] = None, passphrase: Optional[str] = None,
+               data_dir: str = DATA_DIR) -> HistoryStore:
+    """Return the (process-wide cached) store for a user id or passphrase"""
+    store_id = derive_store_id(user_id, passphrase, data_dir)
+    directory = os.path.join(data_dir, store_id)
+    with _store_cache_lock:
+        store = _store_cache.get(directory)
+        if store is None:
+            store = HistoryStore(directory)
+            _store_cache[directory] = store
+        return store
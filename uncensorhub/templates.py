@@ -0,0 +1,179 @@
+"""
+UncensorHub: Chat templates for raw text-generation endpoints
+
+The Hugging Face Inference API takes a single prompt string, so the
+conversation has to be rendered in the format the model was fine-tuned on
+(ChatML, Llama 3 or Mistral [INST]); a generic "User:/Assistant:" transcript
+costs tokens and answer quality. Rendered messages are kept in a
+PromptCache, so a new turn renders only the messages added since the last
+one, and the oldest messages are left out once the prompt would exceed the
+model's input budget.
+
+There is no tokenizer dependency: token counts are estimated from the
+text length, erring on the high side.
+"""
+
+import bisect
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from . import config
+
+CHARS_PER_TOKEN = 3.5  # Conservative for English text under these models' tokenizers
+DEFAULT_CONTEXT_TOKENS = 4096
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of text (over- rather than under-estimated)"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+class ChatTemplate:
+    """How one model family expects a conversation to be laid out
+
+    formats maps each role to a format string with a {content} field.
+    Templates without a "system" format fold the system prompt into the
+    first user message. The server's tokenizer adds the BOS token itself.
+    """
+
+    def __init__(self, name: str, formats: Dict[str, str], generation: str = "", stop: Sequence[str] = ()):
+        self.name = name
+        self.formats = formats
+        self.generation = generation
+        self.stop = list(stop)
+
+    def render(self, role: str, content: str) -> str:
+        """One message, in the format of its role (an unknown role is sent as the user's)"""
+        return self.formats.get(role, self.formats["user"]).format(content=content)
+
+    def render_system(self, system: str) -> str:
+        return self.formats["system"].format(content=system) if "system" in self.formats and system else ""
+
+    def strip_stop(self, text: str) -> str:
+        """text without a trailing stop sequence (some servers return the one that ended generation)"""
+        for stop in self.stop:
+            if text.endswith(stop):
+                return text[:-len(stop)]
+        return text
+
+
+TEMPLATES = {
+    "chatml": ChatTemplate("chatml", {
+        "system": "<|im_start|>system\n{content}<|im_end|>\n",
+        "user": "<|im_start|>user\n{content}<|im_end|>\n",
+        "assistant": "<|im_start|>assistant\n{content}<|im_end|>\n",
+    }, generation="<|im_start|>assistant\n", stop=["<|im_end|>"]),
+    "llama3": ChatTemplate("llama3", {
+        "system": "<|start_header_id|>system<|end_header_id|>\n\n{content}<|eot_id|>",
+        "user": "<|start_header_id|>user<|end_header_id|>\n\n{content}<|eot_id|>",
+        "assistant": "<|start_header_id|>assistant<|end_header_id|>\n\n{content}<|eot_id|>",
+    }, generation="<|start_header_id|>assistant<|end_header_id|>\n\n", stop=["<|eot_id|>"]),
+    "mistral": ChatTemplate("mistral", {
+        "user": "[INST] {content} [/INST]",
+        "assistant": " {content}</s>",
+    }),
+    # The transcript format used before templates, for models not listed below
+    "plain": ChatTemplate("plain", {
+        "system": "{content}\n\n",
+        "user": "User: {content}\n",
+        "assistant": "Assistant: {content}\n",
+    }, generation="Assistant:"),
+}
+
+# Template and context window (tokens) of the models offered in INFERENCE_BACKENDS
+MODEL_TEMPLATES: Dict[str, Tuple[str, int]] = {
+    "cognitivecomputations/dolphin-2.9-llama3-8b": ("chatml", 8192),
+    "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO": ("chatml", 32768),
+    "mistralai/Mixtral-8x7B-Instruct-v0.1": ("mistral", 32768),
+    "meta-llama/Meta-Llama-3-8B-Instruct": ("llama3", 8192),
+}
+
+
+def template_for(model: str) -> Tuple[ChatTemplate, int]:
+    """The chat template and context window for a model, guessed from its name if it is not listed"""
+    if model in MODEL_TEMPLATES:
+        name, context_tokens = MODEL_TEMPLATES[model]
+        return TEMPLATES[name], context_tokens
+    lowered = model.lower()
+    if "llama-3" in lowered and "instruct" in lowered:
+        return TEMPLATES["llama3"], 8192
+    if ("mistral" in lowered or "mixtral" in lowered) and "instruct" in lowered:
+        return TEMPLATES["mistral"], 32768
+    if any(name in lowered for name in ("dolphin", "hermes", "qwen")):
+        return TEMPLATES["chatml"], DEFAULT_CONTEXT_TOKENS
+    return TEMPLATES["plain"], DEFAULT_CONTEXT_TOKENS
+
+
+class PromptCache:
+    """The rendered messages of a conversation's last prompt, reused by its next turn
+
+    Keep one per conversation (e.g. in the session); it holds message text,
+    so drop it with the session.
+    """
+
+    def __init__(self):
+        self.template: Optional[str] = None
+        self._keys: List[Tuple[str, str]] = []
+        self._pieces: List[str] = []
+        self._offsets = [0]  # Estimated tokens of the first i pieces
+
+    def update(self, template: ChatTemplate, messages: Sequence[Mapping[str, str]]):
+        """Render the messages that differ from the cached ones"""
+        if template.name != self.template:
+            self.template, self._keys, self._pieces, self._offsets = template.name, [], [], [0]
+        # Strings compare by identity first, so unchanged history costs a pointer check per message
+        keep, limit = 0, min(len(self._keys), len(messages))
+        while keep < limit and self._keys[keep] == (messages[keep]["role"], messages[keep]["content"]):
+            keep += 1
+        del self._keys[keep:], self._pieces[keep:], self._offsets[keep + 1:]
+        for message in messages[keep:]:
+            piece = template.render(message["role"], message["content"])
+            self._keys.append((message["role"], message["content"]))
+            self._pieces.append(piece)
+            self._offsets.append(self._offsets[-1] + estimate_tokens(piece))
+
+    def first_within(self, budget: int) -> int:
+        """Index of the oldest message from which the rest fit in budget tokens"""
+        return bisect.bisect_left(self._offsets, self._offsets[-1] - budget)
+
+    def joined(self, start: int) -> str:
+        return "".join(self._pieces[start:])
+
+
+def render_prompt(template: ChatTemplate, system_prompt: str, messages: Sequence[Mapping[str, str]],
+                  max_input_tokens: int, cache: Optional[PromptCache] = None) -> str:
+    """The prompt for the next reply, leaving out the oldest messages that do not fit max_input_tokens
+
+    System messages at the start of messages (e.g. retrieved earlier turns)
+    join the system prompt. Raises ValueError if not even the newest message
+    fits.
+    """
+    cache = cache if cache is not None else PromptCache()
+    first = 0
+    system = system_prompt
+    while first < len(messages) and messages[first]["role"] == "system":
+        system = f"{system}\n\n{messages[first]['content']}" if system else messages[first]["content"]
+        first += 1
+    conversation = messages[first:]
+    cache.update(template, conversation)
+
+    header = template.render_system(system)
+    folded = bool(system) and not header
+    budget = max_input_tokens - estimate_tokens(header + template.generation)
+    if folded:
+        budget -= estimate_tokens(system)
+    start = cache.first_within(budget)
+    if conversation and (budget <= 0 or start >= len(conversation)):
+        raise ValueError(f"The message is too long for this model's input limit of {max_input_tokens} tokens")
+    # Open with the user's side of a turn; a leading reply without its question only confuses
+    while start < len(conversation) - 1 and conversation[start]["role"] != "user":
+        start += 1
+
+    if folded and conversation:
+        opening = template.render("user", f"{system}\n\n{conversation[start]['content']}")
+        return opening + cache.joined(start + 1) + template.generation
+    return header + cache.joined(start) + template.generation
+
+
+def max_input_tokens(context_tokens: int, max_new_tokens: int) -> int:
+    """Input budget: $UNCENSORHUB_HF_MAX_INPUT_TOKENS, or what the context leaves after the reply"""
+    return config.HF_MAX_INPUT_TOKENS or max(context_tokens - max_new_tokens, 1)
@@ -0,0 +1,113 @@
+"""
+UncensorHub: Unlock pipeline
+
+Unlocking derives the key, reads and decrypts the history and retrieval
+index, and used to leave loading the model to the first chat request. Only
+the decryption needs the key, so unlock() reads the store's files while
+PBKDF2 runs, and start_warm_up() gets the model loading the moment the user
+clicks Unlock: the chat is usable once the slowest of these is done rather
+than after all of them in turn.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from . import metrics
+from .crypto import EncryptionManager
+from .inference import warm_up
+from .messages import MessageStore
+from .rekey import finish_relocation, pending_rekey
+from .retrieval import RetrievalMemory
+from .store import DATA_DIR, MEMORY_FILE, HistoryStore, open_store
+
+
+class WarmUp:
+    """A backend warm-up running in a daemon thread; seconds and error are set once it finished"""
+
+    def __init__(self, backend: str, model: str, custom_url: Optional[str] = None):
+        self.backend = backend
+        self.model = model
+        self.custom_url = custom_url
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._finished = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the warm-up finished (or timeout passed); returns finished"""
+        return self._finished.wait(timeout)
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            warm_up(self.backend, self.model, self.custom_url)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.seconds = time.perf_counter() - started
+            metrics.STAGE_SECONDS.observe(self.seconds, stage="warm_up")
+            self._finished.set()
+
+
+def start_warm_up(backend: str, model: str, custom_url: Optional[str] = None) -> WarmUp:
+    """Warm up a backend in the background; a failure only means the first turn pays for it"""
+    job = WarmUp(backend, model, custom_url)
+    threading.Thread(target=job.run, name="uncensorhub-warm-up", daemon=True).start()
+    return job
+
+
+def _timed(timer: metrics.TurnTimer, stage: str, function, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        timer.add(stage, time.perf_counter() - started)
+
+
+def unlock(passphrase: str, user_id: Optional[str] = None, timer: Optional[metrics.TurnTimer] = None,
+           data_dir: str = DATA_DIR,
+           retrieval: bool = True) -> Tuple[HistoryStore, EncryptionManager, MessageStore, RetrievalMemory]:
+    """Open a user's store and load its history and retrieval index
+
+    The store's files are read while the key is derived, and the index is
+    decrypted alongside the history. An interrupted passphrase change is
+    finished first. Stages are recorded in timer: "kdf", "history_read",
+    "memory_read", "rekey" (if needed), "history_decrypt" and "memory"; the
+    reads overlap "kdf". With retrieval=False the index is not read and the
+    returned memory is disabled. Raises ValueError if the passphrase is wrong
+    or the history cannot be read.
+    """
+    timer = timer if timer is not None else metrics.TurnTimer()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="uncensorhub-unlock") as pool:
+        started = time.perf_counter()
+        store = open_store(user_id=user_id, passphrase=passphrase, data_dir=data_dir)
+        # Take the salt before the reads hold the store's lock
+        finish_relocation(store)
+        salt = store.load_or_create_salt()
+        history_read = pool.submit(_timed, timer, "history_read", store.prefetch_records)
+        memory_read = pool.submit(_timed, timer, "memory_read", store.read_state, MEMORY_FILE) if retrieval else None
+        encryption_manager = EncryptionManager(passphrase, store, salt=salt)
+        timer.add("kdf", time.perf_counter() - started)
+
+        # Finish a passphrase change that was interrupted or is still running
+        job = pending_rekey(store, encryption_manager)
+        if job:
+            with timer.span("rekey"):
+                encryption_manager = job.run()
+        # An index read before a re-key may be stale
+        if retrieval:
+            memory_state = None if job else memory_read.result()
+            memory = pool.submit(_timed, timer, "memory", RetrievalMemory.load, encryption_manager, store,
+                                 state=memory_state)
+        else:
+            memory = pool.submit(RetrievalMemory, encryption_manager, store, model="")
+        history_read.result()
+        with timer.span("history_decrypt"):
+            history = MessageStore.load(encryption_manager, store)
+        metrics.DECRYPT_SECONDS.observe(timer.stages["history_decrypt"])
+        return store, encryption_manager, history, memory.result()